@@ -0,0 +1,204 @@
+# app/aggregation.py
+
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from etl.config import MAX_SCORE, SCORE_BIN_WIDTH
+from app.utils import quantiles_from_counts
+
+QUANTILE_COLUMNS = {"q1": 0.25, "median": 0.5, "q3": 0.75}
+
+
+def _score_grid(n_bins: int) -> np.ndarray:
+    return np.round(np.arange(n_bins) * SCORE_BIN_WIDTH, 2)
+
+
+def merge_subject_stats(
+    stats_df: pd.DataFrame,
+    subject: str,
+    years: List[int],
+    provinces: Optional[List[str]] = None,
+    by: Optional[str] = "tinh_thanh",
+) -> pd.DataFrame:
+    """
+    Gop bang thong ke (nam, tinh_thanh, mon) cho mot tap nam bat ky ma khong doc
+    du lieu goc: cong cac thanh phan cong don (count, sum, sum_sq, histogram) roi
+    tinh lai mean/std (co trong so theo so thi sinh) va Q1/trung vi/Q3 chinh xac.
+    Chi phi O(so tinh x so nam).
+
+    Tra ve moi dong mot gia tri cua `by` (hoac mot dong duy nhat neu by=None) voi
+    cac cot count, mean, std, min, max, q1, median, q3. Bang thong ke cu khong co
+    sum_sq/histogram thi std va phan vi la NaN.
+    """
+    subset = stats_df[(stats_df["mon"] == subject) & (stats_df["nam"].isin(years))]
+    if provinces:
+        subset = subset[subset["tinh_thanh"].isin(provinces)]
+    if subset.empty:
+        return pd.DataFrame(columns=([by] if by else []) + [
+            "count", "mean", "std", "min", "max", *QUANTILE_COLUMNS,
+        ])
+
+    count = subset["count"].to_numpy(dtype=np.float64)
+    if "sum" in subset.columns:
+        total = subset["sum"].to_numpy(dtype=np.float64)
+    else:
+        # sum = mean * count (mean la NaN khi count = 0)
+        total = np.nan_to_num(subset["mean"].to_numpy(dtype=np.float64)) * count
+    has_sum_sq = "sum_sq" in subset.columns
+    total_sq = subset["sum_sq"].to_numpy(dtype=np.float64) if has_sum_sq else np.zeros(len(subset))
+
+    if by:
+        codes, keys = pd.factorize(subset[by], sort=True, use_na_sentinel=False)
+        n_groups = len(keys)
+    else:
+        codes, keys = np.zeros(len(subset), dtype=np.int64), None
+        n_groups = 1
+
+    n = np.bincount(codes, weights=count, minlength=n_groups)
+    s = np.bincount(codes, weights=total, minlength=n_groups)
+    sq = np.bincount(codes, weights=total_sq, minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(n > 0, s / n, np.nan)
+        # Phuong sai mau (ddof=1) tu tong va tong binh phuong
+        var = np.where(n > 1, (sq - n * mean ** 2) / (n - 1), np.nan)
+    std = np.sqrt(np.maximum(var, 0)) if has_sum_sq else np.full(n_groups, np.nan)
+
+    vmin = np.full(n_groups, np.nan)
+    vmax = np.full(n_groups, np.nan)
+    # fmin/fmax bo qua NaN (nhom khong co thi sinh)
+    np.fmin.at(vmin, codes, subset["min"].to_numpy(dtype=np.float64))
+    np.fmax.at(vmax, codes, subset["max"].to_numpy(dtype=np.float64))
+
+    result = pd.DataFrame({
+        "count": n.astype(np.int64),
+        "mean": mean,
+        "std": std,
+        "min": vmin,
+        "max": vmax,
+    })
+
+    quantiles = np.full((n_groups, len(QUANTILE_COLUMNS)), np.nan)
+    if "histogram" in subset.columns:
+        hist_rows = np.stack(subset["histogram"].to_numpy())
+        merged = np.zeros((n_groups, hist_rows.shape[1]), dtype=np.int64)
+        np.add.at(merged, codes, hist_rows)
+        grid = _score_grid(hist_rows.shape[1])
+        for g in range(n_groups):
+            if merged[g].sum() > 0:
+                quantiles[g] = quantiles_from_counts(grid, merged[g], list(QUANTILE_COLUMNS.values()))
+    for i, name in enumerate(QUANTILE_COLUMNS):
+        result[name] = quantiles[:, i]
+
+    if by:
+        result.insert(0, by, keys)
+    return result
+
+
+def _score_step_units(units: np.ndarray) -> int:
+    """
+    Buoc diem cua mot mon tinh theo so o SCORE_BIN_WIDTH (vd. 4 voi mon cham 0.2,
+    5 voi mon cham 0.25): uoc chung lon nhat cua cac muc diem xuat hien.
+    """
+    present = np.flatnonzero(np.bincount(units))
+    step = int(np.gcd.reduce(present)) if len(present) else 0
+    return step or 1
+
+
+def unique_int_rows(codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    np.unique theo dong cho ma tran so nguyen khong am: tra ve (chi so dong dau
+    tien cua moi bo, chi so bo cua tung dong, so dong moi bo), bo xep tang dan.
+
+    Moi dong duoc ghep thanh mot khoa int64 (base = gia tri lon nhat + 1) vi np.unique
+    tren mang 1 chieu nhanh hon nhieu so voi axis=0; neu base ** so cot vuot int64
+    thi dung np.unique(axis=0) de khong bi tran so.
+    """
+    base = int(codes.max()) + 1 if codes.size else 1
+    axis = None
+    if base ** codes.shape[1] <= np.iinfo(np.int64).max:
+        keys = np.zeros(len(codes), dtype=np.int64)
+        for j in range(codes.shape[1]):
+            keys = keys * base + codes[:, j]
+    else:
+        keys, axis = codes, 0
+    _, first, inverse, counts = np.unique(
+        keys, return_index=True, return_inverse=True, return_counts=True, axis=axis
+    )
+    return first, inverse.reshape(-1), counts
+
+
+def bin_score_points(
+    df: pd.DataFrame,
+    subjects: List[str],
+    bin_width: float,
+    cluster_col: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Gop cac diem (moi thi sinh mot diem) vao luoi o vuong/khoi lap phuong canh
+    khoang `bin_width` tren cac cot `subjects`. Moi dong ket qua la mot o: toa do
+    tam o theo tung mon, so_luong thi sinh va mat_do (so thi sinh tren moi muc
+    diem trong o). Neu co `cluster_col` thi them cum chiem da so trong o (cum) va
+    ty le cua cum do (ty_le_cum).
+    So dong ket qua phu thuoc vao luoi diem chu khong phu thuoc so thi sinh.
+
+    Canh o cua moi mon duoc lam tron ve boi so buoc diem cua mon do (0.2 hoac
+    0.25) de moi o chua cung so muc diem; o o bien tren (diem 10) chua it muc
+    hon nen mat_do chia cho so muc diem thuc co trong o.
+    """
+    columns = list(subjects) + (["cum", "ty_le_cum"] if cluster_col else [])
+    mask = df[subjects].notna().all(axis=1).to_numpy()
+    if not mask.any():
+        return pd.DataFrame(columns=columns + ["so_luong", "mat_do"])
+
+    # Doi diem sang so nguyen o SCORE_BIN_WIDTH de chia o chinh xac (khong sai so float)
+    units = np.rint(df[subjects].to_numpy(dtype=np.float64)[mask] / SCORE_BIN_WIDTH).astype(np.int64)
+    max_units = int(round(MAX_SCORE / SCORE_BIN_WIDTH))
+    steps = [_score_step_units(units[:, j]) for j in range(units.shape[1])]
+    widths = [step * max(1, int(round(bin_width / (step * SCORE_BIN_WIDTH)))) for step in steps]
+
+    cells = units // np.array(widths, dtype=np.int64)
+    first, inverse, counts = unique_int_rows(cells)
+
+    result = pd.DataFrame(index=np.arange(len(counts)))
+    n_points = np.ones(len(counts), dtype=np.int64)
+    for j, subject in enumerate(subjects):
+        low = cells[first, j] * widths[j]
+        high = np.maximum(np.minimum(low + widths[j] - steps[j], max_units), low)
+        result[subject] = np.round((low + high) / 2 * SCORE_BIN_WIDTH, 3)
+        n_points *= (high - low) // steps[j] + 1
+    result["so_luong"] = counts
+    result["mat_do"] = counts / n_points
+
+    if cluster_col:
+        labels = df[cluster_col].to_numpy()[mask].astype(np.int64)
+        n_labels = int(labels.max()) + 1
+        per_cluster = np.bincount(
+            inverse * n_labels + labels, minlength=len(counts) * n_labels
+        ).reshape(len(counts), n_labels)
+        majority = per_cluster.argmax(axis=1)
+        result["cum"] = majority
+        result["ty_le_cum"] = per_cluster[np.arange(len(counts)), majority] / counts
+    return result
+
+
+def sum_histogram_cube(
+    cube: pd.DataFrame,
+    subject: str,
+    years: List[int],
+    provinces: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """
+    Cong cac lat cat cua histogram dung san theo bo loc hien tai.
+    Tra ve bang (diem, so_luong) da sap theo diem.
+    """
+    mask = (cube["mon"] == subject) & cube["nam"].isin(years)
+    if provinces:
+        mask &= cube["tinh_thanh"].isin(provinces)
+    return (
+        cube.loc[mask]
+        .groupby("diem", sort=True)["so_luong"]
+        .sum()
+        .reset_index()
+    )
@@ -1,23 +1,101 @@
 # -*- coding: utf-8 -*-
 # app/charts.py
 
+import hashlib
+import json
+from typing import Callable, Optional
+
 import pandas as pd
-import plotly.express as px
+# plotly.express (~0.2 s) chỉ nạp khi vẽ lần đầu qua _px(); graph_objects và io
+# nhẹ và Streamlit cũng đã nạp sẵn
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from etl.instrumentation import stage
+from app.constants import (
+    SUBJECT_LABELS,
+    DEFAULT_SUBJECT_ORDER,
+    COMBINATIONS,
+    COMBINATION_LABELS,
+    FIGURE_CACHE_MAX_MB,
+)
+from app.utils import box_stats_from_counts
+from app.aggregation import bin_score_points, merge_subject_stats, sum_histogram_cube
+from app.lru_cache import LruCache
+
+# Canh ô lưới khi vẽ dạng mật độ: khoảng 0.25 điểm cho 2 môn (tối đa 51 x 51 ô),
+# khoảng 0.5 điểm cho 3 môn (tối đa 26^3 khối) để dữ liệu gửi xuống trình duyệt nhỏ.
+# bin_score_points làm tròn canh ô của từng môn về bội số bước điểm của môn đó
+DENSITY_BIN_WIDTH_2D = 0.25
+DENSITY_BIN_WIDTH_3D = 0.5
+
 
-from app.constants import SUBJECT_LABELS, DEFAULT_SUBJECT_ORDER, COMBINATIONS, COMBINATION_LABELS
+def _px():
+    """plotly.express, nạp ở lần gọi đầu (các lần sau lấy lại từ sys.modules)."""
+    import plotly.express as px
+    return px
 
 
 def get_subject_label(subject: str) -> str:
     return SUBJECT_LABELS.get(subject, subject)
 
 
+# Cache bieu do da tuan tu hoa thanh JSON, gioi han theo so byte. Luu chuoi JSON thay
+# vi doi tuong Figure: gon, khong bi sua ngoai y muon, va dung lai chi ton phan dung
+# lai Figure tu JSON thay vi tinh toan + ve lai
+FIGURE_CACHE: LruCache[str] = LruCache(max_bytes=FIGURE_CACHE_MAX_MB * 1024 ** 2, sizeof=len)
+
+# Danh dau "ham ve tra ve None" (khong du du lieu) de khong phai tinh lai
+_NO_FIGURE = "null"
+
+
+def figure_cache_key(kind: str, fingerprint: str, params: dict) -> str:
+    """
+    Khoa cache bieu do tu (loai bieu do, dau van tay du lieu, tham so).
+    """
+    payload = json.dumps(
+        {"kind": kind, "fingerprint": fingerprint, "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def cached_figure(
+    kind: str,
+    fingerprint: str,
+    params: dict,
+    build: Callable[[], Optional[go.Figure]],
+    cache: LruCache[str] = FIGURE_CACHE,
+) -> Optional[go.Figure]:
+    """
+    Tra ve bieu do tu cache neu cung (kind, fingerprint, params), neu khong thi goi
+    `build()` va luu JSON cua ket qua. `fingerprint` nen la dau van tay re cua du
+    lieu dau vao (vd. app.cluster_cache.data_fingerprint).
+    """
+    key = figure_cache_key(kind, fingerprint, params)
+    with stage(f"figure:{kind}"):
+        payload = cache.get(key)
+        if payload is None:
+            with stage("build"):
+                fig = build()
+            with stage("to_json"):
+                cache.put(key, _NO_FIGURE if fig is None else fig.to_json())
+            return fig
+        if payload == _NO_FIGURE:
+            return None
+        with stage("from_json"):
+            return pio.from_json(payload)
+
+
 def create_histogram(df: pd.DataFrame, subject: str):
     """
     Biểu đồ phân bố điểm theo một môn. Trục Y hiển thị Số thí sinh.
     Tooltip tiếng Việt.
     """
     label = get_subject_label(subject)
-    fig = px.histogram(
+    fig = _px().histogram(
         df,
         x=subject,
         nbins=40,
@@ -36,6 +114,40 @@ def create_histogram(df: pd.DataFrame, subject: str):
     return fig
 
 
+def create_histogram_from_cube(
+    cube: pd.DataFrame,
+    subject: str,
+    years: list[int],
+    provinces: Optional[list[str]] = None,
+):
+    """
+    Biểu đồ phân bố điểm theo một môn từ histogram dựng sẵn: số thí sinh chính xác
+    tại từng mức điểm trên toàn bộ thí sinh (không lấy mẫu).
+    """
+    label = get_subject_label(subject)
+    counts = sum_histogram_cube(cube, subject, years, provinces)
+    if counts.empty:
+        return None
+
+    fig = _px().bar(
+        counts,
+        x="diem",
+        y="so_luong",
+        title=f"Phân bố điểm môn {label}",
+        labels={"diem": f"Điểm môn {label}", "so_luong": "Số thí sinh"},
+    )
+    fig.update_layout(
+        xaxis_title=f"Điểm môn {label}",
+        yaxis_title="Số thí sinh",
+        bargap=0.1,
+    )
+    # Việt hóa tooltip
+    fig.update_traces(
+        hovertemplate="Điểm %{x}<br>Số thí sinh = %{y:,}<extra></extra>"
+    )
+    return fig
+
+
 def create_boxplot_all_subjects(df: pd.DataFrame):
     """
     Boxplot so sánh phân bố điểm giữa các môn.
@@ -48,7 +160,7 @@ def create_boxplot_all_subjects(df: pd.DataFrame):
     long_df = df[cols].melt(var_name="mon", value_name="diem")
     long_df["ten_mon"] = long_df["mon"].map(SUBJECT_LABELS)
 
-    fig = px.box(
+    fig = _px().box(
         long_df,
         x="ten_mon",
         y="diem",
@@ -72,6 +184,65 @@ def create_boxplot_all_subjects(df: pd.DataFrame):
     return fig
 
 
+def create_boxplot_from_cube(
+    cube: pd.DataFrame,
+    years: list[int],
+    provinces: Optional[list[str]] = None,
+):
+    """
+    Boxplot so sánh các môn với Q1/trung vị/Q3/cận tính sẵn từ histogram dựng sẵn:
+    chính xác trên toàn bộ thí sinh, chi phí theo số mức điểm thay vì số dòng.
+    """
+    mask = cube["nam"].isin(years)
+    if provinces:
+        mask &= cube["tinh_thanh"].isin(provinces)
+    counts = cube.loc[mask].groupby(["mon", "diem"], sort=True)["so_luong"].sum()
+
+    names, boxes = [], []
+    for mon in DEFAULT_SUBJECT_ORDER:
+        if mon not in counts.index.get_level_values("mon"):
+            continue
+        subject_counts = counts.loc[mon]
+        subject_counts = subject_counts[subject_counts > 0]
+        if subject_counts.empty:
+            continue
+        names.append(SUBJECT_LABELS.get(mon, mon))
+        boxes.append(box_stats_from_counts(subject_counts.index.to_numpy(), subject_counts.to_numpy()))
+    if not boxes:
+        return None
+
+    fig = go.Figure(
+        go.Box(
+            x=names,
+            q1=[b["q1"] for b in boxes],
+            median=[b["median"] for b in boxes],
+            q3=[b["q3"] for b in boxes],
+            lowerfence=[b["lowerfence"] for b in boxes],
+            upperfence=[b["upperfence"] for b in boxes],
+            boxpoints=False,
+        )
+    )
+    fig.update_layout(
+        title="So sánh phân bố điểm giữa các môn",
+        xaxis_title="Môn học",
+        yaxis_title="Điểm",
+    )
+
+    # Việt hóa tooltip boxplot
+    fig.update_traces(
+        hovertemplate=(
+            "<b>%{x}</b><br>"
+            "Q1: %{q1:.2f}<br>"
+            "Trung vị: %{median:.2f}<br>"
+            "Q3: %{q3:.2f}<br>"
+            "Cận dưới: %{lowerfence:.2f}<br>"
+            "Cận trên: %{upperfence:.2f}"
+            "<extra></extra>"
+        ),
+    )
+    return fig
+
+
 def create_bar_mean_by_province(stats_df: pd.DataFrame, subject: str, years: list[int]):
     """
     Biểu đồ cột điểm trung bình theo tỉnh/thành.
@@ -79,31 +250,27 @@ def create_bar_mean_by_province(stats_df: pd.DataFrame, subject: str, years: lis
     """
     label = get_subject_label(subject)
 
-    subset = stats_df[
-        (stats_df["mon"] == subject) & (stats_df["nam"].isin(years))
-    ].copy()
-    if subset.empty:
+    # Gộp nhiều năm theo trọng số số thí sinh (không lấy trung bình của các trung bình)
+    group = merge_subject_stats(stats_df, subject, years, by="tinh_thanh")
+    group = group[group["count"] > 0].dropna(subset=["tinh_thanh"])
+    if group.empty:
         return None
+    group = group.sort_values("mean", ascending=False)
 
-    # Nếu chọn nhiều năm, lấy trung bình của "điểm trung bình"
-    group = (
-        subset.groupby("tinh_thanh", dropna=False)["mean"]
-        .mean()
-        .reset_index()
-        .sort_values("mean", ascending=False)
-    )
-
-    fig = px.bar(
+    fig = _px().bar(
         group,
         x="tinh_thanh",
         y="mean",
         title=f"Điểm trung bình môn {label} theo tỉnh/thành",
         labels={"tinh_thanh": "Tỉnh/thành", "mean": "Điểm trung bình"},
+        custom_data=["count", "std"],
     )
     fig.update_layout(xaxis_tickangle=60)
     # Tooltip tiếng Việt
     fig.update_traces(
-        hovertemplate="Tỉnh/thành: %{x}<br>Điểm trung bình: %{y:.2f}<extra></extra>"
+        hovertemplate="Tỉnh/thành: %{x}<br>Điểm trung bình: %{y:.2f}<br>"
+                      "Độ lệch chuẩn: %{customdata[1]:.2f}<br>"
+                      "Số thí sinh: %{customdata[0]:,}<extra></extra>"
     )
     return fig
 
@@ -126,7 +293,7 @@ def create_scatter_for_combination(df: pd.DataFrame, combination_code: str):
 
     if len(exist_subjects) == 2:
         s1, s2 = exist_subjects
-        fig = px.scatter(
+        fig = _px().scatter(
             df,
             x=s1,
             y=s2,
@@ -145,7 +312,7 @@ def create_scatter_for_combination(df: pd.DataFrame, combination_code: str):
 
     if len(exist_subjects) >= 3:
         s1, s2, s3 = exist_subjects[:3]
-        fig = px.scatter_3d(
+        fig = _px().scatter_3d(
             df,
             x=s1,
             y=s2,
@@ -178,7 +345,7 @@ def create_scatter_clusters(df: pd.DataFrame, subjects: list[str], cluster_col:
 
     if len(subjects) == 2:
         x, y = subjects
-        fig = px.scatter(
+        fig = _px().scatter(
             df,
             x=x, y=y,
             color=df[cluster_col].astype(str),
@@ -195,7 +362,7 @@ def create_scatter_clusters(df: pd.DataFrame, subjects: list[str], cluster_col:
 
     if len(subjects) >= 3:
         x, y, z = subjects[:3]
-        fig = px.scatter_3d(
+        fig = _px().scatter_3d(
             df,
             x=x, y=y, z=z,
             color=df[cluster_col].astype(str),
@@ -212,3 +379,150 @@ def create_scatter_clusters(df: pd.DataFrame, subjects: list[str], cluster_col:
         return fig
 
     return None
+
+
+def _density_bin_width(n_subjects: int) -> float:
+    return DENSITY_BIN_WIDTH_2D if n_subjects == 2 else DENSITY_BIN_WIDTH_3D
+
+
+def create_density_for_combination(df: pd.DataFrame, combination_code: str):
+    """
+    Như create_scatter_for_combination nhưng gộp thí sinh theo ô lưới điểm:
+    2 môn vẽ heatmap, 3 môn vẽ mỗi khối một điểm có kích thước và màu theo
+    mật độ (số thí sinh trên mỗi mức điểm của ô, để ô ở biên không bị nhạt đi).
+    Dùng được trên toàn bộ dữ liệu, không cần lấy mẫu.
+    """
+    subjects = COMBINATIONS.get(combination_code)
+    if not subjects:
+        return None
+
+    exist_subjects = [s for s in subjects if s in df.columns][:3]
+    if len(exist_subjects) < 2:
+        return None
+
+    labels = {s: get_subject_label(s) for s in exist_subjects}
+    bins = bin_score_points(df, exist_subjects, _density_bin_width(len(exist_subjects)))
+    if bins.empty:
+        return None
+    title = f"Mật độ điểm khối {combination_code}"
+
+    if len(exist_subjects) == 2:
+        s1, s2 = exist_subjects
+        density = bins.pivot(index=s2, columns=s1, values="mat_do")
+        counts = bins.pivot(index=s2, columns=s1, values="so_luong")
+        fig = go.Figure(
+            go.Heatmap(
+                x=density.columns,
+                y=density.index,
+                z=density.to_numpy(),
+                customdata=counts.to_numpy(),
+                colorscale="Viridis",
+                colorbar={"title": "Thí sinh / mức điểm"},
+                hovertemplate=f"Điểm {labels[s1]}: "+"%{x:.2f}<br>"
+                              f"Điểm {labels[s2]}: "+"%{y:.2f}<br>"
+                              "Số thí sinh: %{customdata:,}<extra></extra>",
+            )
+        )
+        fig.update_layout(
+            title=title,
+            xaxis_title=f"Điểm {labels[s1]}",
+            yaxis_title=f"Điểm {labels[s2]}",
+        )
+        return fig
+
+    s1, s2, s3 = exist_subjects
+    fig = _px().scatter_3d(
+        bins,
+        x=s1,
+        y=s2,
+        z=s3,
+        size="mat_do",
+        color="mat_do",
+        size_max=18,
+        title=title,
+        labels={
+            s1: f"Điểm {labels[s1]}",
+            s2: f"Điểm {labels[s2]}",
+            s3: f"Điểm {labels[s3]}",
+            "mat_do": "Thí sinh / mức điểm",
+        },
+        custom_data=["so_luong"],
+    )
+    fig.update_traces(
+        hovertemplate=f"Điểm {labels[s1]}: "+"%{x:.2f}<br>"
+                      f"Điểm {labels[s2]}: "+"%{y:.2f}<br>"
+                      f"Điểm {labels[s3]}: "+"%{z:.2f}<br>"
+                      "Số thí sinh: %{customdata[0]:,}<extra></extra>"
+    )
+    return fig
+
+
+def create_density_clusters(df: pd.DataFrame, subjects: list[str], cluster_col: str = "cum"):
+    """
+    Như create_scatter_clusters nhưng gộp theo ô lưới điểm: mỗi ô một điểm,
+    kích thước theo mật độ thí sinh, màu theo cụm chiếm đa số trong ô.
+    """
+    subjects = [s for s in subjects if s in df.columns][:3]
+    if len(subjects) < 2:
+        return None
+
+    bins = bin_score_points(df, subjects, _density_bin_width(len(subjects)), cluster_col=cluster_col)
+    if bins.empty:
+        return None
+    bins["cum"] = bins["cum"].astype(str)
+
+    labs = {s: SUBJECT_LABELS.get(s, s) for s in subjects}
+    title = "Phân cụm KMeans theo tổ hợp (gộp theo ô điểm)"
+    common = dict(
+        color="cum",
+        size="mat_do",
+        size_max=18 if len(subjects) == 3 else 12,
+        title=title,
+        labels={**labs, "cum": "Cụm"},
+        custom_data=["cum", "so_luong", "ty_le_cum"],
+        category_orders={"cum": sorted(bins["cum"].unique(), key=int)},
+    )
+    hover_tail = ("Số thí sinh: %{customdata[1]:,}<br>"
+                  "Tỷ lệ thuộc cụm: %{customdata[2]:.0%}<extra></extra>")
+
+    if len(subjects) == 2:
+        x, y = subjects
+        fig = _px().scatter(bins, x=x, y=y, **common)
+        fig.update_traces(
+            marker={"symbol": "square"},
+            hovertemplate="Cụm: %{customdata[0]}<br>"
+                          f"{labs[x]}: "+"%{x:.2f}<br>"
+                          f"{labs[y]}: "+"%{y:.2f}<br>" + hover_tail,
+        )
+        return fig
+
+    x, y, z = subjects
+    fig = _px().scatter_3d(bins, x=x, y=y, z=z, **common)
+    fig.update_traces(
+        hovertemplate="Cụm: %{customdata[0]}<br>"
+                      f"{labs[x]}: "+"%{x:.2f}<br>"
+                      f"{labs[y]}: "+"%{y:.2f}<br>"
+                      f"{labs[z]}: "+"%{z:.2f}<br>" + hover_tail
+    )
+    return fig
+
+
+def create_at_least_curve(dist: pd.DataFrame, combination_code: str, threshold: Optional[float] = None):
+    """
+    Đường số thí sinh đạt từ mỗi mức điểm tổ hợp trở lên (từ bảng phân phối đã gộp),
+    kèm đường dọc tại ngưỡng đang chọn.
+    """
+    fig = _px().line(
+        dist,
+        x="diem",
+        y="so_luong_tu_diem",
+        title=f"Số thí sinh đạt từ mỗi mức điểm khối {combination_code} trở lên",
+        labels={"diem": "Điểm tổ hợp", "so_luong_tu_diem": "Số thí sinh"},
+        line_shape="hv",
+    )
+    fig.update_traces(
+        hovertemplate="Từ %{x:.2f} điểm trở lên: %{y:,} thí sinh<extra></extra>"
+    )
+    if threshold is not None:
+        fig.add_vline(x=threshold, line_dash="dash", line_color="red")
+    return fig
@@ -0,0 +1,141 @@
+# app/cluster_cache.py
+
+import hashlib
+import json
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.lru_cache import LruCache
+
+
+class ClusteringResult(NamedTuple):
+    """
+    Ket qua phan cum gon nhe de luu cache: vi tri dong (trong df dau vao),
+    nhan cum tuong ung, tam cum (thang diem goc) va so thi sinh moi cum.
+    """
+    positions: np.ndarray
+    labels: np.ndarray
+    centers: pd.DataFrame
+    counts: np.ndarray
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.positions.nbytes
+            + self.labels.nbytes
+            + self.counts.nbytes
+            + int(self.centers.memory_usage(index=False).sum())
+        )
+
+
+def data_fingerprint(df: pd.DataFrame, columns: List[str], n_probe: int = 4096) -> str:
+    """
+    Dau van tay re cua du lieu dau vao phan cum: so dong, kieu, tong va so gia tri
+    khac NA cua tung cot (mot lan duyet vector hoa) cong voi bam cua toi da
+    `n_probe` dong cach deu. Hai lua chon bo loc khac nhau gan nhu khong the trung.
+    """
+    digest = hashlib.sha1()
+    digest.update(f"{len(df)}|{columns}".encode("utf-8"))
+    if len(df) == 0:
+        return digest.hexdigest()
+
+    values = df[columns]
+    digest.update(str(list(values.dtypes)).encode("utf-8"))
+    digest.update(values.notna().sum().to_numpy(dtype=np.int64).tobytes())
+    digest.update(values.sum(skipna=True).to_numpy(dtype=np.float64).tobytes())
+
+    step = max(len(df) // n_probe, 1)
+    probe = values.iloc[::step]
+    digest.update(pd.util.hash_pandas_object(probe, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def clustering_cache_key(
+    fingerprint: str,
+    subjects: List[str],
+    n_clusters: int,
+    sample_size: Optional[int],
+    random_state: int,
+    engine: str,
+) -> str:
+    """
+    Khoa cache (chuoi hex, dung duoc lam ten file) tu dau van tay va tham so phan cum.
+    """
+    params = {
+        "fingerprint": fingerprint,
+        "subjects": list(subjects),
+        "n_clusters": int(n_clusters),
+        "sample_size": None if sample_size is None else int(sample_size),
+        "random_state": int(random_state),
+        "engine": engine,
+    }
+    payload = json.dumps(params, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(payload).hexdigest()
+
+
+class ClusteringResultCache(LruCache[ClusteringResult]):
+    """
+    Cache LRU gioi han theo so byte cho ket qua phan cum, co the kem kho tren dia
+    (moi khoa mot file .npz trong `disk_dir`) de giu ket qua qua cac lan khoi dong lai.
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: Optional[Path] = None):
+        super().__init__(max_bytes=max_bytes, sizeof=lambda result: result.nbytes)
+        self.disk_dir = Path(disk_dir) if disk_dir is not None else None
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / f"{key}.npz"
+
+    def _load_missing(self, key: str) -> Optional[ClusteringResult]:
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        if not path.exists():
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                centers = pd.DataFrame(data["centers"], columns=[str(c) for c in data["center_columns"]])
+                centers["cum"] = range(len(centers))
+                return ClusteringResult(
+                    positions=data["positions"],
+                    labels=data["labels"],
+                    centers=centers,
+                    counts=data["counts"],
+                )
+        except (OSError, ValueError, KeyError):
+            # File hong thi coi nhu chua co, se tinh lai
+            return None
+
+    def _save_to_disk(self, key: str, result: ClusteringResult) -> None:
+        if self.disk_dir is None:
+            return
+        center_columns = [c for c in result.centers.columns if c != "cum"]
+        try:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.disk_dir / f"{key}.tmp.npz"
+            np.savez(
+                tmp_path,
+                positions=result.positions,
+                labels=result.labels,
+                centers=result.centers[center_columns].to_numpy(dtype=np.float64),
+                center_columns=np.array(center_columns, dtype=str),
+                counts=result.counts,
+            )
+            tmp_path.replace(self._disk_path(key))
+        except OSError:
+            # Khong ghi duoc (vd. thu muc chi doc) thi chi dung cache trong bo nho
+            pass
+
+    def put(self, key: str, result: ClusteringResult) -> None:
+        with self._lock:
+            super().put(key, result)
+            self._save_to_disk(key, result)
+
+    def clear(self) -> None:
+        """
+        Xoa cache trong bo nho (khong xoa file tren dia).
+        """
+        super().clear()
@@ -1,53 +1,419 @@
 # -*- coding: utf-8 -*-
 # app/clustering.py
 
+import numpy as np
 import pandas as pd
-from typing import List, Tuple
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
+from typing import TYPE_CHECKING, Iterator, List, Optional, Tuple
 
-def kmeans_cluster(
+from etl.config import SCORE_BIN_WIDTH
+from app.aggregation import unique_int_rows
+from app.cluster_cache import (
+    ClusteringResult,
+    ClusteringResultCache,
+    clustering_cache_key,
+    data_fingerprint,
+)
+
+# sklearn nạp mất hơn 1 s nên chỉ import trong các hàm phân cụm, khi người dùng
+# mở tab Phân cụm lần đầu, không phải lúc khởi động ứng dụng
+if TYPE_CHECKING:
+    from sklearn.preprocessing import StandardScaler
+
+# Các cách phân cụm:
+# - "kmeans": KMeans đầy đủ (n_init=10) trên một mẫu
+# - "minibatch": MiniBatchKMeans, chạy được trên toàn bộ dữ liệu đã lọc,
+#   khởi tạo từ tâm cụm lần trước và trả kết quả dần sau mỗi vòng
+# - "dedup": gộp các bộ điểm trùng nhau, KMeans có trọng số trên các bộ điểm
+#   duy nhất rồi gán lại nhãn: chính xác trên toàn bộ dữ liệu, không lấy mẫu
+CLUSTERING_ENGINES = ("kmeans", "minibatch", "dedup")
+
+# Số dòng mỗi lô khi gán nhãn cho toàn bộ dữ liệu bằng predict()
+PREDICT_BATCH_SIZE = 100_000
+
+
+def _use_columns(df: pd.DataFrame, subjects: List[str]) -> List[str]:
+    use_cols = [c for c in subjects if c in df.columns]
+    if len(use_cols) < 2:
+        raise ValueError("Cần ít nhất hai môn để phân cụm.")
+    return use_cols
+
+
+def _valid_positions(df: pd.DataFrame, use_cols: List[str]) -> np.ndarray:
+    """
+    Vị trí (theo thứ tự dòng) các thí sinh có đủ điểm các môn.
+    """
+    return np.flatnonzero(df[use_cols].notna().all(axis=1).to_numpy())
+
+
+def _sample_positions(
+    positions: np.ndarray,
+    sample_size: Optional[int],
+    random_state: int,
+) -> np.ndarray:
+    if sample_size is None or len(positions) <= sample_size:
+        return positions
+    rng = np.random.default_rng(random_state)
+    return np.sort(rng.choice(positions, size=sample_size, replace=False))
+
+
+def _centers_frame(scaler: "StandardScaler", centers: np.ndarray, use_cols: List[str]) -> pd.DataFrame:
+    # Tâm cụm theo thang đo gốc để đọc dễ hơn
+    centers_df = pd.DataFrame(scaler.inverse_transform(centers), columns=use_cols)
+    centers_df["cum"] = range(len(centers_df))
+    return centers_df
+
+
+def _predict_in_batches(
+    km,
+    scaler: "StandardScaler",
+    df: pd.DataFrame,
+    use_cols: List[str],
+    positions: np.ndarray,
+    batch_size: int = PREDICT_BATCH_SIZE,
+) -> np.ndarray:
+    """
+    Gán nhãn cho các dòng `positions` theo từng lô: bộ nhớ tạm chỉ cỡ một lô
+    thay vì một ma trận chuẩn hóa của toàn bộ dữ liệu.
+    """
+    labels = np.empty(len(positions), dtype=np.int16)
+    for start in range(0, len(positions), batch_size):
+        batch = positions[start:start + batch_size]
+        X = scaler.transform(df[use_cols].iloc[batch].to_numpy(dtype=np.float64))
+        labels[start:start + batch_size] = km.predict(X)
+    return labels
+
+
+def _make_result(positions: np.ndarray, labels: np.ndarray, centers_df: pd.DataFrame) -> ClusteringResult:
+    labels = labels.astype(np.int16, copy=False)
+    return ClusteringResult(
+        positions=positions.astype(np.int64, copy=False),
+        labels=labels,
+        centers=centers_df,
+        counts=np.bincount(labels, minlength=len(centers_df)).astype(np.int64),
+    )
+
+
+def clustered_frame(df: pd.DataFrame, result: ClusteringResult) -> pd.DataFrame:
+    """
+    Các dòng đã phân cụm của df kèm cột 'cum' (nhãn gán theo vị trí dòng).
+    """
+    return df.iloc[result.positions].assign(cum=result.labels)
+
+
+def fit_kmeans(
     df: pd.DataFrame,
     subjects: List[str],
     n_clusters: int = 4,
-    sample_size: int = 50000,
+    sample_size: Optional[int] = 50000,
     random_state: int = 42,
-) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    predict_all: bool = False,
+) -> ClusteringResult:
     """
-    Chạy KMeans trên các cột 'subjects'. Trả về:
-    - df_out: bản sao df có thêm cột 'cum' (nhãn cụm)
-    - centers_df: tọa độ tâm cụm ở hệ gốc (đã inverse scale) để tham khảo
+    KMeans đầy đủ (n_init=10) trên tối đa `sample_size` thí sinh đủ điểm.
+    predict_all=True: sau khi học tâm cụm trên mẫu thì gán nhãn cho toàn bộ
+    thí sinh đủ điểm bằng predict() theo lô, số lượng mỗi cụm là chính xác.
     """
-    # Chỉ lấy các cột cần thiết và loại NA trên các môn
-    use_cols = [c for c in subjects if c in df.columns]
-    if len(use_cols) < 2:
-        raise ValueError("Cần ít nhất hai môn để phân cụm.")
-
-    work = df[use_cols].dropna().copy()
-    if work.empty:
+    use_cols = _use_columns(df, subjects)
+    valid = _valid_positions(df, use_cols)
+    if len(valid) == 0:
         raise ValueError("Không có dữ liệu hợp lệ để phân cụm.")
 
+    from sklearn.cluster import KMeans
+    from sklearn.preprocessing import StandardScaler
+
     # Lấy mẫu để tránh quá nặng
-    if len(work) > sample_size:
-        work = work.sample(n=sample_size, random_state=random_state)
+    positions = _sample_positions(valid, sample_size, random_state)
 
     # Chuẩn hóa
     scaler = StandardScaler()
-    X = scaler.fit_transform(work[use_cols].values)
+    X = scaler.fit_transform(df[use_cols].iloc[positions].to_numpy(dtype=np.float64))
 
     # KMeans
     km = KMeans(n_clusters=n_clusters, n_init=10, random_state=random_state)
     labels = km.fit_predict(X)
+    centers_df = _centers_frame(scaler, km.cluster_centers_, use_cols)
+
+    if predict_all and len(positions) < len(valid):
+        positions = valid
+        labels = _predict_in_batches(km, scaler, df, use_cols, valid)
+    return _make_result(positions, labels, centers_df)
+
+
+def unique_score_tuples(
+    df: pd.DataFrame,
+    use_cols: List[str],
+    positions: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Gộp các bộ điểm giống nhau của các dòng `positions`.
+    Trả về (các bộ điểm duy nhất, số thí sinh mỗi bộ, chỉ số bộ điểm của từng dòng).
+
+    Điểm nằm trên lưới SCORE_BIN_WIDTH nên mỗi môn được đổi thành số nguyên bước lưới
+    rồi gộp bằng unique_int_rows (ghép khóa int64 khi không tràn số), nhanh hơn
+    nhiều so với np.unique(axis=0) trên số thực.
+    """
+    values = df[use_cols].iloc[positions].to_numpy(dtype=np.float64)
+    steps = np.rint(values / SCORE_BIN_WIDTH).astype(np.int64)
+    first, inverse, counts = unique_int_rows(steps)
+    return values[first], counts, inverse
+
+
+def fit_kmeans_dedup(
+    df: pd.DataFrame,
+    subjects: List[str],
+    n_clusters: int = 4,
+    random_state: int = 42,
+) -> ClusteringResult:
+    """
+    KMeans (n_init=10) trên toàn bộ thí sinh đủ điểm, nhưng chỉ chạy trên các bộ
+    điểm duy nhất với sample_weight là số thí sinh có bộ điểm đó. Kết quả tương
+    đương phân cụm từng thí sinh, chi phí theo số bộ điểm thay vì số dòng.
+    """
+    use_cols = _use_columns(df, subjects)
+    positions = _valid_positions(df, use_cols)
+    if len(positions) == 0:
+        raise ValueError("Không có dữ liệu hợp lệ để phân cụm.")
+
+    unique_values, weights, inverse = unique_score_tuples(df, use_cols, positions)
+    if len(unique_values) < n_clusters:
+        raise ValueError("Số bộ điểm khác nhau ít hơn số cụm.")
+
+    from sklearn.cluster import KMeans
+    from sklearn.preprocessing import StandardScaler
+
+    # Chuẩn hóa theo phân bố của toàn bộ thí sinh (có trọng số)
+    scaler = StandardScaler()
+    X = scaler.fit_transform(unique_values, sample_weight=weights)
+
+    km = KMeans(n_clusters=n_clusters, n_init=10, random_state=random_state)
+    unique_labels = km.fit_predict(X, sample_weight=weights)
+    centers_df = _centers_frame(scaler, km.cluster_centers_, use_cols)
+    return _make_result(positions, unique_labels[inverse], centers_df)
+
+
+def kmeans_cluster(
+    df: pd.DataFrame,
+    subjects: List[str],
+    n_clusters: int = 4,
+    sample_size: Optional[int] = 50000,
+    random_state: int = 42,
+    engine: str = "kmeans",
+    init_centers: Optional[pd.DataFrame] = None,
+    predict_all: bool = False,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Chạy KMeans trên các cột 'subjects'. Trả về:
+    - df_out: các dòng của df đã được phân cụm, thêm cột 'cum' (nhãn cụm)
+    - centers_df: tọa độ tâm cụm ở hệ gốc (đã inverse scale) để tham khảo
+
+    engine="minibatch" dùng iter_minibatch_results và trả về kết quả cuối cùng
+    (sample_size=None: dùng toàn bộ dữ liệu).
+    engine="dedup" phân cụm toàn bộ dữ liệu qua các bộ điểm duy nhất (bỏ qua sample_size).
+    predict_all=True: gán nhãn cho toàn bộ thí sinh đủ điểm, không chỉ mẫu.
+    """
+    result = run_clustering(
+        df,
+        subjects,
+        n_clusters=n_clusters,
+        sample_size=sample_size,
+        random_state=random_state,
+        engine=engine,
+        init_centers=init_centers,
+        predict_all=predict_all,
+    )
+    return clustered_frame(df, result), result.centers
+
 
-    # Gắn nhãn vào bản ghi tương ứng
-    work = work.assign(cum=labels)
+def run_clustering(
+    df: pd.DataFrame,
+    subjects: List[str],
+    n_clusters: int = 4,
+    sample_size: Optional[int] = 50000,
+    random_state: int = 42,
+    engine: str = "kmeans",
+    init_centers: Optional[pd.DataFrame] = None,
+    predict_all: bool = False,
+) -> ClusteringResult:
+    if engine not in CLUSTERING_ENGINES:
+        raise ValueError(f"Cách phân cụm không hợp lệ: {engine}")
+    if engine == "kmeans":
+        return fit_kmeans(
+            df,
+            subjects,
+            n_clusters=n_clusters,
+            sample_size=sample_size,
+            random_state=random_state,
+            predict_all=predict_all,
+        )
+    if engine == "dedup":
+        return fit_kmeans_dedup(df, subjects, n_clusters=n_clusters, random_state=random_state)
 
-    # Tính tâm cụm theo thang đo gốc để đọc dễ hơn
-    centers = scaler.inverse_transform(km.cluster_centers_)
-    centers_df = pd.DataFrame(centers, columns=use_cols)
-    centers_df["cum"] = range(n_clusters)
+    result = None
+    for result, _ in iter_minibatch_results(
+        df,
+        subjects,
+        n_clusters=n_clusters,
+        sample_size=sample_size,
+        random_state=random_state,
+        init_centers=init_centers,
+        predict_all=predict_all,
+    ):
+        pass
+    return result
+
+
+def _warm_start_init(
+    init_centers: Optional[pd.DataFrame],
+    use_cols: List[str],
+    n_clusters: int,
+    scaler: "StandardScaler",
+):
+    """
+    Đưa tâm cụm lần trước (thang điểm gốc) về hệ đã chuẩn hóa để khởi tạo.
+    Không khớp số cụm/môn thì quay về k-means++.
+    """
+    if init_centers is None or len(init_centers) != n_clusters:
+        return "k-means++"
+    if not all(c in init_centers.columns for c in use_cols):
+        return "k-means++"
+    values = init_centers[use_cols].to_numpy(dtype=np.float64)
+    if not np.isfinite(values).all():
+        return "k-means++"
+    return scaler.transform(values)
 
-    # Gộp lại với df gốc để còn dùng các cột khác nếu cần
-    df_out = df.merge(work[use_cols + ["cum"]], how="inner", on=use_cols)
 
-    return df_out, centers_df
+def iter_minibatch_results(
+    df: pd.DataFrame,
+    subjects: List[str],
+    n_clusters: int = 4,
+    sample_size: Optional[int] = None,
+    random_state: int = 42,
+    init_centers: Optional[pd.DataFrame] = None,
+    batch_size: int = 8192,
+    max_epochs: int = 10,
+    tol: float = 1e-3,
+    predict_all: bool = False,
+) -> Iterator[Tuple[ClusteringResult, int]]:
+    """
+    Phân cụm MiniBatchKMeans theo từng vòng (epoch) qua dữ liệu.
+    Sau mỗi vòng trả về (kết quả, số vòng) để giao diện vẽ ngay kết quả
+    sơ bộ rồi tinh chỉnh dần; dừng khi tâm cụm dịch chuyển ít hơn `tol`
+    (trong hệ đã chuẩn hóa) hoặc đủ `max_epochs` vòng.
+
+    - sample_size=None: phân cụm toàn bộ thí sinh đủ điểm (mặc định)
+    - init_centers: tâm cụm lần trước (thang điểm gốc, cột theo môn) để khởi động ấm
+    - predict_all: khi có lấy mẫu, gán nhãn cho toàn bộ thí sinh đủ điểm theo lô
+    """
+    use_cols = _use_columns(df, subjects)
+    valid = _valid_positions(df, use_cols)
+    positions = _sample_positions(valid, sample_size, random_state)
+    if len(positions) < n_clusters:
+        raise ValueError("Không có dữ liệu hợp lệ để phân cụm.")
+    predict_all = predict_all and len(positions) < len(valid)
+
+    from sklearn.cluster import MiniBatchKMeans
+    from sklearn.preprocessing import StandardScaler
+
+    X = df[use_cols].iloc[positions].to_numpy(dtype=np.float64)
+    scaler = StandardScaler()
+    X = scaler.fit_transform(X)
+
+    init = _warm_start_init(init_centers, use_cols, n_clusters, scaler)
+    km = MiniBatchKMeans(
+        n_clusters=n_clusters,
+        init=init,
+        n_init=1,
+        batch_size=batch_size,
+        random_state=random_state,
+    )
+
+    # Lô đầu tiên phải có ít nhất n_clusters điểm
+    batch_size = max(batch_size, n_clusters)
+    rng = np.random.default_rng(random_state)
+    previous = None
+    for epoch in range(1, max_epochs + 1):
+        order = rng.permutation(len(X))
+        for start in range(0, len(X), batch_size):
+            km.partial_fit(X[order[start:start + batch_size]])
+
+        centers = km.cluster_centers_.copy()
+        shift = np.inf if previous is None else np.abs(centers - previous).max()
+        previous = centers
+        converged = shift < tol or epoch == max_epochs
+
+        centers_df = _centers_frame(scaler, centers, use_cols)
+        if predict_all and converged:
+            # Chỉ gán nhãn toàn bộ ở vòng cuối, các vòng sơ bộ dùng mẫu
+            labels = _predict_in_batches(km, scaler, df, use_cols, valid)
+            yield _make_result(valid, labels, centers_df), epoch
+        else:
+            yield _make_result(positions, km.predict(X), centers_df), epoch
+
+        if converged:
+            break
+
+
+def iter_minibatch_kmeans(
+    df: pd.DataFrame,
+    subjects: List[str],
+    **kwargs,
+) -> Iterator[Tuple[pd.DataFrame, pd.DataFrame, int]]:
+    """
+    Như iter_minibatch_results nhưng trả về (df_out, centers_df, số vòng).
+    """
+    for result, epoch in iter_minibatch_results(df, subjects, **kwargs):
+        yield clustered_frame(df, result), result.centers, epoch
+
+
+def clustering_key_for(
+    df: pd.DataFrame,
+    subjects: List[str],
+    n_clusters: int,
+    sample_size: Optional[int],
+    random_state: int,
+    engine: str,
+    predict_all: bool = False,
+) -> str:
+    use_cols = [c for c in subjects if c in df.columns]
+    # Đánh dấu predict_all trong engine để không dùng nhầm kết quả chỉ có nhãn của mẫu
+    return clustering_cache_key(
+        data_fingerprint(df, use_cols),
+        use_cols,
+        n_clusters=n_clusters,
+        sample_size=sample_size,
+        random_state=random_state,
+        engine=f"{engine}+all" if predict_all else engine,
+    )
+
+
+def cached_kmeans_cluster(
+    df: pd.DataFrame,
+    subjects: List[str],
+    cache: ClusteringResultCache,
+    n_clusters: int = 4,
+    sample_size: Optional[int] = 50000,
+    random_state: int = 42,
+    engine: str = "kmeans",
+    init_centers: Optional[pd.DataFrame] = None,
+    predict_all: bool = False,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Như kmeans_cluster nhưng nhớ kết quả theo (dấu vân tay dữ liệu, tham số):
+    cùng một yêu cầu sẽ trả về ngay, kể cả ở phiên khác hoặc sau khi khởi động lại
+    (nếu cache có kho trên đĩa). init_centers chỉ dùng khi chưa có trong cache.
+    """
+    key = clustering_key_for(df, subjects, n_clusters, sample_size, random_state, engine, predict_all)
+    result = cache.get(key)
+    if result is None:
+        result = run_clustering(
+            df,
+            subjects,
+            n_clusters=n_clusters,
+            sample_size=sample_size,
+            random_state=random_state,
+            engine=engine,
+            init_centers=init_centers,
+            predict_all=predict_all,
+        )
+        cache.put(key, result)
+    return clustered_frame(df, result), result.centers
@@ -1,7 +1,33 @@
 # app/constants.py
 
+import os
+
 from etl.config import SUBJECT_COLUMNS, COMBINATION_DEFINITIONS
 
+# Cach nap du lieu chinh (bien moi truong THPT_DATA_BACKEND):
+# - "shared": memory-map ban Arrow, moi phien/tien trinh dung chung mot vung nho
+# - "dataset": doc tu bo du lieu phan vung, day bo loc nam/tinh xuong pyarrow
+# - "parquet": doc toan bo file Parquet (st.cache_data, moi phien mot ban sao)
+# - "auto": chon cach tot nhat theo cac file ETL da tao
+DATA_BACKEND = os.environ.get("THPT_DATA_BACKEND", "auto")
+
+# Dung luong toi da (MB) cua cache ket qua loc dung chung giua cac phien
+FILTER_CACHE_MAX_MB = int(os.environ.get("THPT_FILTER_CACHE_MB", "256"))
+
+# Cache ket qua phan cum: dung luong toi da trong bo nho (MB) va co luu xuong
+# data_processed/ de giu qua cac lan khoi dong lai hay khong ("0" de tat)
+CLUSTER_CACHE_MAX_MB = int(os.environ.get("THPT_CLUSTER_CACHE_MB", "128"))
+CLUSTER_CACHE_ON_DISK = os.environ.get("THPT_CLUSTER_CACHE_DISK", "1") != "0"
+
+# Dung luong toi da (MB) cua cache bieu do (JSON da tuan tu hoa) dung chung giua cac phien
+FIGURE_CACHE_MAX_MB = int(os.environ.get("THPT_FIGURE_CACHE_MB", "64"))
+
+# Do thoi gian/bo nho tung buoc moi lan chay lai (etl/instrumentation.py):
+# ghi mot dong JSON ra stderr moi lan ("0" de tat) va hien bang do trong sidebar
+# (bat bang bien moi truong hoac them ?debug=1 vao URL)
+PERF_LOG_ENABLED = os.environ.get("THPT_PERF_LOG", "1") != "0"
+DEBUG_PANEL_ENABLED = os.environ.get("THPT_DEBUG_PANEL", "0") == "1"
+
 # Nhan tieng Viet cho cac mon
 SUBJECT_LABELS = {
     "toan": "Toán",
@@ -1,17 +1,61 @@
 # app/data_access.py
 
-from typing import List, Optional, Tuple
+from typing import Hashable, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
 import streamlit as st
 
-from etl.config import MAIN_DATA_FILE, AGG_SUBJECT_PROVINCE_FILE
-from app.constants import DEFAULT_SUBJECT_ORDER
+from etl.config import (
+    MAIN_DATA_FILE,
+    MAIN_ARROW_FILE,
+    MAIN_DATASET_DIR,
+    AGG_SUBJECT_PROVINCE_FILE,
+    HISTOGRAM_CUBE_FILE,
+    ROW_OFFSETS_FILE,
+    CLUSTER_CACHE_DIR,
+    COMBINATION_CDF_FILE,
+)
+from etl.preprocess import file_signature, open_main_dataset, read_row_offsets
+from etl.schema import output_arrow_schema
+from etl.province_mapping import MA_TINH_TO_TEN
+from app.constants import (
+    DEFAULT_SUBJECT_ORDER,
+    DATA_BACKEND,
+    FILTER_CACHE_MAX_MB,
+    CLUSTER_CACHE_MAX_MB,
+    CLUSTER_CACHE_ON_DISK,
+)
+from app.cluster_cache import ClusteringResultCache
+from app.score_lookup import CombinationScoreLookup
+from app.filter_cache import FilterResultCache, is_superset_key, normalize_filter_key
 
-@st.cache_data
-def load_main_dataset() -> pd.DataFrame:
+TEN_TO_MA_TINH = {ten: ma for ma, ten in MA_TINH_TO_TEN.items()}
+
+# Dinh danh cua mot phien ban du lieu chinh: (duong dan file, kich thuoc, mtime_ns)
+DatasetVersion = Tuple[str, int, int]
+
+
+def main_dataset_version(backend: str) -> DatasetVersion:
+    """
+    Dinh danh on dinh cua file du lieu chinh ma `backend` se nap: giu nguyen qua
+    cac lan chay lai, doi khi ETL ghi lai file. Dung lam khoa cho cac loader va
+    cho cache ket qua loc (thay cho id() cua DataFrame).
+    """
+    path = MAIN_ARROW_FILE if backend == "shared" else MAIN_DATA_FILE
+    if not path.exists():
+        return (str(path), -1, -1)
+    signature = file_signature(path)
+    return (str(path), signature["size"], signature["mtime_ns"])
+
+
+@st.cache_data(max_entries=1)
+def load_main_dataset(version: Optional[DatasetVersion] = None) -> pd.DataFrame:
     """
-    Doc du lieu diem thi da xu ly tu file Parquet.
+    Doc du lieu diem thi da xu ly tu file Parquet. `version` (main_dataset_version)
+    chi lam khoa cache: file doi thi doc lai.
     """
     if not MAIN_DATA_FILE.exists():
         raise RuntimeError(
@@ -21,6 +65,78 @@ def load_main_dataset() -> pd.DataFrame:
     return df
 
 
+@st.cache_resource(max_entries=1)
+def load_main_dataset_shared(version: Optional[DatasetVersion] = None) -> pd.DataFrame:
+    """
+    Memory-map ban Arrow cua du lieu chinh va dung DataFrame tro thang vao do
+    (khong sao chep cac cot diem). st.cache_resource tra ve cung mot doi tuong
+    cho moi phien, con cac tien trinh khac cung map file se dung chung trang nho
+    cua he dieu hanh. DataFrame nay chi doc, khong duoc sua tai cho.
+    `version` chi lam khoa cache nhu load_main_dataset.
+    """
+    if not MAIN_ARROW_FILE.exists():
+        raise RuntimeError(
+            f"Khong tim thay file {MAIN_ARROW_FILE}. Hay chay ETL truoc khi chay ung dung."
+        )
+    source = pa.memory_map(str(MAIN_ARROW_FILE), "r")
+    table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def resolve_data_backend() -> str:
+    """
+    Chon cach nap du lieu chinh theo DATA_BACKEND; "auto" uu tien ban Arrow
+    dung chung, sau do bo du lieu phan vung, cuoi cung la file Parquet.
+    """
+    if DATA_BACKEND != "auto":
+        return DATA_BACKEND
+    if MAIN_ARROW_FILE.exists():
+        return "shared"
+    if main_dataset_available():
+        return "dataset"
+    return "parquet"
+
+
+def main_dataset_available() -> bool:
+    """
+    Kiem tra ETL da tao bo du lieu phan vung (nam=YYYY/...) hay chua.
+    """
+    return MAIN_DATASET_DIR.exists() and any(MAIN_DATASET_DIR.glob("nam=*"))
+
+
+@st.cache_resource
+def _get_main_dataset() -> ds.Dataset:
+    return open_main_dataset(MAIN_DATASET_DIR)
+
+
+def build_dataset_filter(years: List[int], provinces: Optional[List[str]] = None) -> ds.Expression:
+    """
+    Chuyen lua chon nam/tinh tren sidebar thanh bieu thuc loc cua pyarrow.dataset.
+    Tinh thanh duoc doi sang ma_tinh de tan dung phan vung va thong ke row group.
+    """
+    expr = ds.field("nam").isin(list(years))
+    if provinces:
+        codes = [TEN_TO_MA_TINH[p] for p in provinces if p in TEN_TO_MA_TINH]
+        expr = expr & ds.field("ma_tinh").isin(codes)
+    return expr
+
+
+@st.cache_data
+def load_filtered_dataset(
+    years: Tuple[int, ...],
+    provinces: Tuple[str, ...] = (),
+) -> pd.DataFrame:
+    """
+    Doc tu bo du lieu phan vung chi nhung nam/tinh duoc chon (day bo loc xuong
+    pyarrow.dataset), thay vi doc toan bo roi moi loc.
+    """
+    dataset = _get_main_dataset()
+    table = dataset.to_table(filter=build_dataset_filter(list(years), list(provinces)))
+    schema = output_arrow_schema()
+    table = table.select(schema.names).cast(schema)
+    return table.to_pandas()
+
+
 @st.cache_data
 def load_agg_subject_province() -> pd.DataFrame:
     """
@@ -34,15 +150,126 @@ def load_agg_subject_province() -> pd.DataFrame:
     return df
 
 
+@st.cache_data
+def load_histogram_cube() -> Optional[pd.DataFrame]:
+    """
+    Doc histogram dung san (so thi sinh theo nam, tinh, mon, diem).
+    Tra ve None neu ETL chua tao file nay.
+    """
+    if not HISTOGRAM_CUBE_FILE.exists():
+        return None
+    return pd.read_parquet(HISTOGRAM_CUBE_FILE)
+
+
+@st.cache_resource
+def get_combination_lookup() -> Optional[CombinationScoreLookup]:
+    """
+    Bo tra cuu phan phoi diem to hop (dung chung cho moi phien).
+    Tra ve None neu ETL chua tao file phan phoi to hop.
+    """
+    if not COMBINATION_CDF_FILE.exists():
+        return None
+    return CombinationScoreLookup(pd.read_parquet(COMBINATION_CDF_FILE))
+
+
+@st.cache_data
+def load_row_offsets() -> Optional[pd.DataFrame]:
+    """
+    Doc chi muc doan dong (nam, ma_tinh) -> [start, stop) cua du lieu chinh.
+    Tra ve None neu ETL chua tao file nay hoac chi muc khong con khop voi
+    MAIN_DATA_FILE (file du lieu da bi ghi lai sau khi lap chi muc).
+    """
+    return read_row_offsets(ROW_OFFSETS_FILE, MAIN_DATA_FILE)
+
+
+def offsets_match(df: pd.DataFrame, offsets: Optional[pd.DataFrame]) -> bool:
+    """
+    Chi muc chi dung duoc cho dung du lieu da lap chi muc: cac doan phai phu kin
+    df va (nam, ma_tinh) o dong dau, dong cuoi moi doan phai trung voi chi muc.
+    Chi kiem tra 2 dong moi doan nen chi phi khong phu thuoc so dong.
+    """
+    if offsets is None or offsets.empty:
+        return False
+    starts = offsets["start"].to_numpy()
+    stops = offsets["stop"].to_numpy()
+    if starts[0] != 0 or stops[-1] != len(df) or (starts[1:] != stops[:-1]).any():
+        return False
+
+    probe = np.concatenate([starts, stops - 1])
+    nam = df["nam"].to_numpy()[probe]
+    if not np.array_equal(nam, np.tile(offsets["nam"].to_numpy(), 2)):
+        return False
+    ma_tinh = offsets["ma_tinh"].astype("category")
+    probe_codes = pd.Categorical(df["ma_tinh"].iloc[probe], categories=ma_tinh.cat.categories).codes
+    return np.array_equal(probe_codes, np.tile(ma_tinh.cat.codes.to_numpy(), 2))
+
+
+def _merged_ranges(
+    offsets: pd.DataFrame,
+    years: List[int],
+    provinces: Optional[List[str]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    selected = offsets[offsets["nam"].isin(years)]
+    if provinces:
+        selected = selected[selected["tinh_thanh"].isin(provinces)]
+    selected = selected.sort_values("start")
+    starts = selected["start"].to_numpy()
+    stops = selected["stop"].to_numpy()
+    if len(starts) > 1:
+        # Gop cac doan ke nhau thanh mot doan (vi du ca mot nam, tat ca cac tinh)
+        new_run = np.ones(len(starts), dtype=bool)
+        new_run[1:] = starts[1:] != stops[:-1]
+        run_heads = np.flatnonzero(new_run)
+        starts = starts[run_heads]
+        stops = np.maximum.reduceat(stops, run_heads)
+    return starts, stops
+
+
+def positions_from_offsets(
+    offsets: pd.DataFrame,
+    years: List[int],
+    provinces: Optional[List[str]] = None,
+) -> np.ndarray:
+    """
+    Vi tri cac dong thoa bo loc, ghep tu cac doan lien tuc trong chi muc:
+    chi phi ti le voi so dong duoc chon, khong phu thuoc tong so dong.
+    """
+    starts, stops = _merged_ranges(offsets, years, provinces)
+    if len(starts) == 0:
+        return np.array([], dtype=np.int64)
+    lengths = stops - starts
+    # arange cho tung doan noi tiep nhau: start_i, start_i + 1, ..., stop_i - 1
+    positions = np.ones(int(lengths.sum()), dtype=np.int64)
+    run_heads = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    positions[run_heads] = starts - np.concatenate(([0], stops[:-1] - 1))
+    return np.cumsum(positions)
+
+
+def filter_main_dataset_by_offsets(
+    df: pd.DataFrame,
+    offsets: pd.DataFrame,
+    years: List[int],
+    provinces: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """
+    Giong filter_main_dataset nhung dung chi muc doan dong: ghep cac lat cat lien tuc
+    thay vi quet isin tren toan bo du lieu. Neu ket qua chi la mot doan (vi du
+    mot nam, tat ca tinh) thi tra ve lat cat cua df, khong sao chep.
+    """
+    starts, stops = _merged_ranges(offsets, years, provinces)
+    if len(starts) == 0:
+        return df.iloc[0:0]
+    if len(starts) == 1:
+        return df.iloc[int(starts[0]):int(stops[0])]
+    return pd.concat(
+        [df.iloc[int(a):int(b)] for a, b in zip(starts, stops)],
+    )
+
+
 def get_filter_options(df: pd.DataFrame) -> Tuple[List[int], List[str]]:
     years = sorted(df["nam"].dropna().unique().tolist())
-    provinces = (
-        df["tinh_thanh"]
-        .dropna()
-        .drop_duplicates()
-        .sort_values()
-        .tolist()
-    )
+    # tinh_thanh có thể là categorical (sắp theo mã tỉnh) nên sắp xếp theo tên
+    provinces = sorted(df["tinh_thanh"].dropna().unique().tolist())
     return years, provinces
 
 
@@ -64,3 +291,98 @@ def sample_for_plotting(df: pd.DataFrame, max_rows: int = 100_000) -> pd.DataFra
     if len(df) <= max_rows:
         return df
     return df.sample(n=max_rows, random_state=42)
+
+
+@st.cache_resource
+def get_filter_cache() -> FilterResultCache:
+    """
+    Cache LRU ket qua loc, mot doi tuong duy nhat dung chung cho moi phien.
+    """
+    return FilterResultCache(max_bytes=FILTER_CACHE_MAX_MB * 1024 ** 2)
+
+
+@st.cache_resource
+def get_cluster_cache() -> ClusteringResultCache:
+    """
+    Cache ket qua phan cum dung chung cho moi phien, kem kho tren dia neu bat.
+    """
+    return ClusteringResultCache(
+        max_bytes=CLUSTER_CACHE_MAX_MB * 1024 ** 2,
+        disk_dir=CLUSTER_CACHE_DIR if CLUSTER_CACHE_ON_DISK else None,
+    )
+
+
+def _filter_positions(
+    df: pd.DataFrame,
+    years: List[int],
+    provinces: Optional[List[str]] = None,
+    base_rows: Optional[np.ndarray] = None,
+    offsets: Optional[pd.DataFrame] = None,
+) -> np.ndarray:
+    """
+    Vi tri cac dong thoa bo loc; neu co `base_rows` thi chi xet trong cac dong do,
+    neu co chi muc doan dong thi ghep doan thay vi quet toan bo.
+    """
+    index_dtype = np.int32 if len(df) < np.iinfo(np.int32).max else np.int64
+    if base_rows is None and offsets_match(df, offsets):
+        return positions_from_offsets(offsets, years, provinces).astype(index_dtype)
+
+    nam = df["nam"].to_numpy()
+    if base_rows is not None:
+        nam = nam[base_rows]
+    mask = np.isin(nam, years)
+    if provinces:
+        tinh_thanh = df["tinh_thanh"]
+        if base_rows is not None:
+            tinh_thanh = tinh_thanh.iloc[base_rows]
+        mask &= tinh_thanh.isin(provinces).to_numpy()
+
+    if base_rows is None:
+        return np.flatnonzero(mask).astype(index_dtype)
+    return base_rows[mask]
+
+
+def filter_main_dataset_cached(
+    df: pd.DataFrame,
+    dataset_version: Hashable,
+    years: List[int],
+    provinces: Optional[List[str]] = None,
+    max_plot_rows: int = 100_000,
+    offsets: Optional[pd.DataFrame] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Giong filter_main_dataset + sample_for_plotting nhung nho ket qua theo lua chon
+    nam/tinh da chuan hoa. Lan lap lai tra ve ngay tu cache; lua chon moi nam trong
+    mot ket qua da co (vi du bot mot nam) chi loc lai tren cac dong cua ket qua do;
+    lan dau gap lua chon thi dung chi muc doan dong `offsets` (neu co). Tra ve (du lieu da loc, mau de ve bieu do).
+
+    `dataset_version` xac dinh noi dung cua df (vd. main_dataset_version): cac ban
+    sao cua cung du lieu (st.cache_data tra ve ban sao moi moi lan chay lai) dung
+    chung ket qua, con du lieu da doi thi khong dung lai vi tri dong cu.
+    """
+    cache = get_filter_cache()
+    token = (dataset_version, len(df), max_plot_rows)
+    filter_key = normalize_filter_key(years, provinces)
+    key = (token, filter_key)
+
+    entry = cache.get(key)
+    if entry is None:
+        superset = cache.find(lambda k: k[0] == token and is_superset_key(k[1], filter_key))
+        base_rows = superset[1] if superset is not None else None
+        rows = _filter_positions(
+            df, list(filter_key[0]), list(filter_key[1]), base_rows, offsets
+        )
+
+        if len(rows) <= max_plot_rows:
+            sample_rows = rows
+        else:
+            rng = np.random.RandomState(42)
+            pick = np.sort(rng.choice(len(rows), size=max_plot_rows, replace=False))
+            sample_rows = rows[pick]
+        cache.put(key, rows, sample_rows)
+    else:
+        rows, sample_rows = entry
+
+    filtered = df.iloc[rows]
+    plot_df = filtered if sample_rows is rows else df.iloc[sample_rows]
+    return filtered, plot_df
@@ -0,0 +1,65 @@
+# app/filter_cache.py
+
+from typing import Callable, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from app.lru_cache import LruCache
+
+# Khoa chuan hoa cua mot lua chon bo loc: (cac nam, cac tinh); tinh rong = tat ca
+FilterKey = Tuple[Tuple[int, ...], Tuple[str, ...]]
+
+
+def normalize_filter_key(years: List[int], provinces: Optional[List[str]] = None) -> FilterKey:
+    """
+    Chuan hoa lua chon nam/tinh (bo trung, sap xep) de cac lua chon giong nhau
+    theo thu tu khac nhau dung chung mot muc trong cache.
+    """
+    return (
+        tuple(sorted({int(y) for y in years})),
+        tuple(sorted(set(provinces or []))),
+    )
+
+
+def is_superset_key(outer: FilterKey, inner: FilterKey) -> bool:
+    """
+    Tap dong cua `outer` co chua tap dong cua `inner` hay khong.
+    """
+    outer_years, outer_provinces = outer
+    inner_years, inner_provinces = inner
+    if not set(inner_years) <= set(outer_years):
+        return False
+    if not outer_provinces:
+        return True
+    return bool(inner_provinces) and set(inner_provinces) <= set(outer_provinces)
+
+
+def _entry_nbytes(rows: np.ndarray, sample_rows: np.ndarray) -> int:
+    # Khi khong can lay mau, mau chinh la mang vi tri dong (cung mot doi tuong)
+    if sample_rows is rows:
+        return rows.nbytes
+    return rows.nbytes + sample_rows.nbytes
+
+
+class FilterResultCache(LruCache[Tuple[np.ndarray, np.ndarray]]):
+    """
+    Cache LRU gioi han theo so byte cho ket qua loc: luu vi tri dong (mang so nguyen)
+    va vi tri dong cua mau ve bieu do, khong luu DataFrame.
+    """
+
+    def __init__(self, max_bytes: int):
+        super().__init__(max_bytes=max_bytes, sizeof=lambda entry: _entry_nbytes(*entry))
+
+    def find(self, predicate: Callable[[Hashable], bool]) -> Optional[Tuple[Hashable, np.ndarray]]:
+        """
+        Tim muc gan day nhat co khoa thoa `predicate` (dung de loc tiep tu mot
+        ket qua bao trum thay vi quet toan bo du lieu).
+        """
+        found = super().find(predicate)
+        if found is None:
+            return None
+        key, (rows, _) = found
+        return key, rows
+
+    def put(self, key: Hashable, rows: np.ndarray, sample_rows: np.ndarray) -> None:
+        super().put(key, (rows, sample_rows))
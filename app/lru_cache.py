@@ -0,0 +1,105 @@
+# app/lru_cache.py
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+
+class LruCache(Generic[V]):
+    """
+    Cache LRU gioi han theo tong so byte (`max_bytes`, kich thuoc moi muc do
+    `sizeof` tinh) va/hoac theo so muc (`max_entries`). Cac cache cua ung dung
+    dung chung cho moi phien/yeu cau trong tien trinh nen moi thao tac deu giu khoa.
+
+    Lop con co the ghi de `_load_missing` de nap muc chua co tu noi khac (vd. dia);
+    muc nap duoc tinh la trung va duoc dua vao cache.
+    """
+
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        max_entries: Optional[int] = None,
+        sizeof: Optional[Callable[[V], int]] = None,
+    ):
+        if max_bytes is None and max_entries is None:
+            raise ValueError("Cần max_bytes hoặc max_entries để giới hạn cache.")
+        if max_bytes is not None and sizeof is None:
+            raise ValueError("Giới hạn theo byte cần hàm sizeof.")
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._sizeof = sizeof
+        self._entries: "OrderedDict[Hashable, V]" = OrderedDict()
+        self._nbytes = 0
+        # RLock: lop con goi lai get/put khi dang giu khoa
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _size(self, value: V) -> int:
+        return self._sizeof(value) if self._sizeof is not None else 0
+
+    def _over_limit(self) -> bool:
+        return (
+            (self.max_bytes is not None and self._nbytes > self.max_bytes)
+            or (self.max_entries is not None and len(self._entries) > self.max_entries)
+        )
+
+    def _load_missing(self, key: Hashable) -> Optional[V]:
+        return None
+
+    def get(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+            value = self._load_missing(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._store(key, value)
+            self.hits += 1
+            return value
+
+    def find(self, predicate: Callable[[Hashable], bool]) -> Optional[Tuple[Hashable, V]]:
+        """
+        Muc gan day nhat co khoa thoa `predicate` (khong tinh vao trung/truot).
+        """
+        with self._lock:
+            for key in reversed(self._entries):
+                if predicate(key):
+                    return key, self._entries[key]
+        return None
+
+    def _store(self, key: Hashable, value: V) -> None:
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._nbytes -= self._size(old)
+        size = self._size(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self._entries[key] = value
+        self._nbytes += size
+        while self._over_limit():
+            _, evicted = self._entries.popitem(last=False)
+            self._nbytes -= self._size(evicted)
+
+    def put(self, key: Hashable, value: V) -> None:
+        with self._lock:
+            self._store(key, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
@@ -0,0 +1,435 @@
+# app/query_service.py
+"""
+Dich vu truy van HTTP/JSON khong giao dien (asyncio, chi dung thu vien chuan),
+phuc vu tu cac bang tong hop da nap san trong bo nho:
+
+- GET /health
+- GET /province-stats?subject=toan&years=2023,2024[&provinces=Hà Nội,...][&by=tinh_thanh]
+- GET /histogram?subject=toan&years=2024[&provinces=...]
+- GET /percentile?combination=D01&years=2023[&provinces=...][&score=24][&top=10]
+
+Cac yeu cau giong nhau dang chay dong thoi duoc gop lai (chi tinh mot lan) va
+ket qua duoc luu trong cache LRU. Doi tuong QueryService cung la mot ung dung
+ASGI nen co the chay bang uvicorn hoac thu bang client ASGI bat ky.
+
+Chay: python -m app.query_service --host 127.0.0.1 --port 8765
+"""
+
+import argparse
+import asyncio
+import json
+import math
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from etl.config import AGG_SUBJECT_PROVINCE_FILE, HISTOGRAM_CUBE_FILE, COMBINATION_CDF_FILE
+from app.aggregation import merge_subject_stats, sum_histogram_cube
+from app.lru_cache import LruCache
+from app.score_lookup import CombinationScoreLookup
+
+# Ket qua tra ve: (ma trang thai HTTP, noi dung JSON da ma hoa)
+Response = Tuple[int, bytes]
+
+_STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+# Gioi han kich thuoc phan dau cua mot yeu cau HTTP
+_MAX_HEADER_BYTES = 64 * 1024
+
+
+class QueryError(ValueError):
+    """
+    Loi do tham so truy van khong hop le (tra ve HTTP 400).
+    """
+
+
+def _json_default(value):
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return None if np.isnan(value) else float(value)
+    return str(value)
+
+
+def _clean_float(value: float) -> Optional[float]:
+    return None if value is None or (isinstance(value, float) and math.isnan(value)) else value
+
+
+def _records(df: pd.DataFrame) -> List[dict]:
+    # NaN -> None de JSON hop le
+    return df.astype(object).where(df.notna(), None).to_dict(orient="records")
+
+
+def _encode(payload) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, default=_json_default).encode("utf-8")
+
+
+def _split_list(params: Dict[str, List[str]], name: str) -> List[str]:
+    values = []
+    for raw in params.get(name, []):
+        values.extend(v.strip() for v in raw.split(",") if v.strip())
+    return values
+
+
+# Tham so nhan danh sach gia tri (thu tu khong quan trong); cac tham so con lai chi nhan mot gia tri
+_LIST_PARAMS = ("years", "provinces")
+
+
+def _single(params: Dict[str, List[str]], name: str) -> Optional[str]:
+    values = _split_list(params, name)
+    if len(values) > 1:
+        raise QueryError(f"Tham số '{name}' chỉ nhận một giá trị: {values}")
+    return values[0] if values else None
+
+
+def _required(params: Dict[str, List[str]], name: str) -> str:
+    value = _single(params, name)
+    if value is None:
+        raise QueryError(f"Thiếu tham số '{name}'.")
+    return value
+
+
+def _years(params: Dict[str, List[str]]) -> List[int]:
+    raw = _split_list(params, "years")
+    if not raw:
+        raise QueryError("Thiếu tham số 'years'.")
+    try:
+        return sorted({int(y) for y in raw})
+    except ValueError:
+        raise QueryError(f"Năm không hợp lệ: {raw}")
+
+
+def _optional_float(params: Dict[str, List[str]], name: str) -> Optional[float]:
+    raw = _single(params, name)
+    if raw is None:
+        return None
+    try:
+        return float(raw)
+    except ValueError:
+        raise QueryError(f"Giá trị '{name}' không hợp lệ: {raw}")
+
+
+class QueryService:
+    """
+    Phuc vu cac truy van tong hop tu bang thong ke mon/tinh/nam, histogram dung san
+    va bang phan phoi diem to hop. Bang nao chua co (ETL chua tao) thi endpoint
+    tuong ung tra ve 404.
+    """
+
+    def __init__(
+        self,
+        stats_df: Optional[pd.DataFrame] = None,
+        histogram_cube: Optional[pd.DataFrame] = None,
+        combination_lookup: Optional[CombinationScoreLookup] = None,
+        cache_entries: int = 1024,
+    ):
+        self.stats_df = stats_df
+        self.histogram_cube = histogram_cube
+        self.combination_lookup = combination_lookup
+        # Cache LRU (gioi han so muc) cho noi dung phan hoi da ma hoa
+        self.cache: LruCache[Response] = LruCache(max_entries=cache_entries)
+        # Cac yeu cau dang tinh: khoa -> task dung chung cho cac yeu cau trung
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.coalesced = 0
+        self._routes: Dict[str, Callable[[Dict[str, List[str]]], object]] = {
+            "/health": self._health,
+            "/province-stats": self._province_stats,
+            "/histogram": self._histogram,
+            "/percentile": self._percentile,
+        }
+
+    @classmethod
+    def from_files(cls, cache_entries: int = 1024) -> "QueryService":
+        """
+        Nap san cac bang tong hop do ETL tao trong data_processed/.
+        """
+        stats_df = pd.read_parquet(AGG_SUBJECT_PROVINCE_FILE) if AGG_SUBJECT_PROVINCE_FILE.exists() else None
+        cube = pd.read_parquet(HISTOGRAM_CUBE_FILE) if HISTOGRAM_CUBE_FILE.exists() else None
+        lookup = (
+            CombinationScoreLookup(pd.read_parquet(COMBINATION_CDF_FILE))
+            if COMBINATION_CDF_FILE.exists() else None
+        )
+        if stats_df is None and cube is None and lookup is None:
+            raise RuntimeError("Không tìm thấy bảng tổng hợp nào. Hãy chạy ETL trước khi chạy dịch vụ.")
+        return cls(stats_df, cube, lookup, cache_entries=cache_entries)
+
+    # ---- Cac endpoint (chay trong luong phu, khong chan vong lap su kien) ----
+
+    def _health(self, params: Dict[str, List[str]]) -> dict:
+        return {
+            "status": "ok",
+            "province_stats": self.stats_df is not None,
+            "histogram": self.histogram_cube is not None,
+            "percentile": self.combination_lookup is not None,
+        }
+
+    def _province_stats(self, params: Dict[str, List[str]]) -> dict:
+        if self.stats_df is None:
+            raise LookupError("Chưa có bảng thống kê môn theo tỉnh.")
+        subject = _required(params, "subject")
+        years = _years(params)
+        provinces = _split_list(params, "provinces")
+        by = _single(params, "by") or "tinh_thanh"
+        if by not in ("tinh_thanh", "nam", "none"):
+            raise QueryError(f"Tham số 'by' không hợp lệ: {by}")
+        result = merge_subject_stats(
+            self.stats_df, subject, years, provinces or None, by=None if by == "none" else by
+        )
+        return {"subject": subject, "years": years, "provinces": provinces, "rows": _records(result)}
+
+    def _histogram(self, params: Dict[str, List[str]]) -> dict:
+        if self.histogram_cube is None:
+            raise LookupError("Chưa có histogram dựng sẵn.")
+        subject = _required(params, "subject")
+        years = _years(params)
+        provinces = _split_list(params, "provinces")
+        hist = sum_histogram_cube(self.histogram_cube, subject, years, provinces or None)
+        return {
+            "subject": subject,
+            "years": years,
+            "provinces": provinces,
+            "diem": hist["diem"].round(2).tolist(),
+            "so_luong": hist["so_luong"].astype(np.int64).tolist(),
+        }
+
+    def _percentile(self, params: Dict[str, List[str]]) -> dict:
+        lookup = self.combination_lookup
+        if lookup is None:
+            raise LookupError("Chưa có bảng phân phối điểm tổ hợp.")
+        combination = _required(params, "combination")
+        years = _years(params)
+        provinces = _split_list(params, "provinces") or None
+        score = _optional_float(params, "score")
+        top = _optional_float(params, "top")
+
+        result = {
+            "combination": combination,
+            "years": years,
+            "provinces": provinces or [],
+            "total": lookup.total(combination, years, provinces),
+        }
+        if score is not None:
+            result["score"] = score
+            result["count_at_least"] = lookup.count_at_least(combination, score, years, provinces)
+            result["percentile_rank"] = _clean_float(lookup.percentile_rank(combination, score, years, provinces))
+        if top is not None:
+            if not 0 < top <= 100:
+                raise QueryError("Tham số 'top' phải nằm trong (0, 100].")
+            result["top"] = top
+            result["score_for_top"] = _clean_float(lookup.score_for_top(combination, top, years, provinces))
+        return result
+
+    # ---- Dieu phoi ----
+
+    def _compute(self, path: str, params: Dict[str, List[str]]) -> Response:
+        route = self._routes.get(path)
+        if route is None:
+            return 404, _encode({"error": f"Không có endpoint {path}"})
+        try:
+            return 200, _encode(route(params))
+        except QueryError as e:
+            return 400, _encode({"error": str(e)})
+        except LookupError as e:
+            return 404, _encode({"error": str(e)})
+
+    @staticmethod
+    def cache_key(path: str, params: Dict[str, List[str]]) -> str:
+        # Chuan hoa thu tu tham so (va thu tu gia tri cua tham so danh sach) de cac URL
+        # tuong duong dung chung ket qua; tham so don giu nguyen thu tu de van bi tu choi
+        normalized = {
+            k: sorted(_split_list(params, k)) if k in _LIST_PARAMS else _split_list(params, k)
+            for k in sorted(params)
+        }
+        return json.dumps([path, normalized], ensure_ascii=False)
+
+    async def handle(self, method: str, target: str) -> Response:
+        """
+        Xu ly mot yeu cau (method, duong dan kem query string), tra ve (status, body).
+        """
+        if method not in ("GET", "HEAD"):
+            return 405, _encode({"error": "Chỉ hỗ trợ GET."})
+        parts = urlsplit(target)
+        params = parse_qs(parts.query, keep_blank_values=False)
+        key = self.cache_key(parts.path, params)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        # Gop yeu cau: moi phep tinh la mot task dung chung, cac yeu cau trung chi cho no.
+        # shield() de mot yeu cau bi huy (client ngat, het thoi gian) khong huy task
+        # cua cac yeu cau khac dang cho cung ket qua
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(self._compute_and_cache(key, parts.path, params))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget_in_flight(key, done))
+        return await asyncio.shield(task)
+
+    async def _compute_and_cache(self, key: str, path: str, params: Dict[str, List[str]]) -> Response:
+        try:
+            response = await asyncio.to_thread(self._compute, path, params)
+        except Exception as e:  # loi bat ngo: khong cache, bao cho moi yeu cau dang cho
+            return 500, _encode({"error": f"Lỗi máy chủ: {e}"})
+        if response[0] == 200:
+            self.cache.put(key, response)
+        return response
+
+    def _forget_in_flight(self, key: str, task: asyncio.Future) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+    # ---- Giao dien ASGI ----
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+
+        query = scope.get("query_string", b"").decode("latin-1")
+        target = scope["path"] + (f"?{query}" if query else "")
+        status, body = await self.handle(scope["method"], target)
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json; charset=utf-8"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": b"" if scope["method"] == "HEAD" else body})
+
+
+async def call_asgi(app, method: str, target: str) -> Tuple[int, bytes]:
+    """
+    Client ASGI toi gian (khong can socket) de thu dich vu ngay trong tien trinh:
+    status, body = await call_asgi(service, "GET", "/histogram?subject=toan&years=2024")
+    """
+    parts = urlsplit(target)
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "path": parts.path,
+        "raw_path": parts.path.encode(),
+        "query_string": parts.query.encode(),
+        "headers": [],
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    status = next(m["status"] for m in messages if m["type"] == "http.response.start")
+    body = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.response.body")
+    return status, body
+
+
+# ---- May chu HTTP/1.1 toi gian tren asyncio (giu ket noi keep-alive) ----
+
+async def _handle_connection(
+    service: QueryService,
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+) -> None:
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            except asyncio.LimitOverrunError:
+                break
+            if len(head) > _MAX_HEADER_BYTES:
+                break
+
+            lines = head.decode("latin-1").split("\r\n")
+            try:
+                method, target, version = lines[0].split(" ", 2)
+            except ValueError:
+                break
+            headers = {}
+            for line in lines[1:]:
+                if ":" in line:
+                    name, value = line.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+            # Bo qua than yeu cau (neu co), dich vu chi doc query string
+            length = int(headers.get("content-length", "0") or 0)
+            if length:
+                await reader.readexactly(length)
+
+            status, body = await service.handle(method, target)
+            keep_alive = (
+                headers.get("connection", "").lower() != "close"
+                and version.upper() == "HTTP/1.1"
+            )
+            writer.write(
+                f"HTTP/1.1 {status} {_STATUS_TEXT.get(status, '')}\r\n"
+                "Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+                + (b"" if method == "HEAD" else body)
+            )
+            await writer.drain()
+            if not keep_alive:
+                break
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def start_server(service: QueryService, host: str = "127.0.0.1", port: int = 8765) -> asyncio.AbstractServer:
+    """
+    Mo may chu HTTP cho `service`; port=0 de he dieu hanh tu chon cong trong.
+    """
+    return await asyncio.start_server(
+        lambda r, w: _handle_connection(service, r, w), host, port, limit=_MAX_HEADER_BYTES
+    )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Dịch vụ truy vấn HTTP/JSON điểm thi THPT")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cache-entries", type=int, default=1024, help="Số phản hồi tối đa giữ trong cache.")
+    return parser.parse_args(argv)
+
+
+async def _serve_forever(args: argparse.Namespace) -> None:
+    service = QueryService.from_files(cache_entries=args.cache_entries)
+    server = await start_server(service, args.host, args.port)
+    address = server.sockets[0].getsockname()
+    print(f"Dịch vụ truy vấn đang chạy tại http://{address[0]}:{address[1]}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    try:
+        asyncio.run(_serve_forever(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# app/score_lookup.py
+
+import math
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Mot nhom (nam, tinh_thanh) cua mot to hop: cac muc diem tang dan va
+# so thi sinh dat tu muc do tro len (day khong tang)
+GroupCdf = Tuple[np.ndarray, np.ndarray]
+
+# Khoa nhom; tinh_thanh la None voi thi sinh khong xac dinh duoc tinh
+GroupKey = Tuple[int, Optional[str]]
+
+
+class CombinationScoreLookup:
+    """
+    Tra cuu nhanh phan phoi diem to hop tu bang phan phoi tich luy do ETL tao
+    (COMBINATION_CDF_FILE), khong quet du lieu tung thi sinh.
+
+    - count_at_least: so thi sinh dat >= X, O(so nhom x log so muc diem)
+    - percentile_rank / score_for_top: gop phan phoi cac nhom duoc chon, O(so o)
+    """
+
+    def __init__(self, cdf: pd.DataFrame):
+        self._groups: Dict[str, Dict[GroupKey, GroupCdf]] = {}
+        cdf = cdf.sort_values(["to_hop", "nam", "tinh_thanh", "diem"], kind="mergesort")
+        # dropna=False: thi sinh khong ro tinh van duoc tinh khi khong loc theo tinh
+        for (to_hop, nam, tinh), group in cdf.groupby(
+            ["to_hop", "nam", "tinh_thanh"], observed=True, sort=False, dropna=False
+        ):
+            tinh = None if pd.isna(tinh) else str(tinh)
+            self._groups.setdefault(str(to_hop), {})[(int(nam), tinh)] = (
+                group["diem"].to_numpy(dtype=np.float64),
+                group["so_luong_tu_diem"].to_numpy(dtype=np.int64),
+            )
+
+    @property
+    def combinations(self) -> List[str]:
+        return list(self._groups)
+
+    def _select(
+        self,
+        to_hop: str,
+        years: List[int],
+        provinces: Optional[List[str]] = None,
+    ) -> List[GroupCdf]:
+        groups = self._groups.get(to_hop, {})
+        years = set(int(y) for y in years)
+        provinces = set(provinces) if provinces else None
+        return [
+            cdf for (nam, tinh), cdf in groups.items()
+            if nam in years and (provinces is None or tinh in provinces)
+        ]
+
+    def total(self, to_hop: str, years: List[int], provinces: Optional[List[str]] = None) -> int:
+        """
+        Tong so thi sinh co diem to hop trong cac nam/tinh duoc chon.
+        """
+        return int(sum(at_least[0] for _, at_least in self._select(to_hop, years, provinces)))
+
+    def count_at_least(
+        self,
+        to_hop: str,
+        score: float,
+        years: List[int],
+        provinces: Optional[List[str]] = None,
+    ) -> int:
+        """
+        So thi sinh dat diem to hop >= score, vd. "bao nhieu thi sinh D01 o Ha Noi
+        nam 2023 dat tu 24 diem": count_at_least("D01", 24, [2023], ["Hà Nội"]).
+        """
+        # Lam tron ve 2 chu so nhu diem trong bang de tranh sai so dau phay dong
+        score = round(float(score), 2)
+        result = 0
+        for scores, at_least in self._select(to_hop, years, provinces):
+            idx = np.searchsorted(scores, score, side="left")
+            if idx < len(scores):
+                result += int(at_least[idx])
+        return result
+
+    def merged_distribution(
+        self,
+        to_hop: str,
+        years: List[int],
+        provinces: Optional[List[str]] = None,
+    ) -> pd.DataFrame:
+        """
+        Gop phan phoi cac nhom duoc chon: moi muc diem mot dong voi so_luong va
+        so_luong_tu_diem, xep theo diem tang dan.
+        """
+        selected = self._select(to_hop, years, provinces)
+        if not selected:
+            return pd.DataFrame(columns=["diem", "so_luong", "so_luong_tu_diem"])
+
+        scores = np.concatenate([s for s, _ in selected])
+        # So thi sinh dung bang tung muc suy ra tu hieu cua day tich luy
+        counts = np.concatenate([a - np.append(a[1:], 0) for _, a in selected])
+        grid, inverse = np.unique(scores, return_inverse=True)
+        merged = np.bincount(inverse, weights=counts, minlength=len(grid)).astype(np.int64)
+        return pd.DataFrame({
+            "diem": grid,
+            "so_luong": merged,
+            "so_luong_tu_diem": np.cumsum(merged[::-1])[::-1],
+        })
+
+    def percentile_rank(
+        self,
+        to_hop: str,
+        score: float,
+        years: List[int],
+        provinces: Optional[List[str]] = None,
+    ) -> float:
+        """
+        Ty le (%) thi sinh co diem to hop thap hon score; NaN neu khong co thi sinh.
+        """
+        total = self.total(to_hop, years, provinces)
+        if total == 0:
+            return float("nan")
+        return 100.0 * (total - self.count_at_least(to_hop, score, years, provinces)) / total
+
+    def score_for_top(
+        self,
+        to_hop: str,
+        top_percent: float,
+        years: List[int],
+        provinces: Optional[List[str]] = None,
+    ) -> float:
+        """
+        Muc diem cao nhat X sao cho so thi sinh dat >= X chiem it nhat `top_percent`%
+        (nguong de lot vao nhom top_percent% cao nhat); NaN neu khong co thi sinh.
+        """
+        dist = self.merged_distribution(to_hop, years, provinces)
+        if dist.empty:
+            return float("nan")
+        total = int(dist["so_luong_tu_diem"].iloc[0])
+        needed = max(math.ceil(total * top_percent / 100.0), 1)
+        # so_luong_tu_diem khong tang theo diem: dao chieu de tim kiem nhi phan
+        at_least = dist["so_luong_tu_diem"].to_numpy()[::-1]
+        idx = np.searchsorted(at_least, needed, side="left")
+        return float(dist["diem"].to_numpy()[::-1][min(idx, len(at_least) - 1)])
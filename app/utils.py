@@ -1,5 +1,6 @@
 # app/utils.py
 
+import numpy as np
 import pandas as pd
 from app.constants import SUBJECT_LABELS
 
@@ -31,3 +32,42 @@ def format_stat_value(value: float, decimals: int = 2) -> str:
 
 def get_subject_label(subject: str) -> str:
     return SUBJECT_LABELS.get(subject, subject)
+
+
+def quantiles_from_counts(values: np.ndarray, counts: np.ndarray, probs) -> np.ndarray:
+    """
+    Phan vi chinh xac tu bang dem (gia tri da sap tang dan, so lan xuat hien),
+    noi suy tuyen tinh giong numpy.quantile tren du lieu khai trien day du.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    cum = np.cumsum(counts)
+    n = cum[-1]
+    pos = np.asarray(probs, dtype=np.float64) * (n - 1)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.ceil(pos).astype(np.int64)
+    # Gia tri tai hang k (tinh tu 0) la gia tri dau tien co tong tich luy > k
+    v_lo = values[np.searchsorted(cum, lo, side="right")]
+    v_hi = values[np.searchsorted(cum, hi, side="right")]
+    return v_lo + (v_hi - v_lo) * (pos - lo)
+
+
+def box_stats_from_counts(values: np.ndarray, counts: np.ndarray) -> dict:
+    """
+    Thong ke boxplot (Q1, trung vi, Q3, can duoi, can tren) tu bang dem.
+    Can la gia tri du lieu xa nhat con nam trong khoang 1.5 IQR, nhu Plotly.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    counts = np.asarray(counts)
+    present = values[counts > 0]
+    q1, median, q3 = quantiles_from_counts(values, counts, [0.25, 0.5, 0.75])
+    iqr = q3 - q1
+    lower = present[present >= q1 - 1.5 * iqr].min()
+    upper = present[present <= q3 + 1.5 * iqr].max()
+    return {
+        "q1": float(q1),
+        "median": float(median),
+        "q3": float(q3),
+        "lowerfence": float(lower),
+        "upperfence": float(upper),
+        "count": int(counts.sum()),
+    }
@@ -0,0 +1,74 @@
+# benchmarks/bench_province_decoding.py
+"""
+So sánh tốc độ giải mã tỉnh từ số báo danh:
+- cách cũ: hai lượt .apply() với hàm scalar
+- cách mới: decode_province_series (vector hóa, categorical)
+
+Chạy: python -m benchmarks.bench_province_decoding --rows 1000000
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from etl.province_mapping import (
+    MA_TINH_TO_TEN,
+    decode_province_series,
+    extract_ma_tinh_from_sbd,
+    get_tinh_thanh_from_sbd,
+)
+
+
+def make_sbd_series(n_rows: int, seed: int = 0) -> pd.Series:
+    rng = np.random.default_rng(seed)
+    prefixes = np.array(list(MA_TINH_TO_TEN.keys()) + ["99"], dtype=object)
+    chosen = rng.choice(prefixes, size=n_rows)
+    suffixes = rng.integers(0, 1_000_000, size=n_rows)
+    return pd.Series([f"{p}{s:06d}" for p, s in zip(chosen, suffixes)], dtype=str)
+
+
+def decode_with_apply(sbd: pd.Series):
+    ma_tinh = sbd.apply(extract_ma_tinh_from_sbd)
+    tinh_thanh = sbd.apply(get_tinh_thanh_from_sbd)
+    return ma_tinh, tinh_thanh
+
+
+def _as_list(s: pd.Series) -> list:
+    return [None if pd.isna(v) else v for v in s]
+
+
+def _best_of(func, sbd: pd.Series, repeat: int):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(sbd)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    sbd = make_sbd_series(args.rows)
+
+    t_apply, (ma_old, ten_old) = _best_of(decode_with_apply, sbd, args.repeat)
+    t_vec, (ma_new, ten_new) = _best_of(decode_province_series, sbd, args.repeat)
+
+    # Kiểm tra hai cách cho cùng kết quả
+    assert _as_list(ma_new) == _as_list(ma_old)
+    assert _as_list(ten_new) == _as_list(ten_old)
+
+    print(f"Số dòng: {args.rows:,}")
+    print(f"apply (2 lượt):      {t_apply:.3f} s")
+    print(f"vector hóa:          {t_vec:.3f} s")
+    print(f"Tăng tốc:            {t_apply / t_vec:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
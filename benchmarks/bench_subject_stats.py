@@ -0,0 +1,80 @@
+# benchmarks/bench_subject_stats.py
+"""
+So sánh tốc độ tạo bảng thống kê môn theo tỉnh và năm:
+- cách cũ: mỗi môn một lượt groupby(["nam", "tinh_thanh"])
+- cách mới: build_subject_stats_by_province (một lượt groupby cho tất cả các môn)
+
+Chạy: python -m benchmarks.bench_subject_stats --rows 5000000
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from etl.config import SUBJECT_COLUMNS
+from etl.build_aggregates import build_subject_stats_by_province
+from etl.province_mapping import TINH_THANH_CATEGORIES
+
+
+def make_scores_frame(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Dữ liệu tổng hợp: 5 năm, tỉnh ngẫu nhiên, điểm trên lưới 0.25, ~30% bỏ trống.
+    """
+    rng = np.random.default_rng(seed)
+    codes = rng.integers(-1, len(TINH_THANH_CATEGORIES), size=n_rows)
+    data = {
+        "nam": rng.integers(2020, 2025, size=n_rows),
+        "tinh_thanh": pd.Categorical.from_codes(codes, categories=TINH_THANH_CATEGORIES),
+    }
+    for mon in SUBJECT_COLUMNS:
+        scores = np.round(np.clip(rng.normal(6.0, 1.5, size=n_rows), 0, 10) * 4) / 4
+        scores[rng.random(n_rows) < 0.3] = np.nan
+        data[mon] = scores
+    return pd.DataFrame(data)
+
+
+def build_stats_per_subject(df: pd.DataFrame) -> pd.DataFrame:
+    """Cách cũ: mỗi môn một lượt groupby."""
+    frames = []
+    for mon in SUBJECT_COLUMNS:
+        if mon not in df.columns:
+            continue
+        group = (
+            df.groupby(["nam", "tinh_thanh"], dropna=False, observed=True)[mon]
+            .agg(["mean", "median", "min", "max", "count"])
+            .reset_index()
+        )
+        group["mon"] = mon
+        frames.append(group)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _timed(func, df: pd.DataFrame):
+    start = time.perf_counter()
+    result = func(df)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    args = parser.parse_args()
+
+    df = make_scores_frame(args.rows)
+
+    t_old, old = _timed(build_stats_per_subject, df)
+    t_new, new = _timed(build_subject_stats_by_province, df)
+
+    # Hai cách phải cho cùng một bảng kết quả
+    pd.testing.assert_frame_equal(old, new[old.columns], check_dtype=False)
+
+    print(f"Số dòng: {args.rows:,}")
+    print(f"groupby từng môn:   {t_old:.3f} s")
+    print(f"một lượt groupby:   {t_new:.3f} s")
+    print(f"Tăng tốc:           {t_old / t_new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
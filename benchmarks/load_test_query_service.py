@@ -0,0 +1,182 @@
+# benchmarks/load_test_query_service.py
+"""
+Kiểm thử tải dịch vụ truy vấn HTTP/JSON (app/query_service.py): nhiều client
+đồng thời gửi hỗn hợp truy vấn thống kê tỉnh / histogram / phân vị, báo cáo
+độ trễ p50/p90/p99, thông lượng và tỷ lệ trúng cache.
+
+- Không truyền --url: tự mở dịch vụ trong tiến trình trên một cổng trống (HTTP thật qua socket)
+- --mode asgi: gọi thẳng ứng dụng ASGI, không qua socket (đo riêng phần xử lý)
+- --distinct: số truy vấn khác nhau trong hỗn hợp (nhỏ = trúng cache nhiều)
+
+Chạy: python -m benchmarks.load_test_query_service --requests 5000 --concurrency 32
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from typing import List, Optional, Tuple
+from urllib.parse import quote, urlsplit
+
+import numpy as np
+
+from etl.config import SUBJECT_COLUMNS, COMBINATION_DEFINITIONS
+from etl.province_mapping import TINH_THANH_CATEGORIES
+from app.query_service import QueryService, call_asgi, start_server
+
+YEARS = [2020, 2021, 2022, 2023, 2024]
+
+
+def make_queries(n_distinct: int, seed: int = 0) -> List[str]:
+    """
+    Tạo `n_distinct` đường dẫn truy vấn ngẫu nhiên (đã mã hóa URL).
+    """
+    rng = random.Random(seed)
+    provinces = list(TINH_THANH_CATEGORIES)
+    queries = []
+    for _ in range(n_distinct):
+        years = ",".join(map(str, sorted(rng.sample(YEARS, rng.randint(1, 3)))))
+        chosen = ",".join(rng.sample(provinces, rng.randint(0, 2)))
+        kind = rng.choice(["province-stats", "histogram", "percentile"])
+        if kind == "percentile":
+            combination = rng.choice(list(COMBINATION_DEFINITIONS))
+            score = rng.choice([15, 18, 20, 22, 24, 26])
+            path = f"/percentile?combination={combination}&years={years}&score={score}&top=10"
+        else:
+            path = f"/{kind}?subject={rng.choice(SUBJECT_COLUMNS)}&years={years}"
+        if chosen:
+            path += f"&provinces={chosen}"
+        queries.append(quote(path, safe="/?=&,"))
+    return queries
+
+
+class _HttpClient:
+    """
+    Client HTTP/1.1 tối giản trên asyncio, giữ một kết nối keep-alive.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def get(self, target: str) -> Tuple[int, bytes]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(
+            f"GET {target} HTTP/1.1\r\nHost: {self.host}\r\nConnection: keep-alive\r\n\r\n".encode("latin-1")
+        )
+        await self.writer.drain()
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ")[1])
+        length = 0
+        for line in lines[1:]:
+            if line.lower().startswith("content-length:"):
+                length = int(line.split(":", 1)[1])
+        body = await self.reader.readexactly(length)
+        return status, body
+
+    async def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+
+
+async def run_load(
+    queries: List[str],
+    n_requests: int,
+    concurrency: int,
+    mode: str,
+    host: str,
+    port: int,
+    service: Optional[QueryService],
+    seed: int = 0,
+) -> Tuple[np.ndarray, dict, float]:
+    rng = random.Random(seed)
+    plan = [rng.choice(queries) for _ in range(n_requests)]
+    latencies = np.empty(n_requests)
+    statuses: dict = {}
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        client = _HttpClient(host, port) if mode == "http" else None
+        try:
+            while next_index < n_requests:
+                i = next_index
+                next_index += 1
+                start = time.perf_counter()
+                if client is not None:
+                    status, _ = await client.get(plan[i])
+                else:
+                    status, _ = await call_asgi(service, "GET", plan[i])
+                latencies[i] = time.perf_counter() - start
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            if client is not None:
+                await client.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - start
+
+
+def report(latencies: np.ndarray, statuses: dict, elapsed: float, service: Optional[QueryService]) -> None:
+    ms = latencies * 1000
+    print(f"Số yêu cầu: {len(ms)} trong {elapsed:.2f} s ({len(ms) / elapsed:,.0f} yêu cầu/s)")
+    print(f"Mã trạng thái: {dict(sorted(statuses.items()))}")
+    print(
+        "Độ trễ (ms): "
+        f"p50={np.percentile(ms, 50):.2f}  p90={np.percentile(ms, 90):.2f}  "
+        f"p99={np.percentile(ms, 99):.2f}  max={ms.max():.2f}"
+    )
+    if service is not None:
+        print(
+            f"Cache phản hồi: {service.cache.hits} trúng / {service.cache.misses} trượt; "
+            f"gộp yêu cầu trùng: {service.coalesced}"
+        )
+
+
+async def _main(args: argparse.Namespace) -> None:
+    queries = make_queries(args.distinct, seed=args.seed)
+    service = None
+    server = None
+    if args.url:
+        parts = urlsplit(args.url)
+        host, port = parts.hostname, parts.port or 80
+        if args.mode == "asgi":
+            raise ValueError("--mode asgi chỉ dùng với dịch vụ trong tiến trình (không truyền --url).")
+    else:
+        service = QueryService.from_files()
+        host, port = "127.0.0.1", 0
+        if args.mode == "http":
+            server = await start_server(service, host, 0)
+            port = server.sockets[0].getsockname()[1]
+
+    try:
+        latencies, statuses, elapsed = await run_load(
+            queries, args.requests, args.concurrency, args.mode, host, port, service, seed=args.seed
+        )
+    finally:
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+    report(latencies, statuses, elapsed, service)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="Địa chỉ dịch vụ đang chạy, vd. http://127.0.0.1:8765")
+    parser.add_argument("--mode", choices=["http", "asgi"], default="http")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--distinct", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
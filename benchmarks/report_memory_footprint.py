@@ -0,0 +1,61 @@
+# benchmarks/report_memory_footprint.py
+"""
+Báo cáo bộ nhớ của dữ liệu đã xử lý: schema gọn hiện tại (float32, int16,
+categorical) so với cách lưu cũ (float64, int64, chuỗi object).
+
+Chạy: python -m benchmarks.report_memory_footprint [--path data_processed/diem_thpt_2020_2024.parquet]
+"""
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from etl.config import MAIN_DATA_FILE
+from etl.schema import SCORE_COLUMNS
+
+
+def to_legacy_layout(df: pd.DataFrame) -> pd.DataFrame:
+    """Dựng lại cách lưu cũ: điểm float64, nam int64, chuỗi dạng object."""
+    legacy = df.copy()
+    for col in legacy.columns:
+        if col in SCORE_COLUMNS:
+            legacy[col] = legacy[col].astype(np.float64)
+        elif col == "nam":
+            legacy[col] = legacy[col].astype(np.int64)
+        else:
+            legacy[col] = legacy[col].astype(object)
+    return legacy
+
+
+def _mb(n_bytes: float) -> str:
+    return f"{n_bytes / 1024 ** 2:10.1f} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--path", type=Path, default=MAIN_DATA_FILE)
+    args = parser.parse_args()
+
+    compact = pd.read_parquet(args.path)
+    legacy = to_legacy_layout(compact)
+
+    compact_usage = compact.memory_usage(deep=True, index=False)
+    legacy_usage = legacy.memory_usage(deep=True, index=False)
+
+    print(f"File: {args.path} ({len(compact):,} dòng)")
+    print(f"{'Cột':<18}{'Kiểu gọn':<12}{'Gọn':>14}{'Cũ':>14}")
+    for col in compact.columns:
+        print(
+            f"{col:<18}{str(compact[col].dtype):<12}"
+            f"{_mb(compact_usage[col])}{_mb(legacy_usage[col])}"
+        )
+    total_compact = compact_usage.sum()
+    total_legacy = legacy_usage.sum()
+    print(f"{'Tổng':<30}{_mb(total_compact)}{_mb(total_legacy)}")
+    print(f"Tỉ lệ giảm: {total_legacy / total_compact:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+# benchmarks/run_scenarios.py
+"""
+Đo thời gian và bộ nhớ đỉnh (peak RSS) của các bước chính trên dữ liệu giả lập
+(benchmarks/synthetic_data.py) ở nhiều quy mô, không cần data_raw thật:
+
+- ETL: load_raw_year (engine pandas và arrow), build_subject_stats_by_province, build_score_histogram_cube, build_combination_cdf
+- App: filter_main_dataset, kmeans_cluster (từng engine), từng hàm vẽ biểu đồ
+  (tính cả bước tuần tự hóa figure sang JSON như khi gửi xuống trình duyệt)
+
+Mỗi kịch bản chạy trong một tiến trình con riêng để peak RSS không lẫn giữa các kịch bản.
+Dữ liệu sinh ra được giữ trong --workdir và dùng lại ở lần chạy sau.
+
+Chạy: python -m benchmarks.run_scenarios --sizes 100000,1000000,5000000
+"""
+
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic_data import DEFAULT_YEARS, write_year_csv
+
+BENCH_YEAR = 2024
+FILTER_YEARS = [2023, 2024]
+FILTER_PROVINCES = ["Hà Nội", "Thành phố Hồ Chí Minh", "Đà Nẵng"]
+COMBINATION = "A00"
+CLUSTER_SUBJECTS = ["toan", "ly", "hoa"]
+
+
+def _reset_peak_rss() -> None:
+    # Trên Linux ru_maxrss của tiến trình con giữ đỉnh của tiến trình cha (qua fork + exec);
+    # ghi "5" vào clear_refs đặt lại đỉnh (VmHWM) về RSS hiện tại
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss tính bằng KB trên Linux, byte trên macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def prepare_inputs(workdir: Path, n_rows: int, seed: int = 0) -> Dict[str, str]:
+    """
+    Sinh (hoặc dùng lại) file CSV thô `n_rows` dòng và các bảng đã xử lý tương ứng.
+    Dữ liệu đã xử lý được chia đều cho các năm DEFAULT_YEARS để các phép gom nhóm
+    theo năm có nhiều nhóm như dữ liệu thật.
+    """
+    from etl.build_aggregates import (
+        build_subject_stats_by_province,
+        build_score_histogram_cube,
+        build_combination_cdf,
+    )
+    from etl.preprocess import load_raw_year
+
+    size_dir = workdir / f"rows_{n_rows}_seed_{seed}"
+    paths = {
+        "csv": size_dir / f"thpt{BENCH_YEAR}.csv",
+        "main": size_dir / "diem_thi.parquet",
+        "stats": size_dir / "thong_ke.parquet",
+        "cube": size_dir / "histogram.parquet",
+        "cdf": size_dir / "phan_phoi_to_hop.parquet",
+    }
+    if all(p.exists() for p in paths.values()):
+        return {k: str(p) for k, p in paths.items()}
+
+    print(f"Sinh dữ liệu giả lập {n_rows:,} dòng vào {size_dir} ...")
+    write_year_csv(paths["csv"], BENCH_YEAR, n_rows, seed=seed)
+    df = load_raw_year(paths["csv"], BENCH_YEAR)
+    years = np.array(DEFAULT_YEARS, dtype=df["nam"].dtype)
+    df["nam"] = years[np.arange(len(df)) % len(years)]
+    df.to_parquet(paths["main"], index=False)
+    build_subject_stats_by_province(df).to_parquet(paths["stats"], index=False)
+    build_score_histogram_cube(df).to_parquet(paths["cube"], index=False)
+    build_combination_cdf(df).to_parquet(paths["cdf"], index=False)
+    return {k: str(p) for k, p in paths.items()}
+
+
+# --- Kịch bản: setup(inputs) -> đối số (không tính giờ), run(đối số) -> kết quả (tính giờ) ---
+
+def _main_frame(inputs: Dict[str, str]) -> pd.DataFrame:
+    return pd.read_parquet(inputs["main"])
+
+
+def _plot_frame(inputs: Dict[str, str]) -> pd.DataFrame:
+    from app.data_access import sample_for_plotting
+    return sample_for_plotting(_main_frame(inputs))
+
+
+def _clustered_frame(inputs: Dict[str, str]) -> pd.DataFrame:
+    from app.clustering import kmeans_cluster
+    clustered, _ = kmeans_cluster(_main_frame(inputs), CLUSTER_SUBJECTS, engine="dedup")
+    return clustered
+
+
+def _figure_json(fig) -> int:
+    return 0 if fig is None else len(fig.to_json())
+
+
+def _run_load_raw_year(inputs):
+    from etl.preprocess import load_raw_year
+    return load_raw_year(Path(inputs["csv"]), BENCH_YEAR)
+
+
+def _run_load_raw_year_arrow(inputs):
+    from etl.arrow_engine import load_raw_year_arrow
+    return load_raw_year_arrow(Path(inputs["csv"]), BENCH_YEAR)
+
+
+def _run_stats(df):
+    from etl.build_aggregates import build_subject_stats_by_province
+    return build_subject_stats_by_province(df)
+
+
+def _run_cube(df):
+    from etl.build_aggregates import build_score_histogram_cube
+    return build_score_histogram_cube(df)
+
+
+def _run_cdf(df):
+    from etl.build_aggregates import build_combination_cdf
+    return build_combination_cdf(df)
+
+
+def _run_filter(df):
+    from app.data_access import filter_main_dataset
+    return filter_main_dataset(df, FILTER_YEARS, FILTER_PROVINCES)
+
+
+def _run_kmeans(engine: str) -> Callable:
+    def run(df):
+        from app.clustering import kmeans_cluster
+        return kmeans_cluster(df, CLUSTER_SUBJECTS, n_clusters=4, engine=engine)
+    return run
+
+
+def _run_chart(name: str, *args) -> Callable:
+    def run(data):
+        from app import charts
+        return _figure_json(getattr(charts, name)(data, *args))
+    return run
+
+
+def _run_at_least_curve(cdf):
+    from app import charts
+    from app.score_lookup import CombinationScoreLookup
+    dist = CombinationScoreLookup(cdf).merged_distribution(COMBINATION, FILTER_YEARS)
+    return _figure_json(charts.create_at_least_curve(dist, COMBINATION, 24.0))
+
+
+SCENARIOS: Dict[str, Tuple[Callable, Callable]] = {
+    "load_raw_year": (lambda inputs: inputs, _run_load_raw_year),
+    "load_raw_year_arrow": (lambda inputs: inputs, _run_load_raw_year_arrow),
+    "build_subject_stats_by_province": (_main_frame, _run_stats),
+    "build_score_histogram_cube": (_main_frame, _run_cube),
+    "build_combination_cdf": (_main_frame, _run_cdf),
+    "filter_main_dataset": (_main_frame, _run_filter),
+    "kmeans_cluster[kmeans]": (_main_frame, _run_kmeans("kmeans")),
+    "kmeans_cluster[minibatch]": (_main_frame, _run_kmeans("minibatch")),
+    "kmeans_cluster[dedup]": (_main_frame, _run_kmeans("dedup")),
+    "create_histogram": (_plot_frame, _run_chart("create_histogram", "toan")),
+    "create_histogram_from_cube": (
+        lambda inputs: pd.read_parquet(inputs["cube"]),
+        _run_chart("create_histogram_from_cube", "toan", FILTER_YEARS),
+    ),
+    "create_boxplot_all_subjects": (_plot_frame, _run_chart("create_boxplot_all_subjects")),
+    "create_boxplot_from_cube": (
+        lambda inputs: pd.read_parquet(inputs["cube"]),
+        _run_chart("create_boxplot_from_cube", FILTER_YEARS),
+    ),
+    "create_bar_mean_by_province": (
+        lambda inputs: pd.read_parquet(inputs["stats"]),
+        _run_chart("create_bar_mean_by_province", "toan", FILTER_YEARS),
+    ),
+    "create_scatter_for_combination": (_plot_frame, _run_chart("create_scatter_for_combination", COMBINATION)),
+    "create_density_for_combination": (_main_frame, _run_chart("create_density_for_combination", COMBINATION)),
+    "create_scatter_clusters": (
+        lambda inputs: _clustered_frame(inputs).sample(frac=1.0, random_state=42).head(100_000),
+        _run_chart("create_scatter_clusters", CLUSTER_SUBJECTS),
+    ),
+    "create_density_clusters": (_clustered_frame, _run_chart("create_density_clusters", CLUSTER_SUBJECTS)),
+    "create_at_least_curve": (lambda inputs: pd.read_parquet(inputs["cdf"]), _run_at_least_curve),
+}
+
+
+def run_scenario(name: str, inputs: Dict[str, str], repeat: int) -> dict:
+    """
+    Chạy một kịch bản trong tiến trình hiện tại (được gọi trong tiến trình con).
+    Trả về thời gian tốt nhất trong `repeat` lần, peak RSS và phần tăng thêm so với sau bước setup.
+    """
+    # Nạp trước các module (kể cả các thư viện mà ứng dụng chỉ import khi dùng)
+    # để thời gian import không bị tính vào lần chạy đầu
+    import app.charts, app.clustering, app.data_access, app.score_lookup  # noqa: F401
+    import etl.arrow_engine, etl.build_aggregates, etl.preprocess  # noqa: F401
+    import plotly.express, sklearn.cluster, sklearn.preprocessing  # noqa: F401
+
+    _reset_peak_rss()
+    setup, run = SCENARIOS[name]
+    data = setup(inputs)
+    baseline = _peak_rss_mb()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(data)
+        times.append(time.perf_counter() - start)
+    peak = _peak_rss_mb()
+    return {
+        "scenario": name,
+        "seconds": min(times),
+        "peak_rss_mb": peak,
+        "rss_delta_mb": peak - baseline,
+    }
+
+
+def run_isolated(name: str, inputs: Dict[str, str], repeat: int) -> dict:
+    # Tiến trình con mới cho mỗi kịch bản (spawn để không kế thừa bộ nhớ của tiến trình cha)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_scenario, name, inputs, repeat).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100000,1000000,5000000", help="Các quy mô (số dòng), cách nhau bởi dấu phẩy.")
+    parser.add_argument("--scenarios", default="", help="Chỉ chạy các kịch bản có tên chứa một trong các chuỗi này.")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", type=Path, default=Path("/tmp/thpt_bench"))
+    parser.add_argument("--json", type=Path, default=None, help="Ghi kết quả ra file JSON.")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    filters = [s for s in args.scenarios.split(",") if s]
+    names = [n for n in SCENARIOS if not filters or any(f in n for f in filters)]
+
+    results: List[dict] = []
+    for n_rows in sizes:
+        inputs = prepare_inputs(args.workdir, n_rows, seed=args.seed)
+        print(f"\n== {n_rows:,} dòng ==")
+        print(f"{'Kịch bản':<36}{'Thời gian (s)':>15}{'Peak RSS (MB)':>15}{'Tăng (MB)':>12}")
+        for name in names:
+            result = dict(run_isolated(name, inputs, args.repeat), rows=n_rows)
+            results.append(result)
+            print(
+                f"{name:<36}{result['seconds']:>15.3f}"
+                f"{result['peak_rss_mb']:>15.0f}{result['rss_delta_mb']:>12.0f}"
+            )
+
+    if args.json:
+        args.json.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\nĐã ghi kết quả vào {args.json}")
+
+
+if __name__ == "__main__":
+    main()
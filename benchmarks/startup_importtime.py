@@ -0,0 +1,129 @@
+# benchmarks/startup_importtime.py
+"""
+Đo thời gian khởi động nguội của ứng dụng (import main_app trong tiến trình Python mới)
+bằng `python -X importtime` và kiểm tra ngân sách để phát hiện hồi quy:
+
+- Phần của ứng dụng = thời gian import main_app khi các thư viện nền bắt buộc
+  (streamlit, pandas, pyarrow.dataset) đã được nạp trước trong cùng tiến trình; so với --budget-ms
+- Các module nặng chỉ được nạp khi dùng (sklearn, plotly.express) không được xuất hiện
+  lúc khởi động (--forbid)
+- --max-total-ms: giới hạn tuyệt đối cho tổng thời gian (tùy máy, mặc định không kiểm tra)
+
+Thoát với mã 1 nếu vượt ngân sách, dùng được trong CI.
+
+Chạy: python -m benchmarks.startup_importtime --runs 5 --budget-ms 150
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+BASELINE_MODULES = ["streamlit", "pandas", "pyarrow.dataset"]
+DEFAULT_FORBIDDEN = ["sklearn", "plotly.express"]
+
+# Một dòng của -X importtime: "import time: <self us> | <cumulative us> | <khoảng trắng><module>"
+ImportRecord = Tuple[str, int, int, int]
+
+
+def parse_importtime(stderr: str) -> List[ImportRecord]:
+    """
+    Trả về danh sách (module, độ sâu lồng, self us, cumulative us).
+    """
+    records = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        self_us, cumulative_us, name = int(parts[0]), int(parts[1]), parts[2]
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        records.append((name.strip(), depth, self_us, cumulative_us))
+    return records
+
+
+def measure_imports(statement: str) -> List[ImportRecord]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=BASE_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_importtime(result.stderr)
+
+
+def top_level_total_ms(records: List[ImportRecord]) -> float:
+    # Tổng cumulative của các import cấp cao nhất = thời gian của cả câu lệnh import
+    return sum(cum for _, depth, _, cum in records if depth == 0) / 1000
+
+
+def module_cumulative_ms(records: List[ImportRecord], module: str) -> float:
+    return sum(cum for name, depth, _, cum in records if depth == 0 and name == module) / 1000
+
+
+def median_run(statement: str, runs: int, module: str = "") -> Tuple[float, List[ImportRecord]]:
+    """
+    Trung vị qua `runs` tiến trình mới của tổng thời gian import (hoặc của riêng `module`
+    nếu truyền vào), kèm chi tiết của lần đo cuối.
+    """
+    # Lần đầu có thể phải biên dịch .pyc nên bỏ qua
+    measure_imports(statement)
+    totals = []
+    records: List[ImportRecord] = []
+    for _ in range(runs):
+        records = measure_imports(statement)
+        totals.append(module_cumulative_ms(records, module) if module else top_level_total_ms(records))
+    return statistics.median(totals), records
+
+
+def heaviest_imports(records: List[ImportRecord], depth: int, top: int) -> List[Tuple[str, float]]:
+    by_module: Dict[str, float] = {}
+    for name, d, _, cum in records:
+        if d == depth:
+            by_module[name] = cum / 1000
+    return sorted(by_module.items(), key=lambda item: -item[1])[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main_app", help="Module cần đo (mặc định main_app).")
+    parser.add_argument("--runs", type=int, default=5, help="Số lần đo, lấy trung vị.")
+    parser.add_argument("--budget-ms", type=float, default=150.0, help="Ngân sách cho phần của ứng dụng (ms).")
+    parser.add_argument("--max-total-ms", type=float, default=None, help="Giới hạn tổng thời gian import (ms).")
+    parser.add_argument("--forbid", default=",".join(DEFAULT_FORBIDDEN), help="Module không được nạp lúc khởi động.")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    total_ms, records = median_run(f"import {args.module}", args.runs)
+    app_ms, _ = median_run("import " + ", ".join(BASELINE_MODULES + [args.module]), args.runs, args.module)
+
+    print(f"Import {args.module}: {total_ms:.0f} ms (trung vị {args.runs} lần)")
+    print(f"Thư viện nền ({', '.join(BASELINE_MODULES)}): {total_ms - app_ms:.0f} ms")
+    print(f"Phần của ứng dụng: {app_ms:.0f} ms (ngân sách {args.budget_ms:.0f} ms)")
+    print(f"\nCác import trực tiếp nặng nhất của {args.module}:")
+    for name, ms in heaviest_imports(records, depth=1, top=args.top):
+        print(f"  {name:<40}{ms:>10.1f} ms")
+
+    failures = []
+    loaded = {name for name, _, _, _ in records}
+    for module in [m for m in args.forbid.split(",") if m]:
+        if module in loaded:
+            failures.append(f"{module} bị nạp lúc khởi động (cần import trong hàm sử dụng)")
+    if app_ms > args.budget_ms:
+        failures.append(f"phần của ứng dụng {app_ms:.0f} ms vượt ngân sách {args.budget_ms:.0f} ms")
+    if args.max_total_ms is not None and total_ms > args.max_total_ms:
+        failures.append(f"tổng {total_ms:.0f} ms vượt giới hạn {args.max_total_ms:.0f} ms")
+
+    if failures:
+        print("\nKHÔNG ĐẠT:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("\nĐạt ngân sách khởi động.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# benchmarks/synthetic_data.py
+"""
+Sinh dữ liệu điểm thi giả lập có tính tất định, cùng định dạng với data_raw/thptYYYY.csv,
+để đo hiệu năng ETL và ứng dụng mà không cần dữ liệu thật.
+
+- SBD 8 chữ số, 2 chữ số đầu là mã tỉnh hợp lệ trong MA_TINH_TO_TEN (tỉnh lớn nhiều thí sinh hơn)
+- Điểm trên lưới rời rạc: Toán và Ngoại ngữ bước 0.2, các môn còn lại bước 0.25
+- Thí sinh chọn tổ hợp KHTN (Lý, Hóa, Sinh) hoặc KHXH (Sử, Địa, GDCD), môn không thi để trống;
+  một phần nhỏ bỏ thi Ngoại ngữ/Văn, vài giá trị ngoài khoảng [0, 10] và dấu phẩy thập phân
+- Tên cột khác nhau theo năm giống dữ liệu thật: năm chẵn "sbd, ngu_van, ..." còn năm lẻ
+  "SBD, nguvan, ..."
+
+Chạy: python -m benchmarks.synthetic_data --rows 1000000 --out /tmp/thpt_raw
+"""
+
+import argparse
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from etl.province_mapping import MA_TINH_TO_TEN
+
+DEFAULT_YEARS = (2020, 2021, 2022, 2023, 2024)
+
+# Tên cột thô theo hai kiểu đặt tên đã gặp trong dữ liệu các năm
+RAW_COLUMN_VARIANTS = {
+    "underscore": {
+        "sbd": "sbd", "toan": "toan", "van": "ngu_van", "anh": "ngoai_ngu",
+        "ly": "vat_li", "hoa": "hoa_hoc", "sinh": "sinh_hoc",
+        "su": "lich_su", "dia": "dia_li", "gdcd": "gdcd", "ma_ngoai_ngu": "ma_ngoai_ngu",
+    },
+    "compact": {
+        "sbd": "SBD", "toan": "toan", "van": "nguvan", "anh": "ngoaingu",
+        "ly": "vatli", "hoa": "hoahoc", "sinh": "sinhhoc",
+        "su": "lichsu", "dia": "diali", "gdcd": "gdcd", "ma_ngoai_ngu": "ma_ngoai_ngu",
+    },
+}
+
+# (trung bình, độ lệch chuẩn, bước lưới) của từng môn
+SCORE_PROFILES = {
+    "toan": (6.3, 1.6, 0.2),
+    "van": (6.9, 1.3, 0.25),
+    "anh": (5.5, 1.9, 0.2),
+    "ly": (6.6, 1.4, 0.25),
+    "hoa": (6.7, 1.5, 0.25),
+    "sinh": (6.2, 1.3, 0.25),
+    "su": (6.0, 1.6, 0.25),
+    "dia": (7.0, 1.2, 0.25),
+    "gdcd": (8.1, 1.0, 0.25),
+}
+
+KHTN_SUBJECTS = ["ly", "hoa", "sinh"]
+KHXH_SUBJECTS = ["su", "dia", "gdcd"]
+FOREIGN_LANGUAGE_CODES = ["N1", "N2", "N3", "N4", "N5", "N6"]
+
+
+def _province_weights(codes: np.ndarray) -> np.ndarray:
+    # Hà Nội và TP.HCM đông thí sinh nhất, các tỉnh còn lại gần đều
+    weights = np.ones(len(codes))
+    weights[codes == "01"] = 8.0
+    weights[codes == "02"] = 7.0
+    return weights / weights.sum()
+
+
+def _grid_scores(rng: np.random.Generator, n: int, mean: float, std: float, step: float) -> np.ndarray:
+    raw = np.clip(rng.normal(mean, std, size=n), 0, 10)
+    return np.round(np.round(raw / step) * step, 2)
+
+
+def _format_scores(scores: np.ndarray, decimal_comma: bool) -> np.ndarray:
+    text = np.char.mod("%g", scores).astype(object)
+    text[np.isnan(scores)] = ""
+    if decimal_comma:
+        text = np.char.replace(text.astype(str), ".", ",").astype(object)
+    return text
+
+
+def generate_year_frame(
+    year: int,
+    n_rows: int,
+    seed: int = 0,
+    column_style: Optional[str] = None,
+    decimal_comma: bool = False,
+) -> pd.DataFrame:
+    """
+    Sinh bảng điểm thô (mọi cột là chuỗi, như khi đọc CSV với dtype=str) của một năm.
+    Cùng (year, n_rows, seed) luôn cho cùng kết quả.
+    """
+    rng = np.random.default_rng([seed, year])
+    if column_style is None:
+        column_style = "underscore" if year % 2 == 0 else "compact"
+    names = RAW_COLUMN_VARIANTS[column_style]
+
+    codes = np.array(sorted(MA_TINH_TO_TEN))
+    province = rng.choice(codes, size=n_rows, p=_province_weights(codes))
+    # Số thứ tự trong tỉnh: 6 chữ số sau mã tỉnh (SBD không trùng trong một tỉnh)
+    order_in_province = pd.Series(province).groupby(province).cumcount().to_numpy()
+    sequence = np.char.zfill((order_in_province % 1_000_000).astype(str), 6)
+    sbd = np.char.add(province.astype(str), sequence)
+
+    data = {names["sbd"]: sbd.astype(object)}
+    is_khtn = rng.random(n_rows) < 0.45
+    for subject, (mean, std, step) in SCORE_PROFILES.items():
+        scores = _grid_scores(rng, n_rows, mean, std, step)
+        if subject in KHTN_SUBJECTS:
+            scores[~is_khtn] = np.nan
+        elif subject in KHXH_SUBJECTS:
+            scores[is_khtn] = np.nan
+        missing_rate = {"anh": 0.06, "van": 0.01}.get(subject, 0.005)
+        scores[rng.random(n_rows) < missing_rate] = np.nan
+        data[names[subject]] = _format_scores(scores, decimal_comma)
+
+    # Một vài giá trị ngoài khoảng hợp lệ mà ETL phải loại bỏ
+    bad_rows = rng.random(n_rows) < 0.0005
+    data[names["toan"]][bad_rows] = rng.choice(["-1", "11", "abc"], size=int(bad_rows.sum()))
+
+    has_language = data[names["anh"]] != ""
+    language = rng.choice(FOREIGN_LANGUAGE_CODES, size=n_rows, p=[0.9, 0.02, 0.02, 0.02, 0.02, 0.02])
+    data[names["ma_ngoai_ngu"]] = np.where(has_language, language, "").astype(object)
+
+    return pd.DataFrame(data)
+
+
+def write_year_csv(path: Path, year: int, n_rows: int, seed: int = 0, **kwargs) -> Path:
+    """
+    Ghi thptYYYY.csv giả lập vào `path` (thư mục hoặc đường dẫn file).
+    """
+    path = Path(path)
+    if path.suffix != ".csv":
+        path = path / f"thpt{year}.csv"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    generate_year_frame(year, n_rows, seed=seed, **kwargs).to_csv(path, index=False)
+    return path
+
+
+def write_raw_files(
+    out_dir: Path,
+    n_rows: int,
+    years: Iterable[int] = DEFAULT_YEARS,
+    seed: int = 0,
+) -> Dict[int, Path]:
+    """
+    Ghi các file thptYYYY.csv (mỗi năm `n_rows` dòng) vào `out_dir`.
+    Năm 2022 dùng dấu phẩy thập phân để ETL phải xử lý cả trường hợp này.
+    """
+    return {
+        year: write_year_csv(out_dir, year, n_rows, seed=seed, decimal_comma=(year == 2022))
+        for year in years
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000, help="Số dòng mỗi năm.")
+    parser.add_argument("--years", default=",".join(map(str, DEFAULT_YEARS)))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, required=True, help="Thư mục ghi các file thptYYYY.csv.")
+    args = parser.parse_args()
+
+    years = [int(y) for y in args.years.split(",") if y]
+    for year, path in write_raw_files(args.out, args.rows, years, seed=args.seed).items():
+        print(f"Đã ghi {args.rows} dòng năm {year} vào {path}")
+
+
+if __name__ == "__main__":
+    main()
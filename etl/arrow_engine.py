@@ -0,0 +1,198 @@
+# etl/arrow_engine.py
+"""
+Engine ETL thuần Arrow (chọn bằng `python -m etl.run_all --engine arrow`).
+
+Đọc CSV bằng pyarrow.csv (đa luồng, mọi cột khai báo kiểu chuỗi, chỉ đọc các cột cần
+thiết) và xử lý hoàn toàn bằng pyarrow.compute: đổi tên cột, sửa dấu phẩy thập phân,
+loại điểm ngoài [0, 10], giải mã tỉnh theo tiền tố SBD, tính tổng khối và điểm trung
+bình. Kết quả là bảng Arrow theo đúng output_arrow_schema(), ghi thẳng ra Parquet
+không qua pandas; giá trị giống engine pandas (load_raw_year + to_output_table).
+"""
+
+import csv
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+
+from .config import SUBJECT_COLUMNS, COMBINATION_DEFINITIONS
+from .instrumentation import instrumented
+from .province_mapping import MA_TINH_TO_TEN, MA_TINH_CATEGORIES, TINH_THANH_CATEGORIES
+from .schema import output_arrow_schema
+
+# Các chuỗi được coi là rỗng, giống mặc định của pandas.read_csv
+NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+
+# Số thập phân hợp lệ (sau khi đã đổi dấu phẩy thành dấu chấm và bỏ khoảng trắng);
+# chuỗi không khớp được coi là thiếu điểm như pd.to_numeric(errors="coerce")
+_NUMBER_PATTERN = r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$"
+
+# Ước lượng số byte mỗi dòng CSV để đổi chunksize (số dòng) sang block_size (byte)
+_BYTES_PER_ROW = 80
+
+_MA_TINH_LENGTHS = sorted({len(ma) for ma in MA_TINH_TO_TEN})
+_MA_TINH_VALUES = pa.array(list(MA_TINH_CATEGORIES), type=pa.string())
+_TINH_THANH_VALUES = pa.array(list(TINH_THANH_CATEGORIES), type=pa.string())
+
+
+def _raw_column_map(path: Path) -> Dict[str, str]:
+    """
+    Đọc dòng tiêu đề và trả về {tên cột thô: tên cột chuẩn} cho các cột cần giữ
+    (cùng quy tắc chuẩn hóa tên cột với engine pandas).
+    """
+    from .preprocess import RAW_TO_STANDARD_COLUMNS, normalize_column_name  # tránh import vòng
+
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        header = next(csv.reader(f), [])
+
+    column_map: Dict[str, str] = {}
+    for raw in header:
+        standard = RAW_TO_STANDARD_COLUMNS.get(normalize_column_name(raw))
+        if standard is not None and standard not in column_map.values():
+            column_map[raw] = standard
+
+    if "sbd" not in column_map.values():
+        raise ValueError(
+            f"File {path} không có cột số báo danh sau khi chuẩn hóa. "
+            f"Các cột hiện có: {[normalize_column_name(c) for c in header]}"
+        )
+    return column_map
+
+
+def _csv_options(column_map: Dict[str, str], block_size: Optional[int] = None):
+    read_options = pacsv.ReadOptions(use_threads=True)
+    if block_size:
+        read_options.block_size = block_size
+    convert_options = pacsv.ConvertOptions(
+        column_types={raw: pa.string() for raw in column_map},
+        include_columns=list(column_map),
+        null_values=NA_VALUES,
+        strings_can_be_null=True,
+    )
+    return read_options, convert_options
+
+
+def _parse_scores(values: pa.ChunkedArray) -> pa.ChunkedArray:
+    """
+    Chuỗi điểm -> float64: đổi dấu phẩy thập phân, chuỗi không phải số và điểm
+    ngoài [0, 10] thành null.
+    """
+    text = pc.utf8_trim_whitespace(pc.replace_substring(values, ",", "."))
+    is_number = pc.match_substring_regex(text, _NUMBER_PATTERN)
+    scores = pc.cast(pc.if_else(is_number, text, pa.scalar(None, pa.string())), pa.float64())
+    in_range = pc.and_(pc.greater_equal(scores, 0.0), pc.less_equal(scores, 10.0))
+    return pc.if_else(in_range, scores, pa.scalar(None, pa.float64()))
+
+
+def _province_codes(sbd: pa.ChunkedArray) -> pa.ChunkedArray:
+    """
+    Vị trí mã tỉnh trong MA_TINH_CATEGORIES theo tiền tố SBD (2 rồi 3 ký tự), null nếu không rõ.
+    Khớp với decode_province_series của engine pandas.
+    """
+    text = pc.utf8_trim_whitespace(sbd)
+    codes = None
+    for length in _MA_TINH_LENGTHS:
+        prefix = pc.utf8_slice_codeunits(text, 0, length)
+        found = pc.index_in(prefix, value_set=_MA_TINH_VALUES)
+        codes = found if codes is None else pc.coalesce(codes, found)
+    return pc.cast(codes, pa.int8())
+
+
+def _dictionary_column(indices: pa.ChunkedArray, dictionary: pa.Array) -> pa.ChunkedArray:
+    return pa.chunked_array(
+        [pa.DictionaryArray.from_arrays(chunk, dictionary) for chunk in indices.chunks],
+        type=pa.dictionary(pa.int8(), pa.string()),
+    )
+
+
+def _language_column(values: pa.ChunkedArray) -> pa.ChunkedArray:
+    # Từ điển là các mã sắp tăng dần, giống astype("category") của pandas
+    dictionary = pc.unique(values).drop_null()
+    dictionary = dictionary.take(pc.array_sort_indices(dictionary))
+    return _dictionary_column(pc.cast(pc.index_in(values, value_set=dictionary), pa.int8()), dictionary)
+
+
+def _sum_propagating_null(columns: List[pa.ChunkedArray]) -> pa.ChunkedArray:
+    total = columns[0]
+    for column in columns[1:]:
+        total = pc.add(total, column)
+    return total
+
+
+def process_raw_table(table: pa.Table, year: int, column_map: Dict[str, str]) -> pa.Table:
+    """
+    Xử lý một bảng (hoặc một lô) CSV thô thành bảng theo output_arrow_schema().
+    """
+    schema = output_arrow_schema()
+    n_rows = table.num_rows
+    raw = {column_map[name]: table[name] for name in table.column_names}
+
+    columns: Dict[str, pa.ChunkedArray] = {"sbd": raw["sbd"]}
+    scores = {s: _parse_scores(raw[s]) for s in SUBJECT_COLUMNS if s in raw}
+    columns.update(scores)
+    if "ma_ngoai_ngu" in raw:
+        columns["ma_ngoai_ngu"] = _language_column(raw["ma_ngoai_ngu"])
+    columns["nam"] = pa.chunked_array([np.full(n_rows, year, dtype=np.int16)], type=pa.int16())
+
+    codes = _province_codes(raw["sbd"])
+    columns["ma_tinh"] = _dictionary_column(codes, _MA_TINH_VALUES)
+    columns["tinh_thanh"] = _dictionary_column(codes, _TINH_THANH_VALUES)
+
+    for code, subjects in COMBINATION_DEFINITIONS.items():
+        exist_subjects = [s for s in subjects if s in scores]
+        if exist_subjects:
+            columns[f"tong_{code}"] = _sum_propagating_null([scores[s] for s in exist_subjects])
+
+    if scores:
+        # Trung bình trên các môn có điểm; không có môn nào thì để trống
+        total = _sum_propagating_null([pc.fill_null(v, 0.0) for v in scores.values()])
+        count = _sum_propagating_null([pc.cast(pc.is_valid(v), pa.int32()) for v in scores.values()])
+        mean = pc.divide(total, pc.cast(count, pa.float64()))
+        columns["diem_trung_binh"] = pc.if_else(pc.greater(count, 0), mean, pa.scalar(None, pa.float64()))
+
+    arrays = []
+    for field in schema:
+        if field.name in columns:
+            arrays.append(pc.cast(columns[field.name], field.type))
+        else:
+            # Cột không có trong file thô được để trống như engine pandas
+            arrays.append(pa.chunked_array([pa.nulls(n_rows, field.type)]))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+@instrumented()
+def load_raw_year_arrow(path: Path, year: int) -> pa.Table:
+    """
+    Tương đương load_raw_year nhưng đọc và xử lý hoàn toàn bằng Arrow, trả về pa.Table.
+    """
+    column_map = _raw_column_map(path)
+    read_options, convert_options = _csv_options(column_map)
+    table = pacsv.read_csv(path, read_options=read_options, convert_options=convert_options)
+    return process_raw_table(table, year, column_map)
+
+
+def iter_raw_year_tables(
+    path: Path,
+    year: int,
+    chunksize: Optional[int] = None,
+) -> Iterator[pa.Table]:
+    """
+    Đọc dữ liệu thô của một năm thành các bảng Arrow đã xử lý. Có chunksize thì đọc
+    tuần tự theo khối (khoảng chunksize dòng mỗi khối, ước lượng theo số byte),
+    không thì đọc cả file một lần.
+    """
+    if not chunksize:
+        yield load_raw_year_arrow(path, year)
+        return
+
+    column_map = _raw_column_map(path)
+    read_options, convert_options = _csv_options(column_map, block_size=chunksize * _BYTES_PER_ROW)
+    with pacsv.open_csv(path, read_options=read_options, convert_options=convert_options) as reader:
+        for batch in reader:
+            yield process_raw_table(pa.Table.from_batches([batch]), year, column_map)
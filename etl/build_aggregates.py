@@ -1,47 +1,331 @@
 # etl/build_aggregates.py
 
+from typing import Iterable, List, Tuple
+
+import numpy as np
 import pandas as pd
+import pyarrow.dataset as ds
 
-from .config import SUBJECT_COLUMNS, AGG_SUBJECT_PROVINCE_FILE, PROCESSED_DIR, MAIN_DATA_FILE
+from .config import (
+    SUBJECT_COLUMNS,
+    COMBINATION_DEFINITIONS,
+    AGG_SUBJECT_PROVINCE_FILE,
+    HISTOGRAM_CUBE_FILE,
+    COMBINATION_CDF_FILE,
+    SCORE_BIN_WIDTH,
+    MAX_SCORE,
+    PROCESSED_DIR,
+    MAIN_DATA_FILE,
+    MAIN_DATASET_DIR,
+)
+from .instrumentation import instrumented, stage
+from .preprocess import open_main_dataset
+from .province_mapping import MA_TINH_TO_TEN, MA_TINH_CATEGORIES, TINH_THANH_CATEGORIES
+from .schema import output_arrow_schema, scores_as_float64, SCORE_DECIMALS
 
 
+@instrumented()
 def load_main_data() -> pd.DataFrame:
     if not MAIN_DATA_FILE.exists():
         raise RuntimeError(
-            f"Không tìm thấy file {MAIN_DATA_FILE}. Hãy chạy preprocess.build_all_years trước."
+            f"Không tìm thấy file {MAIN_DATA_FILE}. Hãy chạy ETL trước (python -m etl.run_all)."
         )
     return pd.read_parquet(MAIN_DATA_FILE)
 
 
+@instrumented()
+def load_main_data_years(years: Iterable[int]) -> pd.DataFrame:
+    """
+    Chỉ đọc các năm được chọn từ bộ dữ liệu phân vùng MAIN_DATASET_DIR.
+    """
+    schema = output_arrow_schema()
+    dataset = open_main_dataset(MAIN_DATASET_DIR)
+    table = dataset.to_table(filter=ds.field("nam").isin(list(years)))
+    return table.select(schema.names).cast(schema).to_pandas()
+
+
+STAT_COLUMNS = ["mean", "median", "min", "max", "count"]
+# Các thành phần cộng dồn được giữa các năm/tỉnh (xem app/aggregation.py)
+ADDITIVE_COLUMNS = ["sum", "sum_sq", "histogram"]
+N_SCORE_BINS = int(round(MAX_SCORE / SCORE_BIN_WIDTH)) + 1
+# Điểm tổ hợp (tổng 3 môn) từ 0 đến 3 * MAX_SCORE trên cùng lưới
+N_COMBINATION_BINS = int(round(3 * MAX_SCORE / SCORE_BIN_WIDTH)) + 1
+
+# Giới hạn số ô (nhóm x giá trị điểm) của bảng đếm; vượt quá thì tính bằng sắp xếp
+_MAX_HISTOGRAM_CELLS = 20_000_000
+
+
+def _group_codes(df: pd.DataFrame, keys: List[str]) -> Tuple[np.ndarray, pd.DataFrame]:
+    """
+    Gán mã nhóm 0..G-1 cho từng dòng theo `keys` (thứ tự nhóm giống groupby(sort=True),
+    giá trị thiếu xếp cuối). Trả về (mã nhóm, bảng khóa của từng nhóm).
+    """
+    combined = np.zeros(len(df), dtype=np.int64)
+    uniques_list = []
+    for key in keys:
+        key_codes, uniques = pd.factorize(df[key], sort=True, use_na_sentinel=False)
+        combined = combined * len(uniques) + key_codes
+        uniques_list.append(uniques)
+
+    sizes = [len(u) for u in uniques_list]
+    present = np.bincount(combined, minlength=int(np.prod(sizes))) > 0
+    remap = np.cumsum(present) - 1
+    codes = remap[combined]
+
+    observed = np.unravel_index(np.flatnonzero(present), sizes)
+    keys_df = pd.DataFrame(
+        {key: uniques.take(idx) for key, uniques, idx in zip(keys, uniques_list, observed)}
+    )
+    return codes, keys_df
+
+
+def _subject_stats(codes: np.ndarray, values: np.ndarray, n_groups: int) -> dict:
+    """
+    mean/median/min/max/count của `values` theo mã nhóm, bỏ qua NaN.
+    Điểm thi nằm trên lưới rời rạc nên đếm theo (nhóm, giá trị) rồi đọc trung vị
+    từ tổng tích lũy; nếu có quá nhiều giá trị khác nhau thì sắp xếp trong từng nhóm.
+    """
+    valid = ~np.isnan(values)
+    group = codes[valid]
+    x = values[valid]
+    count = np.bincount(group, minlength=n_groups)
+    total = np.bincount(group, weights=x, minlength=n_groups)
+    total_sq = np.bincount(group, weights=x * x, minlength=n_groups)
+    has_data = count > 0
+    if not has_data.any():
+        empty = np.full(n_groups, np.nan)
+        return {
+            "mean": empty, "median": empty, "min": empty, "max": empty,
+            "count": count.astype(np.int64), "sum": total, "sum_sq": total_sq,
+        }
+
+    # Hạng (tính từ 0) của hai phần tử giữa trong mỗi nhóm
+    lo_rank = np.maximum(count - 1, 0) // 2
+    hi_rank = count // 2
+
+    value_codes, grid = pd.factorize(x, sort=True)
+    n_values = len(grid)
+    if n_groups * n_values <= _MAX_HISTOGRAM_CELLS:
+        grid = np.asarray(grid, dtype=np.float64)
+        hist = np.bincount(
+            group * n_values + value_codes, minlength=n_groups * n_values
+        ).reshape(n_groups, n_values)
+        cum = np.cumsum(hist, axis=1)
+        vmin = grid[np.argmax(hist > 0, axis=1)]
+        vmax = grid[n_values - 1 - np.argmax(hist[:, ::-1] > 0, axis=1)]
+        lo = grid[np.minimum((cum <= lo_rank[:, None]).sum(axis=1), n_values - 1)]
+        hi = grid[np.minimum((cum <= hi_rank[:, None]).sum(axis=1), n_values - 1)]
+    else:
+        xs = x[np.lexsort((x, group))]
+        starts = np.concatenate(([0], np.cumsum(count)[:-1]))
+        last_index = len(xs) - 1
+        vmin = xs[np.minimum(starts, last_index)]
+        vmax = xs[np.clip(starts + count - 1, 0, last_index)]
+        lo = xs[np.minimum(starts + lo_rank, last_index)]
+        hi = xs[np.minimum(starts + hi_rank, last_index)]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+    return {
+        "mean": np.where(has_data, mean, np.nan),
+        "median": np.where(has_data, (lo + hi) / 2, np.nan),
+        "min": np.where(has_data, vmin, np.nan),
+        "max": np.where(has_data, vmax, np.nan),
+        "count": count.astype(np.int64),
+        "sum": total,
+        "sum_sq": total_sq,
+    }
+
+
+def _grid_histogram(
+    codes: np.ndarray,
+    values: np.ndarray,
+    n_groups: int,
+    n_bins: int = N_SCORE_BINS,
+) -> np.ndarray:
+    """
+    Số thí sinh theo (nhóm, ô điểm) trên lưới SCORE_BIN_WIDTH, dạng mảng (n_groups, n_bins).
+    """
+    valid = ~np.isnan(values)
+    bins = np.rint(values[valid] / SCORE_BIN_WIDTH).astype(np.int64)
+    counts = np.bincount(codes[valid] * n_bins + bins, minlength=n_groups * n_bins)
+    return counts.reshape(n_groups, n_bins)
+
+
+@instrumented()
 def build_subject_stats_by_province(df: pd.DataFrame) -> pd.DataFrame:
     """
     Tao bang thong ke diem tung mon theo nam va tinh_thanh.
+
+    Chi gom nhom mot lan theo (nam, tinh_thanh) cho tat ca cac mon, moi mon
+    tinh mean/median/min/max/count bang bang dem theo nhom, roi xuat ra
+    dang dai (moi dong la mot bo nam, tinh_thanh, mon).
+
+    Kem theo cac thanh phan cong don duoc: sum, sum_sq va histogram (so thi sinh
+    tren luoi SCORE_BIN_WIDTH) de gop chinh xac nhieu nam ma khong doc lai du lieu.
     """
-    frames = []
+    subjects = [mon for mon in SUBJECT_COLUMNS if mon in df.columns]
+    if not subjects:
+        raise RuntimeError("Không có môn học nào để thống kê.")
 
-    for mon in SUBJECT_COLUMNS:
-        if mon not in df.columns:
-            continue
+    codes, keys_df = _group_codes(df, ["nam", "tinh_thanh"])
 
-        group = (
-            df.groupby(["nam", "tinh_thanh"], dropna=False)[mon]
-            .agg(["mean", "median", "min", "max", "count"])
-            .reset_index()
-        )
+    frames = []
+    for mon in subjects:
+        values = scores_as_float64(df[mon])
+        group = keys_df.copy()
+        for stat, arr in _subject_stats(codes, values, len(keys_df)).items():
+            group[stat] = arr
+        group["histogram"] = list(_grid_histogram(codes, values, len(keys_df)).astype(np.int32))
         group["mon"] = mon
         frames.append(group)
 
-    if not frames:
-        raise RuntimeError("Không có môn học nào để thống kê.")
-
     result = pd.concat(frames, ignore_index=True)
     return result
 
 
+@instrumented()
+def build_score_histogram_cube(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Tao histogram dung san: so thi sinh theo (nam, ma_tinh, mon, diem) tren luoi
+    SCORE_BIN_WIDTH (0.05). Chi giu cac o co thi sinh. Ung dung cong cac lat cat
+    cua bang nay de ve histogram chinh xac ma khong can doc du lieu tung dong.
+    """
+    subjects = [mon for mon in SUBJECT_COLUMNS if mon in df.columns]
+    if not subjects:
+        raise RuntimeError("Không có môn học nào để thống kê.")
+
+    codes, keys_df = _group_codes(df, ["nam", "ma_tinh"])
+    keys_df["tinh_thanh"] = (
+        keys_df["ma_tinh"].astype(object).map(MA_TINH_TO_TEN)
+        .astype(pd.CategoricalDtype(TINH_THANH_CATEGORIES))
+    )
+    n_groups = len(keys_df)
+
+    frames = []
+    for mon in subjects:
+        counts = _grid_histogram(codes, scores_as_float64(df[mon]), n_groups).ravel()
+        cells = np.flatnonzero(counts)
+        group_idx, bin_idx = np.divmod(cells, N_SCORE_BINS)
+
+        frame = keys_df.iloc[group_idx].reset_index(drop=True)
+        frame["mon"] = mon
+        frame["diem"] = np.round(bin_idx * SCORE_BIN_WIDTH, SCORE_DECIMALS)
+        frame["so_luong"] = counts[cells].astype(np.int64)
+        frames.append(frame)
+
+    return pd.concat(frames, ignore_index=True)
+
+
+@instrumented()
+def build_combination_cdf(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Tạo bảng phân phối điểm tổ hợp theo (nam, ma_tinh, to_hop) trên lưới
+    SCORE_BIN_WIDTH: mỗi dòng là một mức điểm có thí sinh, gồm so_luong (số thí
+    sinh đúng bằng mức đó) và so_luong_tu_diem (số thí sinh đạt từ mức đó trở lên).
+    Trong mỗi nhóm các dòng xếp theo diem tăng dần, nên ứng dụng trả lời
+    "bao nhiêu thí sinh đạt >= X" bằng tìm kiếm nhị phân, không quét dữ liệu.
+    """
+    combinations = [code for code in COMBINATION_DEFINITIONS if f"tong_{code}" in df.columns]
+    if not combinations:
+        raise RuntimeError("Không có cột điểm tổ hợp nào để thống kê.")
+
+    codes, keys_df = _group_codes(df, ["nam", "ma_tinh"])
+    keys_df["tinh_thanh"] = (
+        keys_df["ma_tinh"].astype(object).map(MA_TINH_TO_TEN)
+        .astype(pd.CategoricalDtype(TINH_THANH_CATEGORIES))
+    )
+    n_groups = len(keys_df)
+
+    frames = []
+    for code in combinations:
+        hist = _grid_histogram(
+            codes, scores_as_float64(df[f"tong_{code}"]), n_groups, n_bins=N_COMBINATION_BINS
+        )
+        # Tổng tích lũy từ phía điểm cao: số thí sinh đạt từ mỗi mức trở lên
+        at_least = np.cumsum(hist[:, ::-1], axis=1)[:, ::-1].ravel()
+        counts = hist.ravel()
+        cells = np.flatnonzero(counts)
+        group_idx, bin_idx = np.divmod(cells, N_COMBINATION_BINS)
+
+        frame = keys_df.iloc[group_idx].reset_index(drop=True)
+        frame["to_hop"] = code
+        frame["diem"] = np.round(bin_idx * SCORE_BIN_WIDTH, SCORE_DECIMALS)
+        frame["so_luong"] = counts[cells].astype(np.int64)
+        frame["so_luong_tu_diem"] = at_least[cells].astype(np.int64)
+        frames.append(frame)
+
+    return pd.concat(frames, ignore_index=True)
+
+
+# Các bảng tổng hợp do ETL tạo: (file, hàm tạo, mô tả)
+AGGREGATE_OUTPUTS = [
+    (AGG_SUBJECT_PROVINCE_FILE, build_subject_stats_by_province, "thống kê môn học theo tỉnh và năm"),
+    (HISTOGRAM_CUBE_FILE, build_score_histogram_cube, "histogram điểm theo năm, tỉnh và môn"),
+    (COMBINATION_CDF_FILE, build_combination_cdf, "phân phối điểm tổ hợp theo năm và tỉnh"),
+]
+
+
+def aggregates_complete() -> bool:
+    return all(path.exists() for path, _, _ in AGGREGATE_OUTPUTS)
+
+
 def run_build_aggregates():
     PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
     df_all = load_main_data()
-    stats_df = build_subject_stats_by_province(df_all)
 
-    print(f"Lưu thống kê môn học theo tỉnh và năm vào {AGG_SUBJECT_PROVINCE_FILE}")
-    stats_df.to_parquet(AGG_SUBJECT_PROVINCE_FILE, index=False)
+    for path, builder, description in AGGREGATE_OUTPUTS:
+        result = builder(df_all)
+        print(f"Lưu {description} vào {path}")
+        with stage(f"write:{path.stem}", rows_in=len(result)):
+            result.to_parquet(path, index=False)
+
+
+def _sort_by_subject_and_year(df: pd.DataFrame) -> pd.DataFrame:
+    # Giữ thứ tự như khi tính toàn bộ: theo môn (hoặc tổ hợp), rồi theo năm
+    if "to_hop" in df.columns:
+        key, order = "to_hop", list(COMBINATION_DEFINITIONS)
+    else:
+        key, order = "mon", SUBJECT_COLUMNS
+    mon_order = {mon: i for i, mon in enumerate(order)}
+    df["_thu_tu_mon"] = df[key].map(mon_order)
+    return (
+        df.sort_values(["_thu_tu_mon", "nam"], kind="mergesort")
+        .drop(columns="_thu_tu_mon")
+        .reset_index(drop=True)
+    )
+
+
+def _restore_province_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    # Dòng cũ đọc từ Parquet chỉ mang các category có mặt, khác tập category cố định
+    # của dòng mới nên pd.concat trả về chuỗi; ép lại để cùng schema với khi tính toàn bộ
+    for column, categories in (("ma_tinh", MA_TINH_CATEGORIES), ("tinh_thanh", TINH_THANH_CATEGORIES)):
+        if column in df.columns:
+            df[column] = df[column].astype(pd.CategoricalDtype(categories))
+    return df
+
+
+def update_aggregates(years: Iterable[int]):
+    """
+    Cập nhật các bảng tổng hợp chỉ cho các năm trong `years`: bỏ các dòng cũ của
+    những năm này rồi tính lại từ phân vùng tương ứng (năm không còn phân vùng
+    thì chỉ bị bỏ). Các năm khác giữ nguyên, không đọc lại dữ liệu.
+    """
+    years = sorted(set(years))
+    if not aggregates_complete():
+        run_build_aggregates()
+        return
+
+    present_years = [y for y in years if (MAIN_DATASET_DIR / f"nam={y}").exists()]
+    df_years = load_main_data_years(present_years) if present_years else None
+
+    for path, builder, description in AGGREGATE_OUTPUTS:
+        old = pd.read_parquet(path)
+        frames = [old[~old["nam"].isin(years)]]
+        if df_years is not None:
+            frames.append(builder(df_years))
+        result = _restore_province_dtypes(_sort_by_subject_and_year(pd.concat(frames, ignore_index=True)))
+
+        print(f"Cập nhật {description} các năm {years} vào {path}")
+        with stage(f"write:{path.stem}", rows_in=len(result)):
+            result.to_parquet(path, index=False)
@@ -37,4 +37,27 @@ COMBINATION_DEFINITIONS = {
 }
 
 MAIN_DATA_FILE = PROCESSED_DIR / "diem_thpt_2020_2024.parquet"
+# Chỉ mục vị trí dòng: MAIN_DATA_FILE được sắp theo (nam, ma_tinh), mỗi nhóm là một đoạn [start, stop)
+ROW_OFFSETS_FILE = PROCESSED_DIR / "chi_muc_dong_nam_tinh.parquet"
+# Bản Arrow IPC (Feather v2) không nén của MAIN_DATA_FILE để ứng dụng memory-map
+MAIN_ARROW_FILE = PROCESSED_DIR / "diem_thpt_2020_2024.arrow"
 AGG_SUBJECT_PROVINCE_FILE = PROCESSED_DIR / "thong_ke_mon_tinh_nam.parquet"
+
+# Histogram dựng sẵn: số thí sinh theo (nam, ma_tinh, mon, diem)
+HISTOGRAM_CUBE_FILE = PROCESSED_DIR / "histogram_diem.parquet"
+
+# Phân phối tích lũy điểm tổ hợp: số thí sinh theo (nam, ma_tinh, to_hop, diem) và số thí sinh đạt từ diem trở lên
+COMBINATION_CDF_FILE = PROCESSED_DIR / "phan_phoi_to_hop.parquet"
+
+# Bước lưới điểm nhỏ nhất của đề thi (0.05; các môn khác dùng 0.2 hoặc 0.25 đều là bội số)
+SCORE_BIN_WIDTH = 0.05
+MAX_SCORE = 10.0
+
+# Bộ dữ liệu Parquet phân vùng kiểu Hive: nam=YYYY/[ma_tinh=XX/]part-*.parquet
+MAIN_DATASET_DIR = PROCESSED_DIR / "diem_thpt_2020_2024"
+
+# Báo cáo đo thời gian/bộ nhớ từng bước của lần chạy ETL gần nhất (etl/instrumentation.py)
+ETL_RUN_REPORT_FILE = PROCESSED_DIR / "etl_run_report.json"
+
+# Kho kết quả phân cụm của ứng dụng (mỗi khóa một file .npz), giữ qua các lần khởi động lại
+CLUSTER_CACHE_DIR = PROCESSED_DIR / "cache_phan_cum"
@@ -0,0 +1,225 @@
+# etl/instrumentation.py
+"""
+Đo từng bước xử lý (của ETL và của mỗi lần ứng dụng chạy lại): thời gian thực,
+thời gian CPU, số dòng vào/ra và thay đổi bộ nhớ (RSS).
+
+- `with recording("etl") as run:` bật ghi cho đoạn mã bên trong, kết quả nằm trong `run.stages`
+- `with stage("loc_du_lieu", rows_in=len(df)) as s: ...; s.rows_out = len(out)` đo một bước
+- `@instrumented()` đo một hàm, tự lấy số dòng của đối số đầu tiên và của kết quả
+
+Ngoài khối `recording()` thì `stage`/`instrumented` không ghi gì và gần như không tốn chi phí.
+Bước lồng nhau được ghi với tên đầy đủ "cha/con". Chỉ đo trong tiến trình hiện tại:
+các tiến trình con (ETL chạy với --jobs > 1) không được ghi.
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, List, NamedTuple, Optional
+
+PERF_LOGGER_NAME = "thpt.perf"
+
+
+class StageRecord(NamedTuple):
+    name: str
+    depth: int
+    wall_s: float
+    cpu_s: float
+    rows_in: Optional[int]
+    rows_out: Optional[int]
+    rss_mb: float
+    rss_delta_mb: float
+
+
+class StageTimer:
+    """
+    Bước đang được đo. Gán `rows_in`/`rows_out` trong khối with nếu lúc bắt đầu chưa biết.
+    """
+
+    def __init__(self, name: str, rows_in: Optional[int] = None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out: Optional[int] = None
+
+
+class RunRecorder:
+    """
+    Kết quả đo của một lần chạy: danh sách bước theo thứ tự kết thúc,
+    cùng tổng thời gian và bộ nhớ đỉnh của cả lần chạy.
+    """
+
+    def __init__(self, label: str):
+        self.label = label
+        self.stages: List[StageRecord] = []
+        self.started_at = time.time()
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        # Lỗi làm lần chạy dừng giữa chừng (nếu có)
+        self.error: Optional[str] = None
+        self._stack: List[str] = []
+
+    def to_dict(self) -> dict:
+        return {
+            "label": self.label,
+            "started_at": self.started_at,
+            "wall_s": round(self.wall_s, 4),
+            "cpu_s": round(self.cpu_s, 4),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "error": self.error,
+            "stages": [
+                {k: round(v, 4) if isinstance(v, float) else v for k, v in s._asdict().items()}
+                for s in self.stages
+            ],
+        }
+
+    def log_line(self) -> str:
+        """
+        Một dòng JSON gọn: tổng thời gian và thời gian thực (giây) theo tên bước.
+        """
+        summary = {
+            "event": self.label,
+            "wall_s": round(self.wall_s, 4),
+            "cpu_s": round(self.cpu_s, 4),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "stages": {},
+        }
+        # Bước lặp lại nhiều lần (vd. vẽ lại biểu đồ sau mỗi epoch) được cộng dồn
+        for s in self.stages:
+            summary["stages"][s.name] = round(summary["stages"].get(s.name, 0.0) + s.wall_s, 4)
+        return json.dumps(summary, ensure_ascii=False, separators=(",", ":"))
+
+    def write_json(self, path: Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        tmp_path.replace(path)
+
+
+_ACTIVE_RUN: contextvars.ContextVar[Optional[RunRecorder]] = contextvars.ContextVar(
+    "thpt_active_run", default=None
+)
+
+
+def current_rss_mb() -> float:
+    # /proc/self/statm: trường thứ hai là số trang đang nằm trong RAM (chỉ có trên Linux)
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss tính bằng KB trên Linux, byte trên macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def row_count(obj) -> Optional[int]:
+    """
+    Số dòng của DataFrame/Series/ndarray/bảng Arrow (qua thuộc tính shape);
+    với tuple thì lấy phần tử đầu. Trả về None nếu không xác định được.
+    """
+    if isinstance(obj, tuple):
+        obj = obj[0] if obj else None
+    shape = getattr(obj, "shape", None)
+    if isinstance(shape, tuple) and shape:
+        return int(shape[0])
+    return None
+
+
+@contextmanager
+def recording(label: str) -> Iterator[RunRecorder]:
+    """
+    Ghi mọi bước `stage`/`instrumented` chạy bên trong khối with vào một RunRecorder.
+    """
+    run = RunRecorder(label)
+    token = _ACTIVE_RUN.set(run)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield run
+    finally:
+        run.wall_s = time.perf_counter() - wall_start
+        run.cpu_s = time.process_time() - cpu_start
+        _ACTIVE_RUN.reset(token)
+
+
+@contextmanager
+def stage(name: str, rows_in: Optional[int] = None) -> Iterator[StageTimer]:
+    """
+    Đo một bước. Bước vẫn được ghi nếu mã bên trong ném lỗi.
+    """
+    timer = StageTimer(name, rows_in)
+    run = _ACTIVE_RUN.get()
+    if run is None:
+        yield timer
+        return
+
+    run._stack.append(name)
+    full_name = "/".join(run._stack)
+    rss_start = current_rss_mb()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield timer
+    finally:
+        wall_s = time.perf_counter() - wall_start
+        cpu_s = time.process_time() - cpu_start
+        rss_end = current_rss_mb()
+        run._stack.pop()
+        run.stages.append(StageRecord(
+            name=full_name,
+            depth=len(run._stack),
+            wall_s=wall_s,
+            cpu_s=cpu_s,
+            rows_in=timer.rows_in,
+            rows_out=timer.rows_out,
+            rss_mb=rss_end,
+            rss_delta_mb=rss_end - rss_start,
+        ))
+
+
+def instrumented(name: Optional[str] = None) -> Callable:
+    """
+    Decorator đo một hàm như một bước (tên mặc định là tên hàm).
+    """
+    def decorate(func: Callable) -> Callable:
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _ACTIVE_RUN.get() is None:
+                return func(*args, **kwargs)
+            with stage(stage_name, rows_in=row_count(args[0]) if args else None) as timer:
+                result = func(*args, **kwargs)
+                timer.rows_out = row_count(result)
+            return result
+
+        return wrapper
+
+    return decorate
+
+
+def get_perf_logger() -> logging.Logger:
+    """
+    Logger cho các dòng đo hiệu năng, ghi ra stderr ở mức INFO (cấu hình một lần).
+    """
+    logger = logging.getLogger(PERF_LOGGER_NAME)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
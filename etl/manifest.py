@@ -0,0 +1,130 @@
+# etl/manifest.py
+"""
+Manifest của lần chạy ETL gần nhất, dùng để chỉ xử lý lại các năm có
+file thô thay đổi (kích thước, thời điểm sửa, nội dung) hoặc khi cấu hình đổi.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .config import RAW_FILES, SUBJECT_COLUMNS, COMBINATION_DEFINITIONS, PROCESSED_DIR, MAIN_DATASET_DIR
+from .province_mapping import MA_TINH_TO_TEN, MAPPING_VERSION
+
+MANIFEST_FILE = PROCESSED_DIR / "etl_manifest.json"
+
+# Tăng số này khi thay đổi cách xử lý làm kết quả khác đi
+# (những thay đổi mà cấu hình phía trên không phản ánh được)
+PIPELINE_VERSION = 3
+
+
+def _sha256_of_file(path: Path, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def config_fingerprint(partition_by_province: bool = False) -> str:
+    """
+    Băm toàn bộ cấu hình ảnh hưởng tới dữ liệu đầu ra.
+    """
+    from .preprocess import RAW_TO_STANDARD_COLUMNS  # tránh import vòng
+
+    config = {
+        "pipeline_version": PIPELINE_VERSION,
+        "subject_columns": SUBJECT_COLUMNS,
+        "combination_definitions": COMBINATION_DEFINITIONS,
+        "raw_to_standard_columns": RAW_TO_STANDARD_COLUMNS,
+        "mapping_version": MAPPING_VERSION,
+        "ma_tinh_to_ten": MA_TINH_TO_TEN,
+        "partition_by_province": partition_by_province,
+    }
+    payload = json.dumps(config, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+def load_manifest(path: Path = MANIFEST_FILE) -> Optional[dict]:
+    if not path.exists():
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # Manifest hỏng thì coi như chưa có, sẽ xử lý lại toàn bộ
+        return None
+
+
+def save_manifest(manifest: dict, path: Path = MANIFEST_FILE) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    tmp_path.replace(path)
+
+
+def build_manifest(
+    partition_by_province: bool = False,
+    previous: Optional[dict] = None,
+) -> dict:
+    """
+    Tạo manifest cho trạng thái hiện tại của RAW_FILES.
+    Nếu kích thước và mtime không đổi so với `previous` thì dùng lại mã băm cũ
+    để khỏi đọc lại cả file.
+    """
+    old_files: Dict[str, dict] = (previous or {}).get("files", {})
+    files = {}
+    for year, path in RAW_FILES.items():
+        if not path.exists():
+            continue
+        stat = path.stat()
+        entry = {
+            "path": str(path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+        old = old_files.get(str(year))
+        if (
+            old
+            and old.get("path") == entry["path"]
+            and old.get("size") == entry["size"]
+            and old.get("mtime_ns") == entry["mtime_ns"]
+        ):
+            entry["sha256"] = old["sha256"]
+        else:
+            entry["sha256"] = _sha256_of_file(path)
+        files[str(year)] = entry
+
+    return {
+        "config_hash": config_fingerprint(partition_by_province),
+        "files": files,
+    }
+
+
+def diff_manifests(
+    previous: Optional[dict],
+    current: dict,
+    dataset_dir: Path = MAIN_DATASET_DIR,
+) -> Tuple[List[int], List[int]]:
+    """
+    So sánh hai manifest. Trả về (các năm cần xử lý lại, các năm đã bị bỏ).
+    Cấu hình thay đổi hoặc chưa có manifest thì xử lý lại tất cả các năm.
+    """
+    current_years = sorted(int(y) for y in current["files"])
+    if previous is None or previous.get("config_hash") != current["config_hash"]:
+        previous_years = [int(y) for y in (previous or {}).get("files", {})]
+        removed = sorted(set(previous_years) - set(current_years))
+        return current_years, removed
+
+    old_files = previous.get("files", {})
+    stale = []
+    for year in current_years:
+        old = old_files.get(str(year))
+        partition_missing = not (dataset_dir / f"nam={year}").exists()
+        if old is None or old.get("sha256") != current["files"][str(year)]["sha256"] or partition_missing:
+            stale.append(year)
+
+    removed = sorted(int(y) for y in old_files if y not in current["files"])
+    return stale, removed
@@ -1,78 +1,99 @@
 # etl/preprocess.py
 
+import json
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import shutil
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict
-
-from .config import RAW_FILES, SUBJECT_COLUMNS, COMBINATION_DEFINITIONS, PROCESSED_DIR, MAIN_DATA_FILE
-from .province_mapping import extract_ma_tinh_from_sbd, get_tinh_thanh_from_sbd
+from typing import Dict, Iterable, Iterator, Optional
+
+from .config import (
+    RAW_FILES,
+    SUBJECT_COLUMNS,
+    COMBINATION_DEFINITIONS,
+    PROCESSED_DIR,
+    MAIN_DATA_FILE,
+    MAIN_ARROW_FILE,
+    MAIN_DATASET_DIR,
+    ROW_OFFSETS_FILE,
+)
+from .instrumentation import instrumented, stage
+from .province_mapping import MA_TINH_CATEGORIES, TINH_THANH_CATEGORIES, decode_province_series
+from .schema import apply_compact_schema, output_arrow_schema, partition_schema
+
+# mapping tên cột đã chuẩn hóa -> tên cột chuẩn dùng trong hệ thống
+RAW_TO_STANDARD_COLUMNS: Dict[str, str] = {
+    "sbd": "sbd",
+    "so_bao_danh": "sbd",
+    "sobd": "sbd",
+    "so_bd": "sbd",
+
+    # Các môn
+    "toan": "toan",
+    "ngu_van": "van",
+    "nguvan": "van",
+    "ngoai_ngu": "anh",
+    "ngoaingu": "anh",
+    "vat_li": "ly",
+    "vatli": "ly",
+    "hoa_hoc": "hoa",
+    "hoahoc": "hoa",
+    "sinh_hoc": "sinh",
+    "sinhhoc": "sinh",
+    "lich_su": "su",
+    "lichsu": "su",
+    "dia_li": "dia",
+    "diali": "dia",
+    "gdcd": "gdcd",
+
+    # Mã ngoại ngữ
+    "ma_ngoai_ngu": "ma_ngoai_ngu",
+    "mangoaingu": "ma_ngoai_ngu",
+}
+
+# Số dòng mỗi lô khi đọc CSV theo chế độ streaming
+DEFAULT_CHUNKSIZE = 200_000
+
+# Khóa metadata của ROW_OFFSETS_FILE: chữ ký (kích thước, mtime) của file dữ liệu được lập chỉ mục
+ROW_OFFSETS_SOURCE_KEY = b"thpt_source"
+
+# Engine xử lý CSV thô: "pandas" (mặc định) hoặc "arrow" (etl/arrow_engine.py, cùng schema đầu ra)
+ETL_ENGINES = ("pandas", "arrow")
 
 
 def ensure_processed_dir():
     PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def load_raw_year(path: Path, year: int) -> pd.DataFrame:
+def normalize_column_name(name) -> str:
     """
-    Đọc dữ liệu thô cho một năm.
-
-    Dataset có thể có các cột như:
-    sbd, toan, ngu_van, ngoai_ngu, vat_li, hoa_hoc, sinh_hoc,
-    lich_su, dia_li, gdcd, ma_ngoai_ngu.
+    Chuẩn hóa một tên cột thô (tránh lỗi do ký tự ẩn, viết hoa, khoảng trắng).
+    Ví dụ: " SBD " -> "sbd", "NGU VAN" -> "ngu_van"
     """
+    return (
+        str(name)
+        .strip()           # bỏ khoảng trắng đầu/cuối
+        .replace("\ufeff", "")  # bỏ BOM nếu có
+        .lower()           # chuyển thường
+        .replace(" ", "_") # đổi khoảng trắng thành _
+    )
 
-    # Đọc file CSV (nếu dùng utf-8-sig thì thêm encoding vào)
-    df = pd.read_csv(path, dtype=str)
 
-#    chuẩn hóa tên cột (tránh lỗi do ký tự ẩn, viết hoa, khoảng trắng)
-    # Ví dụ: " SBD " -> "sbd", "NGU VAN" -> "ngu_van"
-    normalized_cols = []
-    for c in df.columns:
-        c_norm = (
-            str(c)
-            .strip()           # bỏ khoảng trắng đầu/cuối
-            .replace("\ufeff", "")  # bỏ BOM nếu có
-            .lower()           # chuyển thường
-            .replace(" ", "_") # đổi khoảng trắng thành _
-        )
-        normalized_cols.append(c_norm)
-
-    df.columns = normalized_cols
-
-    # mapping tên cột đã chuẩn hóa -> tên cột chuẩn dùng trong hệ thống
-    raw_to_standard_lower: Dict[str, str] = {
-        "sbd": "sbd",
-        "so_bao_danh": "sbd",
-        "sobd": "sbd",
-        "so_bd": "sbd",
-
-        # Các môn
-        "toan": "toan",
-        "ngu_van": "van",
-        "nguvan": "van",
-        "ngoai_ngu": "anh",
-        "ngoaingu": "anh",
-        "vat_li": "ly",
-        "vatli": "ly",
-        "hoa_hoc": "hoa",
-        "hoahoc": "hoa",
-        "sinh_hoc": "sinh",
-        "sinhhoc": "sinh",
-        "lich_su": "su",
-        "lichsu": "su",
-        "dia_li": "dia",
-        "diali": "dia",
-        "gdcd": "gdcd",
-
-        # Mã ngoại ngữ
-        "ma_ngoai_ngu": "ma_ngoai_ngu",
-        "mangoaingu": "ma_ngoai_ngu",
-    }
+def _normalize_columns(df: pd.DataFrame, path: Path) -> pd.DataFrame:
+    """
+    Chuẩn hóa tên cột về tên chuẩn và chỉ giữ các cột cần thiết.
+    """
+    df.columns = [normalize_column_name(c) for c in df.columns]
 
     new_columns = {}
     for col in df.columns:
-        if col in raw_to_standard_lower:
-            new_columns[col] = raw_to_standard_lower[col]
+        if col in RAW_TO_STANDARD_COLUMNS:
+            new_columns[col] = RAW_TO_STANDARD_COLUMNS[col]
 
     df = df.rename(columns=new_columns)
 
@@ -88,10 +109,15 @@ def load_raw_year(path: Path, year: int) -> pd.DataFrame:
     if "ma_ngoai_ngu" in df.columns:
         extra_cols.append("ma_ngoai_ngu")
 
-    from .config import SUBJECT_COLUMNS  # tránh import vòng nếu bạn đặt trên đầu file
-
     keep_cols = ["sbd"] + [c for c in SUBJECT_COLUMNS if c in df.columns] + extra_cols
-    df = df[keep_cols]
+    return df[keep_cols]
+
+
+def _clean_and_score(df: pd.DataFrame, year: int) -> pd.DataFrame:
+    """
+    Chuyển điểm sang số, loại điểm không hợp lệ, thêm năm, tỉnh và tổng điểm các khối.
+    """
+    df = df.copy()
 
     # Chuyển cột điểm sang float
     for col in SUBJECT_COLUMNS:
@@ -109,15 +135,10 @@ def load_raw_year(path: Path, year: int) -> pd.DataFrame:
     # Thêm cột năm
     df["nam"] = year
 
-    # Mã tỉnh và tên tỉnh từ số báo danh
-    from .province_mapping import extract_ma_tinh_from_sbd, get_tinh_thanh_from_sbd
-
-    df["ma_tinh"] = df["sbd"].apply(extract_ma_tinh_from_sbd)
-    df["tinh_thanh"] = df["sbd"].apply(get_tinh_thanh_from_sbd)
+    # Mã tỉnh và tên tỉnh từ số báo danh (giải mã vector hóa, kết quả là categorical)
+    df["ma_tinh"], df["tinh_thanh"] = decode_province_series(df["sbd"])
 
     # Tính tổng điểm các khối
-    from .config import COMBINATION_DEFINITIONS
-
     for code, subjects in COMBINATION_DEFINITIONS.items():
         exist_subjects = [s for s in subjects if s in df.columns]
         if not exist_subjects:
@@ -129,26 +150,354 @@ def load_raw_year(path: Path, year: int) -> pd.DataFrame:
     if available_subjects:
         df["diem_trung_binh"] = df[available_subjects].mean(axis=1, skipna=True)
 
-    return df
+    # Ép về schema gọn: điểm float32, nam int16, mã tỉnh/ngoại ngữ categorical
+    return apply_compact_schema(df)
+
+
+@instrumented()
+def load_raw_year(path: Path, year: int) -> pd.DataFrame:
+    """
+    Đọc dữ liệu thô cho một năm.
+
+    Dataset có thể có các cột như:
+    sbd, toan, ngu_van, ngoai_ngu, vat_li, hoa_hoc, sinh_hoc,
+    lich_su, dia_li, gdcd, ma_ngoai_ngu.
+    """
+
+    # Đọc file CSV (nếu dùng utf-8-sig thì thêm encoding vào)
+    df = pd.read_csv(path, dtype=str)
+
+    df = _normalize_columns(df, path)
+    return _clean_and_score(df, year)
+
+
+def iter_raw_year_chunks(
+    path: Path,
+    year: int,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+) -> Iterator[pd.DataFrame]:
+    """
+    Đọc dữ liệu thô của một năm theo từng lô tối đa `chunksize` dòng.
+    Mỗi lô được chuẩn hóa và tính điểm như load_raw_year.
+    """
+    with pd.read_csv(path, dtype=str, chunksize=chunksize) as reader:
+        for chunk in reader:
+            chunk = _normalize_columns(chunk, path)
+            yield _clean_and_score(chunk, year)
+
+
+def to_output_table(df: pd.DataFrame, schema: Optional[pa.Schema] = None) -> pa.Table:
+    """
+    Chuyển một lô đã xử lý sang bảng Arrow theo schema cố định.
+    Cột không có trong file thô được điền giá trị rỗng.
+    """
+    if schema is None:
+        schema = output_arrow_schema()
+    df = df.reindex(columns=schema.names)
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def stream_raw_year(
+    path: Path,
+    year: int,
+    writer: pq.ParquetWriter,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+) -> int:
+    """
+    Đọc, xử lý và ghi thẳng dữ liệu một năm vào `writer` theo từng lô.
+    Bộ nhớ tối đa chỉ phụ thuộc `chunksize`, không phụ thuộc kích thước file.
+    Trả về số dòng đã ghi.
+    """
+    n_rows = 0
+    for chunk in iter_raw_year_chunks(path, year, chunksize=chunksize):
+        writer.write_table(to_output_table(chunk, writer.schema))
+        n_rows += len(chunk)
+    return n_rows
+
 
 def build_all_years() -> pd.DataFrame:
+    """
+    Xử lý lại toàn bộ các năm (tuần tự) và trả về dữ liệu tổng hợp đã ghi.
+    Đi qua build_all_years_parallel để MAIN_DATA_FILE luôn được sắp theo
+    (nam, ma_tinh) và chỉ mục đoạn dòng, bản Arrow dùng chung được ghi lại cùng lúc.
+    """
+    build_all_years_parallel(jobs=1)
+    return pd.read_parquet(MAIN_DATA_FILE)
+
+
+def build_all_years_streaming(chunksize: int = DEFAULT_CHUNKSIZE) -> int:
+    """
+    Giống build_all_years nhưng đọc từng lô và không nạp kết quả vào bộ nhớ.
+    Trả về tổng số dòng đã ghi.
+    """
+    return build_all_years_parallel(jobs=1, chunksize=chunksize)
+
+
+def open_main_dataset(dataset_dir: Path = MAIN_DATASET_DIR) -> ds.Dataset:
+    """
+    Mở bộ dữ liệu phân vùng, tự nhận biết có phân vùng theo ma_tinh hay không.
+    """
+    by_province = any(dataset_dir.glob("nam=*/ma_tinh=*"))
+    partitioning = ds.partitioning(partition_schema(by_province), flavor="hive")
+    return ds.dataset(dataset_dir, format="parquet", partitioning=partitioning)
+
+
+def write_year_partition(
+    path: Path,
+    year: int,
+    dataset_dir: Path,
+    chunksize: Optional[int] = None,
+    partition_by_province: bool = False,
+    engine: str = "pandas",
+) -> int:
+    """
+    Xử lý dữ liệu một năm và ghi vào phân vùng nam=<year> của `dataset_dir`
+    (thêm phân vùng con ma_tinh=<mã> nếu partition_by_province).
+    Dùng làm tác vụ cho từng tiến trình con: chỉ trả về số dòng,
+    không gửi DataFrame về tiến trình cha.
+    engine="arrow": đọc và xử lý bằng pyarrow (etl/arrow_engine.py), cùng schema đầu ra.
+    """
+    if engine not in ETL_ENGINES:
+        raise ValueError(f"Engine không hợp lệ: {engine}. Chọn một trong {ETL_ENGINES}.")
+
+    year_dir = dataset_dir / f"nam={year}"
+    # Xóa phân vùng cũ của năm này để không lẫn file từ lần chạy trước
+    shutil.rmtree(year_dir, ignore_errors=True)
+    year_dir.mkdir(parents=True)
+
+    schema = output_arrow_schema()
+    # Cột khóa phân vùng được mã hóa trong tên thư mục, không ghi vào file
+    file_schema = schema.remove(schema.get_field_index("nam"))
+
+    if engine == "arrow":
+        from .arrow_engine import iter_raw_year_tables  # tránh import vòng
+
+        tables = (
+            table.select(file_schema.names)
+            for table in iter_raw_year_tables(path, year, chunksize=chunksize)
+        )
+    else:
+        if chunksize:
+            chunks = iter_raw_year_chunks(path, year, chunksize=chunksize)
+        else:
+            chunks = iter([load_raw_year(path, year)])
+        tables = (to_output_table(chunk, file_schema) for chunk in chunks)
+
+    n_rows = 0
+    if partition_by_province:
+        for i, table in enumerate(tables):
+            pq.write_to_dataset(
+                table,
+                root_path=year_dir,
+                partition_cols=["ma_tinh"],
+                basename_template=f"part-{i}-{{i}}.parquet",
+                existing_data_behavior="overwrite_or_ignore",
+            )
+            n_rows += table.num_rows
+        return n_rows
+
+    with pq.ParquetWriter(year_dir / "part-0.parquet", file_schema) as writer:
+        for table in tables:
+            writer.write_table(table)
+            n_rows += table.num_rows
+    return n_rows
+
+
+def assemble_main_file(dataset_dir: Path, out_path: Path) -> int:
+    """
+    Ghép bộ dữ liệu phân vùng thành một file Parquet duy nhất, sắp theo
+    (nam, ma_tinh) để mỗi nhóm năm-tỉnh là một đoạn dòng liên tục (xem
+    build_row_offsets). Mỗi lần chỉ nạp dữ liệu (dạng gọn) của một năm.
+    """
+    schema = output_arrow_schema()
+    dataset = open_main_dataset(dataset_dir)
+    province_codes = pa.array(list(MA_TINH_CATEGORIES), type=pa.string())
+    n_rows = 0
+    with pq.ParquetWriter(out_path, schema) as writer:
+        for year_dir in sorted(dataset_dir.glob("nam=*")):
+            year = int(year_dir.name.split("=", 1)[1])
+            table = dataset.to_table(filter=ds.field("nam") == year)
+            if table.num_rows == 0:
+                continue
+            table = table.select(schema.names).cast(schema)
+            # Sắp theo thứ tự mã tỉnh trong MA_TINH_TO_TEN, SBD không rõ tỉnh xếp cuối
+            key = pc.index_in(
+                table["ma_tinh"].cast(pa.string()).combine_chunks(),
+                value_set=province_codes,
+            )
+            order = pc.array_sort_indices(key, null_placement="at_end")
+            table = table.take(order).combine_chunks()
+            writer.write_table(table)
+            n_rows += table.num_rows
+    return n_rows
+
+
+@instrumented()
+def build_row_offsets(parquet_path: Path) -> pd.DataFrame:
+    """
+    Tạo chỉ mục đoạn dòng cho MAIN_DATA_FILE đã sắp theo (nam, ma_tinh):
+    mỗi dòng kết quả (nam, ma_tinh, tinh_thanh, start, stop) cho biết các thí sinh
+    của nhóm đó nằm ở vị trí [start, stop). Chỉ đọc hai cột nam và ma_tinh.
+    """
+    keys = pq.read_table(parquet_path, columns=["nam", "ma_tinh"]).to_pandas()
+    nam = keys["nam"].to_numpy()
+    code = keys["ma_tinh"].cat.codes.to_numpy() if len(keys) else np.array([], dtype=np.int8)
+
+    n = len(keys)
+    change = np.ones(n, dtype=bool)
+    if n > 1:
+        change[1:] = (nam[1:] != nam[:-1]) | (code[1:] != code[:-1])
+    starts = np.flatnonzero(change)
+    stops = np.append(starts[1:], n)
+
+    offsets = pd.DataFrame({
+        "nam": nam[starts],
+        "ma_tinh": keys["ma_tinh"].iloc[starts].to_numpy(),
+        "start": starts.astype(np.int64),
+        "stop": stops.astype(np.int64),
+    })
+    if offsets.duplicated(["nam", "ma_tinh"]).any():
+        raise RuntimeError(f"File {parquet_path} chưa được sắp theo (nam, ma_tinh).")
+    offsets["ma_tinh"] = offsets["ma_tinh"].astype(pd.CategoricalDtype(MA_TINH_CATEGORIES))
+    offsets["tinh_thanh"] = pd.Categorical.from_codes(
+        offsets["ma_tinh"].cat.codes, categories=TINH_THANH_CATEGORIES
+    )
+    return offsets[["nam", "ma_tinh", "tinh_thanh", "start", "stop"]]
+
+
+def file_signature(path: Path) -> Dict[str, int]:
+    stat = path.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def write_row_offsets(parquet_path: Path = MAIN_DATA_FILE, out_path: Path = ROW_OFFSETS_FILE) -> None:
+    """
+    Ghi chỉ mục đoạn dòng của `parquet_path`, kèm chữ ký của file đó trong metadata
+    để read_row_offsets nhận ra chỉ mục cũ khi file dữ liệu đã bị ghi lại.
+    """
+    table = pa.Table.from_pandas(build_row_offsets(parquet_path), preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[ROW_OFFSETS_SOURCE_KEY] = json.dumps(file_signature(parquet_path)).encode("utf-8")
+    pq.write_table(table.replace_schema_metadata(metadata), out_path)
+
+
+def read_row_offsets(
+    offsets_path: Path = ROW_OFFSETS_FILE,
+    parquet_path: Path = MAIN_DATA_FILE,
+) -> Optional[pd.DataFrame]:
+    """
+    Đọc chỉ mục đoạn dòng. Trả về None nếu chưa có, hoặc nếu chỉ mục không được
+    lập cho `parquet_path` hiện tại (thiếu chữ ký hoặc file đã đổi kích thước/mtime).
+    """
+    if not offsets_path.exists() or not parquet_path.exists():
+        return None
+    table = pq.read_table(offsets_path)
+    source = (table.schema.metadata or {}).get(ROW_OFFSETS_SOURCE_KEY)
+    if source is None or json.loads(source) != file_signature(parquet_path):
+        return None
+    return table.to_pandas()
+
+
+@instrumented()
+def write_shared_arrow_file(parquet_path: Path, arrow_path: Path) -> None:
+    """
+    Ghi bản Arrow IPC không nén của dữ liệu chính để ứng dụng memory-map và
+    dựng DataFrame không cần sao chép. Mỗi cột là một khối liên tục duy nhất,
+    cột điểm dùng NaN thay cho null (không có bitmap) để pandas trỏ thẳng vào
+    vùng nhớ của file; mọi tiến trình cùng đọc chung các trang nhớ này.
+
+    Bước này nạp toàn bộ dữ liệu vào bộ nhớ (khác với phần đọc CSV theo lô có
+    bộ nhớ giới hạn bởi --chunksize): đỉnh bộ nhớ của ETL cỡ bằng dữ liệu chính.
+    """
+    table = pq.read_table(parquet_path).unify_dictionaries().combine_chunks()
+    columns = []
+    for field, column in zip(table.schema, table.columns):
+        if pa.types.is_floating(field.type):
+            column = pc.fill_null(column, pa.scalar(float("nan"), field.type))
+        columns.append(column)
+    # fill_null trên cột một khối vẫn trả về một khối, không cần ghép lại lần nữa
+    table = pa.Table.from_arrays(columns, schema=table.schema)
+
+    tmp_path = arrow_path.with_suffix(".tmp")
+    with pa.OSFile(str(tmp_path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=max(table.num_rows, 1))
+    # Thay file một lần để tiến trình đang memory-map bản cũ không đọc phải file ghi dở
+    tmp_path.replace(arrow_path)
+
+
+def build_all_years_parallel(
+    jobs: int,
+    chunksize: Optional[int] = None,
+    partition_by_province: bool = False,
+    only_years: Optional[Iterable[int]] = None,
+    engine: str = "pandas",
+) -> int:
+    """
+    Xử lý các năm (song song bằng process pool nếu jobs > 1). Mỗi năm được ghi
+    thành một phân vùng nam=<year> của MAIN_DATASET_DIR, sau đó các phân vùng
+    được ghép thành MAIN_DATA_FILE. Trả về tổng số dòng đã ghi.
+
+    Nếu truyền `only_years` thì chỉ xử lý lại các năm đó, giữ nguyên phân vùng
+    của các năm còn lại (chế độ cập nhật tăng dần).
+    """
     ensure_processed_dir()
-    all_dfs = []
 
+    selected = None if only_years is None else set(only_years)
+    tasks = {}
+    available_years = set()
     for year, path in RAW_FILES.items():
         if not path.exists():
             print(f"Cảnh báo: không tìm thấy file {path}, bỏ qua năm {year}")
             continue
-        print(f"Xử lý dữ liệu năm {year} từ {path}")
-        df_year = load_raw_year(path, year)
-        all_dfs.append(df_year)
+        available_years.add(year)
+        if selected is None or year in selected:
+            tasks[year] = path
 
-    if not all_dfs:
+    if not available_years:
         raise RuntimeError("Không có dữ liệu nào được xử lý. Kiểm tra lại các file CSV.")
 
-    df_all = pd.concat(all_dfs, ignore_index=True)
-
-    print(f"Lưu dữ liệu tổng hợp vào {MAIN_DATA_FILE}")
-    df_all.to_parquet(MAIN_DATA_FILE, index=False)
-
-    return df_all
+    if only_years is None:
+        # Bỏ các phân vùng năm không còn trong RAW_FILES và kiểu phân vùng cũ
+        shutil.rmtree(MAIN_DATASET_DIR, ignore_errors=True)
+    else:
+        for year_dir in MAIN_DATASET_DIR.glob("nam=*"):
+            if int(year_dir.name.split("=", 1)[1]) not in available_years:
+                print(f"Xóa phân vùng không còn file thô: {year_dir}")
+                shutil.rmtree(year_dir)
+
+    if jobs > 1 and len(tasks) > 1:
+        print(f"Xử lý song song {len(tasks)} năm với {jobs} tiến trình")
+        with stage("write_year_partitions") as timer, ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {
+                year: pool.submit(
+                    write_year_partition,
+                    path, year, MAIN_DATASET_DIR, chunksize, partition_by_province, engine,
+                )
+                for year, path in tasks.items()
+            }
+            timer.rows_out = 0
+            for year, future in futures.items():
+                n_rows = future.result()
+                print(f"Năm {year}: {n_rows} bản ghi")
+                timer.rows_out += n_rows
+    else:
+        for year, path in tasks.items():
+            print(f"Xử lý dữ liệu năm {year} từ {path}")
+            with stage(f"year_{year}") as timer:
+                n_rows = write_year_partition(
+                    path, year, MAIN_DATASET_DIR, chunksize, partition_by_province, engine
+                )
+                timer.rows_out = n_rows
+            print(f"Năm {year}: {n_rows} bản ghi")
+
+    print(f"Đã lưu bộ dữ liệu phân vùng vào {MAIN_DATASET_DIR}")
+    print(f"Ghép dữ liệu các năm vào {MAIN_DATA_FILE}")
+    with stage("assemble_main_file") as timer:
+        n_rows = assemble_main_file(MAIN_DATASET_DIR, MAIN_DATA_FILE)
+        timer.rows_out = n_rows
+    print(f"Ghi chỉ mục đoạn dòng theo (nam, ma_tinh) vào {ROW_OFFSETS_FILE}")
+    write_row_offsets(MAIN_DATA_FILE, ROW_OFFSETS_FILE)
+    print(f"Ghi bản Arrow dùng chung (memory-map) vào {MAIN_ARROW_FILE}")
+    write_shared_arrow_file(MAIN_DATA_FILE, MAIN_ARROW_FILE)
+    return n_rows
@@ -1,6 +1,12 @@
 # etl/province_mapping.py
 
-from typing import Optional
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Tăng khi sửa bảng mã tỉnh hoặc cách giải mã SBD (ETL sẽ xử lý lại toàn bộ)
+MAPPING_VERSION = 1
 
 # Mapping mẫu. Bạn cần bổ sung đầy đủ mã tỉnh theo quy ước SBD của Bộ GD và ĐT.
 MA_TINH_TO_TEN = {
@@ -95,3 +101,42 @@ def get_tinh_thanh_from_sbd(sbd: str) -> Optional[str]:
     if ma_tinh is None:
         return None
     return MA_TINH_TO_TEN.get(ma_tinh)
+
+
+# Bảng tra dạng categorical: mã tỉnh và tên tỉnh dùng chung một bộ mã (codes)
+MA_TINH_CATEGORIES = pd.Index(list(MA_TINH_TO_TEN.keys()), dtype=object)
+TINH_THANH_CATEGORIES = pd.Index(list(MA_TINH_TO_TEN.values()), dtype=object)
+_MA_TINH_LENGTHS = sorted({len(ma) for ma in MA_TINH_TO_TEN})
+
+
+def decode_province_series(sbd: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    """
+    Giải mã mã tỉnh và tên tỉnh cho cả một cột số báo danh (vector hóa).
+
+    Cắt tiền tố 2 (rồi 3) ký tự một lần, tra qua bảng MA_TINH_TO_TEN dưới dạng
+    categorical và trả về (ma_tinh, tinh_thanh) đều là categorical. Kết quả khớp
+    với extract_ma_tinh_from_sbd / get_tinh_thanh_from_sbd cho từng phần tử.
+    """
+    sbd_str = sbd.astype("string").str.strip()
+
+    codes = np.full(len(sbd_str), -1, dtype=np.int8)
+    for length in _MA_TINH_LENGTHS:
+        pending = codes == -1
+        if not pending.any():
+            break
+        prefix = sbd_str.str[:length].to_numpy(dtype=object, na_value=None)
+        found = MA_TINH_CATEGORIES.get_indexer(prefix)
+        take = pending & (found >= 0)
+        codes[take] = found[take]
+
+    ma_tinh = pd.Series(
+        pd.Categorical.from_codes(codes, categories=MA_TINH_CATEGORIES),
+        index=sbd.index,
+        name="ma_tinh",
+    )
+    tinh_thanh = pd.Series(
+        pd.Categorical.from_codes(codes, categories=TINH_THANH_CATEGORIES),
+        index=sbd.index,
+        name="tinh_thanh",
+    )
+    return ma_tinh, tinh_thanh
@@ -1,16 +1,128 @@
 # etl/run_all.py
 
-from .preprocess import build_all_years
-from .build_aggregates import run_build_aggregates
+import argparse
+from pathlib import Path
+from typing import List, Optional
 
+from .config import MAIN_DATA_FILE, MAIN_ARROW_FILE, ROW_OFFSETS_FILE, ETL_RUN_REPORT_FILE
+from .instrumentation import recording, stage
+from .preprocess import (
+    ETL_ENGINES,
+    build_all_years_parallel,
+    read_row_offsets,
+    write_row_offsets,
+    write_shared_arrow_file,
+)
+from .build_aggregates import aggregates_complete, run_build_aggregates, update_aggregates
+from .manifest import build_manifest, diff_manifests, load_manifest, save_manifest
 
-def main():
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="ETL dữ liệu điểm thi THPT Quốc Gia")
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=None,
+        help="Đọc CSV theo từng lô với số dòng này và ghi thẳng ra Parquet "
+             "(giữ bộ nhớ ổn định). Bỏ trống để đọc cả file một lần.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Số tiến trình xử lý các năm song song (mặc định 1: xử lý tuần tự).",
+    )
+    parser.add_argument(
+        "--partition-by-province",
+        action="store_true",
+        help="Phân vùng thêm theo ma_tinh bên trong mỗi năm (nam=YYYY/ma_tinh=XX).",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ETL_ENGINES,
+        default="pandas",
+        help="Cách đọc và xử lý CSV: pandas (mặc định) hoặc arrow (pyarrow.csv + pyarrow.compute, "
+             "đa luồng, cùng schema đầu ra).",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Bỏ qua manifest, xử lý lại toàn bộ các năm.",
+    )
+    parser.add_argument(
+        "--report",
+        type=Path,
+        default=ETL_RUN_REPORT_FILE,
+        help="File JSON ghi thời gian, CPU, số dòng và bộ nhớ của từng bước.",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
     print("Bắt đầu xử lý dữ liệu điểm thi THPT Quốc Gia 202-2024")
-    df_all = build_all_years()
-    print(f"Đã xử lý xong {len(df_all)} bản ghi.")
-    run_build_aggregates()
-    print("Hoàn thành toàn bộ quy trình ETL.")
 
+    # Vẫn ghi báo cáo khi ETL lỗi (các bước đã xong và bước lỗi đều đã được ghi nhận)
+    try:
+        with recording("etl") as run:
+            try:
+                _run_pipeline(args)
+            except BaseException as e:
+                run.error = f"{type(e).__name__}: {e}"
+                raise
+    finally:
+        run.write_json(args.report)
+        print(f"Tổng thời gian {run.wall_s:.1f} s, báo cáo từng bước ghi vào {args.report}")
+
+
+def _run_pipeline(args: argparse.Namespace):
+    with stage("manifest"):
+        previous = None if args.full else load_manifest()
+        current = build_manifest(args.partition_by_province, previous=previous)
+    stale_years, removed_years = diff_manifests(previous, current)
+    full_rebuild = previous is None or previous.get("config_hash") != current["config_hash"]
+
+    if not stale_years and not removed_years and MAIN_DATA_FILE.exists():
+        if read_row_offsets() is None:
+            # Chưa có, hoặc chỉ mục cũ không khớp MAIN_DATA_FILE hiện tại
+            print(f"Ghi chỉ mục đoạn dòng theo (nam, ma_tinh) vào {ROW_OFFSETS_FILE}")
+            write_row_offsets(MAIN_DATA_FILE, ROW_OFFSETS_FILE)
+        if not MAIN_ARROW_FILE.exists():
+            print(f"Ghi bản Arrow dùng chung (memory-map) vào {MAIN_ARROW_FILE}")
+            write_shared_arrow_file(MAIN_DATA_FILE, MAIN_ARROW_FILE)
+        if aggregates_complete():
+            print("Không có file thô nào thay đổi, bỏ qua ETL.")
+        else:
+            print("Không có file thô nào thay đổi, chỉ tạo các bảng tổng hợp còn thiếu.")
+            run_build_aggregates()
+        return
+
+    if full_rebuild:
+        print("Xử lý lại toàn bộ các năm.")
+        only_years = None
+    else:
+        print(f"Các năm cần xử lý lại: {stale_years}; các năm bị bỏ: {removed_years}")
+        only_years = stale_years
+
+    with stage("build_all_years") as timer:
+        n_rows = build_all_years_parallel(
+            jobs=args.jobs,
+            chunksize=args.chunksize,
+            partition_by_province=args.partition_by_province,
+            only_years=only_years,
+            engine=args.engine,
+        )
+        timer.rows_out = n_rows
+    print(f"Đã xử lý xong {n_rows} bản ghi.")
+
+    with stage("aggregates"):
+        if full_rebuild:
+            run_build_aggregates()
+        else:
+            update_aggregates(stale_years + removed_years)
+
+    save_manifest(current)
+    print("Hoàn thành toàn bộ quy trình ETL.")
 
 if __name__ == "__main__":
     main()
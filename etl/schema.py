@@ -0,0 +1,92 @@
+# etl/schema.py
+"""
+Schema gọn (compact) cho dữ liệu điểm đã xử lý.
+
+- Điểm các môn, tổng khối, điểm trung bình: float32 (điểm là bội số 0.05/0.2/0.25
+  trong [0, 10] nên float32 đủ chính xác, làm tròn 2 chữ số là khôi phục đúng giá trị)
+- nam: int16
+- ma_tinh, tinh_thanh, ma_ngoai_ngu: categorical (dictionary trong Parquet)
+- sbd: chuỗi lưu liên tục kiểu Arrow thay vì object
+
+Schema được áp dụng ngay trong load_raw_year và được giữ nguyên khi đọc lại Parquet.
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from .config import SUBJECT_COLUMNS, COMBINATION_DEFINITIONS
+from .province_mapping import MA_TINH_CATEGORIES, TINH_THANH_CATEGORIES
+
+SCORE_DTYPE = np.float32
+YEAR_DTYPE = np.int16
+# Số chữ số thập phân của lưới điểm (0.05 là bước nhỏ nhất)
+SCORE_DECIMALS = 2
+
+SCORE_COLUMNS = (
+    list(SUBJECT_COLUMNS)
+    + [f"tong_{code}" for code in COMBINATION_DEFINITIONS]
+    + ["diem_trung_binh"]
+)
+
+_PROVINCE_TYPE = pa.dictionary(pa.int8(), pa.string())
+
+
+def output_arrow_schema() -> pa.Schema:
+    """
+    Schema cố định của dữ liệu đã xử lý, dùng chung cho mọi lô và mọi năm
+    để có thể ghi nối tiếp vào một ParquetWriter.
+    """
+    fields = [pa.field("sbd", pa.string())]
+    fields += [pa.field(c, pa.float32()) for c in SUBJECT_COLUMNS]
+    fields += [
+        pa.field("ma_ngoai_ngu", pa.dictionary(pa.int8(), pa.string())),
+        pa.field("nam", pa.int16()),
+        pa.field("ma_tinh", _PROVINCE_TYPE),
+        pa.field("tinh_thanh", _PROVINCE_TYPE),
+    ]
+    fields += [pa.field(f"tong_{code}", pa.float32()) for code in COMBINATION_DEFINITIONS]
+    fields.append(pa.field("diem_trung_binh", pa.float32()))
+    return pa.schema(fields)
+
+
+def partition_schema(partition_by_province: bool = False) -> pa.Schema:
+    """
+    Schema các khóa phân vùng Hive của MAIN_DATASET_DIR.
+    """
+    fields = [pa.field("nam", pa.int16())]
+    if partition_by_province:
+        fields.append(pa.field("ma_tinh", pa.string()))
+    return pa.schema(fields)
+
+
+def apply_compact_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Ép kiểu một DataFrame đã xử lý về schema gọn (chỉ các cột có mặt).
+    """
+    df = df.copy()
+    for col in SCORE_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype(SCORE_DTYPE)
+    if "nam" in df.columns:
+        df["nam"] = df["nam"].astype(YEAR_DTYPE)
+    if "sbd" in df.columns:
+        df["sbd"] = df["sbd"].astype(pd.StringDtype("pyarrow"))
+    if "ma_tinh" in df.columns:
+        df["ma_tinh"] = df["ma_tinh"].astype(pd.CategoricalDtype(MA_TINH_CATEGORIES))
+    if "tinh_thanh" in df.columns:
+        df["tinh_thanh"] = df["tinh_thanh"].astype(pd.CategoricalDtype(TINH_THANH_CATEGORIES))
+    if "ma_ngoai_ngu" in df.columns:
+        df["ma_ngoai_ngu"] = df["ma_ngoai_ngu"].astype("category")
+    return df
+
+
+def scores_as_float64(values: pd.Series) -> np.ndarray:
+    """
+    Chuyển cột điểm float32 sang float64 để tính toán, làm tròn về lưới điểm
+    (6.2 lưu float32 thành 6.19999981; làm tròn 2 chữ số cho lại đúng 6.2).
+    """
+    arr = values.to_numpy(dtype=np.float64, na_value=np.nan)
+    if values.dtype == SCORE_DTYPE:
+        arr = np.round(arr, SCORE_DECIMALS)
+    return arr
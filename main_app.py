@@ -7,23 +7,47 @@ from app.constants import (
     SUBJECT_LABELS,
     COMBINATIONS,
     COMBINATION_LABELS,
+    PERF_LOG_ENABLED,
+    DEBUG_PANEL_ENABLED,
 )
 from app.data_access import (
     load_main_dataset,
+    load_main_dataset_shared,
+    main_dataset_version,
+    load_filtered_dataset,
+    resolve_data_backend,
     load_agg_subject_province,
+    load_histogram_cube,
+    load_row_offsets,
     get_filter_options,
-    filter_main_dataset,
+    filter_main_dataset_cached,
     sample_for_plotting,
+    get_cluster_cache,
+    get_combination_lookup,
 )
 from app.charts import (
     create_histogram,
+    create_histogram_from_cube,
     create_boxplot_all_subjects,
+    create_boxplot_from_cube,
     create_bar_mean_by_province,
     create_scatter_for_combination,
     create_scatter_clusters,
+    create_density_for_combination,
+    create_density_clusters,
+    create_at_least_curve,
+    cached_figure,
+)
+from app.cluster_cache import data_fingerprint
+from app.clustering import (
+    CLUSTERING_ENGINES,
+    cached_kmeans_cluster,
+    clustered_frame,
+    clustering_key_for,
+    iter_minibatch_results,
 )
-from app.clustering import kmeans_cluster
 from app.utils import compute_basic_statistics, format_stat_value, get_subject_label
+from etl.instrumentation import get_perf_logger, recording, stage
 
 
 def _init_selected_years(years: list[int]) -> list[int]:
@@ -50,7 +74,61 @@ def _persist_selected_years_to_url(selected_years: list[int]) -> None:
             del st.query_params["years"]
 
 
+def _kept_widget_key(key: str, default) -> str:
+    """
+    Giữ giá trị widget khi tab chứa nó bị đóng: Streamlit xóa state của widget không
+    được vẽ trong lần chạy, nên lưu thêm một bản riêng và nạp lại khi tab mở lại.
+    Widget dùng khóa trả về và không truyền value= (giá trị mặc định nằm ở đây).
+    """
+    saved = f"{key}__da_luu"
+    if key not in st.session_state:
+        st.session_state[key] = st.session_state.get(saved, default)
+    st.session_state[saved] = st.session_state[key]
+    return key
+
+
+def _fingerprint(df: pd.DataFrame, columns: list[str]) -> str:
+    """Dấu vân tay rẻ của các cột dùng để vẽ, làm khóa cache biểu đồ."""
+    with stage("fingerprint", rows_in=len(df)):
+        return data_fingerprint(df, [c for c in columns if c in df.columns])
+
+
+def _plotly_chart(fig, target=st) -> None:
+    """st.plotly_chart kèm đo thời gian (Streamlit kiểm tra và tuần tự hóa lại figure mỗi lần vẽ)."""
+    with stage("plotly_chart"):
+        target.plotly_chart(fig, use_container_width=True)
+
+
+def _show_debug_panel(run) -> None:
+    """Bảng đo thời gian/bộ nhớ từng bước của lần chạy vừa xong, đặt cuối sidebar."""
+    report = run.to_dict()
+    with st.sidebar.expander("Đo hiệu năng lần chạy này", expanded=True):
+        st.caption(
+            f"Tổng {report['wall_s'] * 1000:.0f} ms (CPU {report['cpu_s'] * 1000:.0f} ms), "
+            f"RSS đỉnh {report['peak_rss_mb']:.0f} MB"
+        )
+        stages = pd.DataFrame(report["stages"])
+        if not stages.empty:
+            stages["wall_ms"] = stages.pop("wall_s") * 1000
+            stages["cpu_ms"] = stages.pop("cpu_s") * 1000
+            st.dataframe(
+                stages[["name", "wall_ms", "cpu_ms", "rows_in", "rows_out", "rss_delta_mb"]],
+                hide_index=True,
+                use_container_width=True,
+            )
+
+
 def main():
+    # Đo từng bước của lần chạy lại này: một dòng log JSON và (tùy chọn) bảng trong sidebar
+    with recording("rerun") as run:
+        _render_page()
+    if PERF_LOG_ENABLED:
+        get_perf_logger().info(run.log_line())
+    if DEBUG_PANEL_ENABLED or st.query_params.get("debug") == "1":
+        _show_debug_panel(run)
+
+
+def _render_page():
     st.set_page_config(
         page_title="Phân tích điểm thi THPT quốc gia",
         layout="wide",
@@ -58,10 +136,23 @@ def main():
 
     st.title("Phân tích và trực quan hóa điểm thi THPT quốc gia 2020–2024")
 
-    # Tải dữ liệu
-    df = load_main_dataset()
-    stats_df = load_agg_subject_province()
-    years, provinces = get_filter_options(df)
+    # Tải dữ liệu. Với bộ dữ liệu phân vùng thì chỉ đọc phần được lọc,
+    # danh sách năm/tỉnh lấy từ bảng thống kê thay vì từ toàn bộ dữ liệu.
+    with stage("load_data"):
+        backend = resolve_data_backend()
+        use_dataset = backend == "dataset"
+        stats_df = load_agg_subject_province()
+        histogram_cube = load_histogram_cube()
+        if use_dataset:
+            df = None
+            years, provinces = get_filter_options(stats_df)
+        else:
+            dataset_version = main_dataset_version(backend)
+            if backend == "shared":
+                df = load_main_dataset_shared(dataset_version)
+            else:
+                df = load_main_dataset(dataset_version)
+            years, provinces = get_filter_options(df)
 
     # Khởi tạo năm lần đầu: đọc từ URL, nếu không có thì chọn năm mới nhất
     if "selected_years" not in st.session_state:
@@ -104,30 +195,51 @@ def main():
             format_func=lambda x: COMBINATION_LABELS.get(x, x),
         )
 
+        density_mode = st.checkbox(
+            "Vẽ tổ hợp/phân cụm dạng mật độ",
+            value=True,
+            help="Gộp thí sinh theo ô lưới điểm thay vì vẽ từng điểm: nhẹ hơn nhiều cho trình duyệt "
+                 "và dùng được toàn bộ dữ liệu đã lọc.",
+        )
+
     if not st.session_state["selected_years"]:
         st.warning("Hãy chọn ít nhất một năm trong bộ lọc.")
         return
 
-    # Lọc dữ liệu chính
-    filtered_df = filter_main_dataset(
-        df,
-        years=st.session_state["selected_years"],
-        provinces=selected_provinces,
-    )
+    # Lọc dữ liệu chính và lấy mẫu phục vụ vẽ biểu đồ
+    if use_dataset:
+        with stage("filter") as timer:
+            filtered_df = load_filtered_dataset(
+                tuple(sorted(st.session_state["selected_years"])),
+                tuple(sorted(selected_provinces)),
+            )
+            timer.rows_out = len(filtered_df)
+        with stage("sample", rows_in=len(filtered_df)) as timer:
+            plot_df = sample_for_plotting(filtered_df)
+            timer.rows_out = len(plot_df)
+    else:
+        # Kết quả lọc được nhớ theo (năm, tỉnh) và dùng chung giữa các phiên
+        with stage("filter_and_sample", rows_in=len(df)) as timer:
+            filtered_df, plot_df = filter_main_dataset_cached(
+                df,
+                dataset_version,
+                years=st.session_state["selected_years"],
+                provinces=selected_provinces,
+                offsets=load_row_offsets(),
+            )
+            timer.rows_out = len(filtered_df)
 
     if filtered_df.empty:
         st.warning("Không có bản ghi nào phù hợp với bộ lọc hiện tại.")
         return
 
-    # Lấy mẫu dữ liệu phục vụ vẽ biểu đồ
-    plot_df = sample_for_plotting(filtered_df)
-
     # Thống kê cơ bản
     st.subheader("Tổng quan dữ liệu")
 
     col1, col2, col3, col4 = st.columns(4)
     subject_label = get_subject_label(selected_subject)
-    stats = compute_basic_statistics(filtered_df, selected_subject)
+    with stage("basic_statistics", rows_in=len(filtered_df)):
+        stats = compute_basic_statistics(filtered_df, selected_subject)
 
     if stats:
         col1.metric("Điểm trung bình", format_stat_value(stats["mean"]))
@@ -139,89 +251,284 @@ def main():
 
     st.markdown(f"Dữ liệu hiện tại có {len(filtered_df)} thí sinh sau khi áp dụng bộ lọc.")
 
-    # Tabs phân tích (giữ nguyên Tab 5 của bạn)
-    tab1, tab2, tab3, tab4, tab5 = st.tabs(
+    # Khóa bộ lọc cho cache biểu đồ (không phụ thuộc thứ tự chọn)
+    years_key = sorted(st.session_state["selected_years"])
+    provinces_key = sorted(selected_provinces)
+
+    # Tabs phân tích (giữ nguyên Tab 5 của bạn).
+    # on_change="rerun": chỉ tab đang mở được tính (tab.open), các tab khác bỏ qua
+    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(
         [
             "Phân bố điểm theo môn",
             "So sánh giữa các môn",
             "Theo tỉnh/thành",
             "Tổ hợp xét tuyển",
             "Phân cụm",
-        ]
+            "Ngưỡng điểm tổ hợp",
+        ],
+        key="tab_dang_mo",
+        on_change="rerun",
     )
 
     # Tab 1: Phân bố điểm theo môn
     with tab1:
-        st.subheader(f"Phân bố điểm môn {subject_label}")
-        fig_hist = create_histogram(plot_df, selected_subject)
-        st.plotly_chart(fig_hist, use_container_width=True)
+        if tab1.open:
+            st.subheader(f"Phân bố điểm môn {subject_label}")
+            if histogram_cube is not None:
+                # Cộng histogram dựng sẵn: chính xác trên toàn bộ thí sinh, không lấy mẫu
+                fig_hist = cached_figure(
+                    "histogram_cube",
+                    _fingerprint(histogram_cube, ["so_luong"]),
+                    {"subject": selected_subject, "years": years_key, "provinces": provinces_key},
+                    lambda: create_histogram_from_cube(
+                        histogram_cube,
+                        selected_subject,
+                        years=st.session_state["selected_years"],
+                        provinces=selected_provinces,
+                    ),
+                )
+            else:
+                fig_hist = cached_figure(
+                    "histogram",
+                    _fingerprint(plot_df, [selected_subject]),
+                    {"subject": selected_subject},
+                    lambda: create_histogram(plot_df, selected_subject),
+                )
+            if fig_hist is not None:
+                _plotly_chart(fig_hist)
+            else:
+                st.info("Không có dữ liệu điểm hợp lệ cho môn được chọn.")
 
     # Tab 2: So sánh giữa các môn
     with tab2:
-        st.subheader("So sánh phân bố điểm giữa các môn")
-        fig_box = create_boxplot_all_subjects(plot_df)
-        if fig_box is not None:
-            st.plotly_chart(fig_box, use_container_width=True)
-        else:
-            st.info("Không đủ dữ liệu các môn để vẽ biểu đồ.")
+        if tab2.open:
+            st.subheader("So sánh phân bố điểm giữa các môn")
+            if histogram_cube is not None:
+                # Q1/trung vị/Q3 chính xác từ histogram dựng sẵn thay vì melt() dữ liệu mẫu
+                fig_box = cached_figure(
+                    "boxplot_cube",
+                    _fingerprint(histogram_cube, ["so_luong"]),
+                    {"years": years_key, "provinces": provinces_key},
+                    lambda: create_boxplot_from_cube(
+                        histogram_cube,
+                        years=st.session_state["selected_years"],
+                        provinces=selected_provinces,
+                    ),
+                )
+            else:
+                fig_box = cached_figure(
+                    "boxplot",
+                    _fingerprint(plot_df, DEFAULT_SUBJECT_ORDER),
+                    {},
+                    lambda: create_boxplot_all_subjects(plot_df),
+                )
+            if fig_box is not None:
+                _plotly_chart(fig_box)
+            else:
+                st.info("Không đủ dữ liệu các môn để vẽ biểu đồ.")
 
     # Tab 3: Theo tỉnh/thành
     with tab3:
-        st.subheader(f"Điểm trung bình môn {subject_label} theo tỉnh/thành")
-        fig_bar = create_bar_mean_by_province(
-            stats_df=stats_df,
-            subject=selected_subject,
-            years=st.session_state["selected_years"],
-        )
-        if fig_bar is not None:
-            st.plotly_chart(fig_bar, use_container_width=True)
-        else:
-            st.info("Không có dữ liệu thống kê theo tỉnh/thành cho môn được chọn.")
+        if tab3.open:
+            st.subheader(f"Điểm trung bình môn {subject_label} theo tỉnh/thành")
+            fig_bar = cached_figure(
+                "bar_province",
+                _fingerprint(stats_df, ["count", "mean"]),
+                {"subject": selected_subject, "years": years_key},
+                lambda: create_bar_mean_by_province(
+                    stats_df=stats_df,
+                    subject=selected_subject,
+                    years=st.session_state["selected_years"],
+                ),
+            )
+            if fig_bar is not None:
+                _plotly_chart(fig_bar)
+            else:
+                st.info("Không có dữ liệu thống kê theo tỉnh/thành cho môn được chọn.")
 
     # Tab 4: Tổ hợp xét tuyển
     with tab4:
-        st.subheader(f"Biểu đồ điểm tổ hợp {selected_combination}")
-        fig_scatter = create_scatter_for_combination(plot_df, selected_combination)
-        if fig_scatter is not None:
-            st.plotly_chart(fig_scatter, use_container_width=True)
-        else:
-            st.info("Không đủ môn thành phần hoặc không đủ dữ liệu để vẽ biểu đồ tổ hợp.")
+        if tab4.open:
+            st.subheader(f"Biểu đồ điểm tổ hợp {selected_combination}")
+            if density_mode:
+                # Chỉ gửi số thí sinh theo ô lưới điểm nên dùng được toàn bộ dữ liệu đã lọc
+                fig_scatter = cached_figure(
+                    "density_combination",
+                    _fingerprint(filtered_df, COMBINATIONS.get(selected_combination, [])),
+                    {"combination": selected_combination},
+                    lambda: create_density_for_combination(filtered_df, selected_combination),
+                )
+            else:
+                fig_scatter = cached_figure(
+                    "scatter_combination",
+                    _fingerprint(plot_df, COMBINATIONS.get(selected_combination, [])),
+                    {"combination": selected_combination},
+                    lambda: create_scatter_for_combination(plot_df, selected_combination),
+                )
+            if fig_scatter is not None:
+                _plotly_chart(fig_scatter)
+            else:
+                st.info("Không đủ môn thành phần hoặc không đủ dữ liệu để vẽ biểu đồ tổ hợp.")
 
     # Tab 5: Phân cụm KMeans
     with tab5:
-        st.subheader("Phân cụm KMeans theo tổ hợp đang chọn")
+        if tab5.open:
+            st.subheader("Phân cụm KMeans theo tổ hợp đang chọn")
 
-        subjects = COMBINATIONS.get(selected_combination, [])
-        exist_subjects = [s for s in subjects if s in filtered_df.columns]
+            subjects = COMBINATIONS.get(selected_combination, [])
+            exist_subjects = [s for s in subjects if s in filtered_df.columns]
 
-        if len(exist_subjects) < 2:
-            st.info("Cần ít nhất hai môn trong tổ hợp để phân cụm.")
-        else:
-            n_clusters = st.number_input("Số cụm", min_value=2, max_value=10, value=4, step=1)
-            sample_size = st.number_input(
-                "Số mẫu tối đa để phân cụm", min_value=1000, max_value=200000, value=50000, step=1000
-            )
-
-            try:
-                clustered_df, centers_df = kmeans_cluster(
-                    plot_df,
-                    subjects=exist_subjects,
-                    n_clusters=int(n_clusters),
-                    sample_size=int(sample_size),
+            if len(exist_subjects) < 2:
+                st.info("Cần ít nhất hai môn trong tổ hợp để phân cụm.")
+            else:
+                n_clusters = st.number_input(
+                    "Số cụm", min_value=2, max_value=10, step=1, key=_kept_widget_key("so_cum", 4)
+                )
+                engine = st.radio(
+                    "Thuật toán",
+                    options=list(CLUSTERING_ENGINES),
+                    format_func=lambda x: {
+                        "kmeans": "KMeans đầy đủ (trên mẫu)",
+                        "minibatch": "MiniBatch KMeans (toàn bộ, cập nhật dần)",
+                        "dedup": "KMeans gộp điểm trùng (toàn bộ, chính xác)",
+                    }.get(x, x),
+                    horizontal=True,
+                    key=_kept_widget_key("thuat_toan_phan_cum", CLUSTERING_ENGINES[0]),
                 )
-                fig_c = create_scatter_clusters(clustered_df, exist_subjects, cluster_col="cum")
-                if fig_c is not None:
-                    st.plotly_chart(fig_c, use_container_width=True)
-
-                counts = clustered_df["cum"].value_counts().sort_index()
-                st.write("Số lượng trong từng cụm:")
-                st.table(pd.DataFrame({"Cụm": counts.index, "Số thí sinh": counts.values}))
-
-                st.write("Tọa độ tâm cụm (theo thang điểm gốc):")
-                show_centers = centers_df.rename(columns={c: SUBJECT_LABELS.get(c, c) for c in centers_df.columns})
-                st.table(show_centers)
-            except Exception as e:
-                st.warning(f"Không thể phân cụm: {e}")
+                if engine == "kmeans":
+                    sample_size = st.number_input(
+                        "Số mẫu tối đa để phân cụm",
+                        min_value=1000,
+                        max_value=200000,
+                        step=1000,
+                        key=_kept_widget_key("so_mau_phan_cum", 50000),
+                    )
+                    predict_all = st.checkbox(
+                        "Gán nhãn cho toàn bộ thí sinh đã lọc",
+                        key=_kept_widget_key("gan_nhan_toan_bo", False),
+                        help="Học tâm cụm trên mẫu rồi gán nhãn cho mọi thí sinh, số lượng mỗi cụm là chính xác.",
+                    )
+                else:
+                    sample_size = None
+                    predict_all = False
+
+                fig_slot = st.empty()
+                counts_slot = st.empty()
+                centers_slot = st.empty()
+
+                def _show_clusters(clustered_df: pd.DataFrame, centers_df: pd.DataFrame) -> None:
+                    with stage("figure:clusters", rows_in=len(clustered_df)):
+                        if density_mode:
+                            fig_c = create_density_clusters(clustered_df, exist_subjects, cluster_col="cum")
+                        else:
+                            # Vẽ trên mẫu để không gửi hàng triệu điểm xuống trình duyệt
+                            fig_c = create_scatter_clusters(
+                                sample_for_plotting(clustered_df), exist_subjects, cluster_col="cum"
+                            )
+                    if fig_c is not None:
+                        _plotly_chart(fig_c, target=fig_slot)
+
+                    counts = clustered_df["cum"].value_counts().sort_index()
+                    with counts_slot.container():
+                        st.write("Số lượng trong từng cụm:")
+                        st.table(pd.DataFrame({"Cụm": counts.index, "Số thí sinh": counts.values}))
+
+                    with centers_slot.container():
+                        st.write("Tọa độ tâm cụm (theo thang điểm gốc):")
+                        show_centers = centers_df.rename(columns={c: SUBJECT_LABELS.get(c, c) for c in centers_df.columns})
+                        st.table(show_centers)
+
+                try:
+                    cluster_cache = get_cluster_cache()
+                    if engine == "minibatch":
+                        # Khởi động ấm từ tâm cụm lần trước cùng tổ hợp môn và số cụm
+                        warm_key = (tuple(exist_subjects), int(n_clusters))
+                        warm_centers = st.session_state.setdefault("kmeans_centers", {})
+                        cache_key = clustering_key_for(
+                            filtered_df, exist_subjects, int(n_clusters), None, 42, engine
+                        )
+                        result = cluster_cache.get(cache_key)
+                        if result is None:
+                            # Các bước vẽ lại sau mỗi epoch được ghi lồng trong bước "cluster"
+                            with stage("cluster", rows_in=len(filtered_df)):
+                                for result, _ in iter_minibatch_results(
+                                    filtered_df,
+                                    subjects=exist_subjects,
+                                    n_clusters=int(n_clusters),
+                                    init_centers=warm_centers.get(warm_key),
+                                ):
+                                    _show_clusters(clustered_frame(filtered_df, result), result.centers)
+                            cluster_cache.put(cache_key, result)
+                        else:
+                            _show_clusters(clustered_frame(filtered_df, result), result.centers)
+                        warm_centers[warm_key] = result.centers
+                    else:
+                        # "kmeans": học tâm cụm trên mẫu, nếu chọn thì gán nhãn cho toàn bộ thí sinh đã lọc;
+                        # "dedup": phân cụm toàn bộ thí sinh đã lọc qua các bộ điểm duy nhất
+                        use_full = engine == "dedup" or predict_all
+                        cluster_input = filtered_df if use_full else plot_df
+                        with stage("cluster", rows_in=len(cluster_input)) as timer:
+                            clustered_df, centers_df = cached_kmeans_cluster(
+                                cluster_input,
+                                subjects=exist_subjects,
+                                cache=cluster_cache,
+                                n_clusters=int(n_clusters),
+                                sample_size=None if sample_size is None else int(sample_size),
+                                engine=engine,
+                                predict_all=predict_all,
+                            )
+                            timer.rows_out = len(clustered_df)
+                        _show_clusters(clustered_df, centers_df)
+                except Exception as e:
+                    st.warning(f"Không thể phân cụm: {e}")
+
+    # Tab 6: Ngưỡng điểm / phân vị điểm tổ hợp, tra từ bảng phân phối dựng sẵn
+    with tab6:
+        if tab6.open:
+            st.subheader(f"Ngưỡng điểm và phân vị tổ hợp {selected_combination}")
+            lookup = get_combination_lookup()
+            if lookup is None:
+                st.info("Chưa có bảng phân phối điểm tổ hợp. Hãy chạy lại ETL.")
+            else:
+                years_sel = st.session_state["selected_years"]
+                total = lookup.total(selected_combination, years_sel, selected_provinces)
+                if total == 0:
+                    st.info("Không có thí sinh nào có đủ điểm tổ hợp này trong bộ lọc hiện tại.")
+                else:
+                    col_a, col_b = st.columns(2)
+                    threshold = col_a.number_input(
+                        "Ngưỡng điểm tổ hợp",
+                        min_value=0.0,
+                        max_value=30.0,
+                        step=0.05,
+                        format="%.2f",
+                        key=_kept_widget_key("nguong_diem_to_hop", 24.0),
+                    )
+                    top_percent = col_b.number_input(
+                        "Nhóm điểm cao nhất (%)",
+                        min_value=0.1,
+                        max_value=100.0,
+                        step=0.5,
+                        key=_kept_widget_key("top_phan_tram", 10.0),
+                    )
+
+                    n_at_least = lookup.count_at_least(selected_combination, threshold, years_sel, selected_provinces)
+                    m1, m2, m3, m4 = st.columns(4)
+                    m1.metric("Số thí sinh có điểm tổ hợp", f"{total:,}")
+                    m2.metric(f"Đạt từ {threshold:.2f} trở lên", f"{n_at_least:,}")
+                    m3.metric(
+                        "Phân vị của ngưỡng",
+                        format_stat_value(lookup.percentile_rank(selected_combination, threshold, years_sel, selected_provinces)),
+                    )
+                    m4.metric(
+                        f"Điểm để vào top {top_percent:g}%",
+                        format_stat_value(lookup.score_for_top(selected_combination, top_percent, years_sel, selected_provinces)),
+                    )
+
+                    with stage("figure:at_least_curve"):
+                        dist = lookup.merged_distribution(selected_combination, years_sel, selected_provinces)
+                        fig_cdf = create_at_least_curve(dist, selected_combination, threshold)
+                    _plotly_chart(fig_cdf)
 
 
 if __name__ == "__main__":